@@ -77,6 +77,72 @@ interface HolocraftJson {
     title: string;
     duration: string;
   }[];
+  /**
+   * Mapping of Stream video ID -> Video IDs of clips sourced from that stream
+   */
+  streamClips?: { [videoId: string]: string[] };
+  /**
+   * Streams bucketed by UTC year -> month -> day. Buckets cover craftStreams from
+   * start up to, but not including, start + count. Days are [start, count].
+   */
+  dateBuckets?: {
+    [year: string]: {
+      start: number;
+      count: number;
+      months: {
+        [month: string]: {
+          start: number;
+          count: number;
+          days: { [day: string]: [number, number] };
+        };
+      };
+    };
+  };
+  /**
+   * Mapping of Member -> Indexes into craftStreams of that member's streams, in order
+   */
+  memberStreams?: { [member: string]: number[] };
+}
+
+/**
+ * Splits the updater's UTC days at local midnight, giving runs of streams which are each
+ * published on one local day
+ */
+function* localDayRuns(
+  inOrder: HolocraftStream[],
+  dateBuckets: NonNullable<HolocraftJson["dateBuckets"]>
+): Generator<[dayjs.Dayjs, HolocraftStream[]]> {
+  const days = Object.values(dateBuckets)
+    .flatMap((year) => Object.values(year.months))
+    .flatMap((month) => Object.values(month.days))
+    .sort(([startA], [startB]) => startA - startB);
+  for (const [start, count] of days) {
+    const end = start + count;
+    let runStart = start;
+    while (runStart < end) {
+      const nextDay = inOrder[runStart].publishedAt
+        .startOf("date")
+        .add(1, "day");
+      // Most UTC days fall on one local day, so only search for where this one ends
+      // when it doesn't
+      let runEnd = end;
+      if (!inOrder[end - 1].publishedAt.isBefore(nextDay)) {
+        let low = runStart + 1;
+        let high = end - 1;
+        while (low < high) {
+          const middle = Math.floor((low + high) / 2);
+          if (inOrder[middle].publishedAt.isBefore(nextDay)) {
+            low = middle + 1;
+          } else {
+            high = middle;
+          }
+        }
+        runEnd = low;
+      }
+      yield [inOrder[runStart].publishedAt, inOrder.slice(runStart, runEnd)];
+      runStart = runEnd;
+    }
+  }
 }
 
 export const holocraftData = readable<HolocraftData>(
@@ -128,28 +194,57 @@ export const holocraftData = readable<HolocraftData>(
         );
 
         // Associate clips to streams
-        for (const clip of Object.values(clips)) {
-          for (const sourceStream of clip.sourceStreams) {
-            sourceStream.clips.push(clip);
+        if (responseJson.streamClips !== undefined) {
+          // The updater precomputes this mapping, so there's no join to do
+          for (const [streamId, clipIds] of Object.entries(
+            responseJson.streamClips
+          )) {
+            byId[streamId].clips = clipIds.map((clipId) => clips[clipId]);
+          }
+        } else {
+          // Data emitted before the mapping was added
+          for (const clip of Object.values(clips)) {
+            for (const sourceStream of clip.sourceStreams) {
+              sourceStream.clips.push(clip);
+            }
           }
         }
 
-        const byMember = inOrder.reduce(
-          (accumulator, stream) => ({
-            ...accumulator,
-            ...(stream.member in accumulator
-              ? {
-                  [stream.member]: [...accumulator[stream.member], stream],
-                }
-              : { [stream.member]: [stream] }),
-          }),
-          {} as { [member: string]: HolocraftStream[] }
-        );
+        const memberStreams = responseJson.memberStreams;
+        const byMember =
+          memberStreams !== undefined
+            ? // Precomputed by the updater
+              Object.fromEntries(
+                Object.entries(memberStreams).map(([member, indexes]) => [
+                  member,
+                  indexes.map((index) => inOrder[index]),
+                ])
+              )
+            : inOrder.reduce(
+                (accumulator, stream) => ({
+                  ...accumulator,
+                  ...(stream.member in accumulator
+                    ? {
+                        [stream.member]: [...accumulator[stream.member], stream],
+                      }
+                    : { [stream.member]: [stream] }),
+                }),
+                {} as { [member: string]: HolocraftStream[] }
+              );
 
-        const byDate = new DateTree(
-          inOrder.map((clip) => [clip.publishedAt, clip]),
-          ["year", "month", "date"] as const
-        );
+        const dateBuckets = responseJson.dateBuckets;
+        const byDate =
+          dateBuckets !== undefined
+            ? // Bucketed by the updater, so only each day's runs need placing
+              DateTree.fromRuns(localDayRuns(inOrder, dateBuckets), [
+                "year",
+                "month",
+                "date",
+              ] as const)
+            : new DateTree(
+                inOrder.map((clip) => [clip.publishedAt, clip]),
+                ["year", "month", "date"] as const
+              );
 
         const endTime = performance.now();
         console.log(`Computed stats in ${endTime - startTime} ms`);
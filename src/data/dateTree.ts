@@ -90,6 +90,70 @@ export class DateTree<TValue, TGranularities extends readonly Granularity[]> {
     }
   }
 
+  /**
+   * Builds a tree from runs of entries instead of single entries. Only the date of each run
+   * is looked at, so this is much cheaper than partitioning every entry.
+   */
+  public static fromRuns<
+    TValue,
+    TGranularities extends readonly Granularity[]
+  >(
+    /**
+     * Expected to be sorted by date, with each run falling within one bucket of the
+     * lowest granularity
+     */
+    runs: Iterable<[dayjs.Dayjs, TValue[]]>,
+    granularities: TGranularities
+  ): DateTree<TValue, TGranularities> {
+    const [granularity, ...childGranularities] = granularities;
+
+    // Consecutive runs in the same bucket are grouped together
+    const partitions: [dayjs.Dayjs, [dayjs.Dayjs, TValue[]][]][] = [];
+    let total = 0;
+    for (const [date, values] of runs) {
+      total += values.length;
+      const bucket = date.startOf(granularity);
+      const last = partitions[partitions.length - 1];
+      if (last !== undefined && last[0].isSame(bucket)) {
+        last[1].push([date, values]);
+      } else {
+        partitions.push([bucket, [[date, values]]]);
+      }
+    }
+
+    const isBottom = childGranularities.length === 0;
+    return DateTree.withChildren<TValue, TGranularities>(
+      partitions.map(([bucket, bucketRuns]) => [
+        bucket,
+        isBottom
+          ? bucketRuns.flatMap(([_, values]) => values)
+          : DateTree.fromRuns(bucketRuns, childGranularities),
+      ]),
+      granularities,
+      total
+    );
+  }
+
+  private static withChildren<
+    TValue,
+    TGranularities extends readonly Granularity[]
+  >(
+    children: [dayjs.Dayjs, any][],
+    granularities: TGranularities,
+    totalEntries: number
+  ): DateTree<TValue, TGranularities> {
+    // Skips the constructor, which would partition the entries all over again
+    const tree: DateTree<TValue, TGranularities> = Object.create(
+      DateTree.prototype
+    );
+    tree._granularities = granularities;
+    tree._granularity = granularities[0];
+    tree._isBottom = granularities.length === 1;
+    tree._totalEntriesInTree = totalEntries;
+    tree.children = new DateMap(children, granularities[0]);
+    return tree;
+  }
+
   public flatten(): TValue[] {
     if (this.isBottom()) {
       return Array.from(this.children.values()).flat();
@@ -103,25 +167,51 @@ export class DateTree<TValue, TGranularities extends readonly Granularity[]> {
     );
   }
 
+  /**
+   * Keeps the buckets as they are, dropping the ones left empty
+   */
   public prune(
-    leafCondition: (v: TValue) => boolean,
-    extractDate: (v: TValue) => dayjs.Dayjs
-  ) {
-    return new DateTree(
-      this.flatten()
-        .filter(leafCondition)
-        .map((value) => [extractDate(value), value]),
-      this._granularities
+    leafCondition: (v: TValue) => boolean
+  ): DateTree<TValue, TGranularities> {
+    const children: [dayjs.Dayjs, any][] = [];
+    let total = 0;
+    for (const [bucket, child] of this.children.entries()) {
+      const pruned = this.isBottom()
+        ? ((child as any) as TValue[]).filter(leafCondition)
+        : ((child as any) as DateTree<TValue, Granularity[]>).prune(
+            leafCondition
+          );
+      const entries = Array.isArray(pruned)
+        ? pruned.length
+        : pruned.totalEntries();
+      if (entries > 0) {
+        children.push([bucket, pruned]);
+        total += entries;
+      }
+    }
+
+    return DateTree.withChildren<TValue, TGranularities>(
+      children,
+      this._granularities,
+      total
     );
   }
 
-  public invert(doInvert: boolean, extractDate: (v: TValue) => dayjs.Dayjs) {
+  public invert(doInvert: boolean): DateTree<TValue, TGranularities> {
     if (doInvert) {
-      return new DateTree(
-        this.flatten()
+      return DateTree.withChildren<TValue, TGranularities>(
+        this.entries()
           .reverse()
-          .map((value) => [extractDate(value), value]),
-        this._granularities
+          .map(([bucket, child]) => [
+            bucket,
+            this.isBottom()
+              ? [...((child as any) as TValue[])].reverse()
+              : ((child as any) as DateTree<TValue, Granularity[]>).invert(
+                  true
+                ),
+          ]),
+        this._granularities,
+        this._totalEntriesInTree
       );
     }
 
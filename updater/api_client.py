@@ -0,0 +1,99 @@
+# Builds the YouTube Data API client from a discovery document kept in the repo.
+#
+# googleapiclient.discovery.build looks the document up by name, and falls back to fetching
+# it if the installed googleapiclient doesn't ship one. Building from our own trimmed copy
+# never touches the network and only parses the methods we call.
+#
+# Usage, to refresh the copy from the installed googleapiclient:
+#   python -m updater.api_client
+
+import argparse
+import json
+import os
+from typing import TYPE_CHECKING, Any, Dict, Iterator
+
+from updater.checkpoint import write_json_atomically
+
+if TYPE_CHECKING:
+    import googleapiclient.discovery as api  # type: ignore
+
+DISCOVERY_DOCUMENT_PATH = os.path.join(
+    os.path.dirname(__file__), "discovery", "youtube.v3.json"
+)
+# Resource -> Methods, for every API method the updater calls
+USED_METHODS = {
+    "channels": ["list"],
+    "playlistItems": ["list"],
+    "videos": ["list"],
+}
+
+
+def build_youtube(api_key: str) -> "api.Resource":
+    from googleapiclient.discovery import build_from_document  # type: ignore
+
+    with open(DISCOVERY_DOCUMENT_PATH, "r") as document_file:
+        document = document_file.read()
+    return build_from_document(document, developerKey=api_key)
+
+
+def _schema_refs(value: Any) -> Iterator[str]:
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "$ref":
+                yield item
+            else:
+                yield from _schema_refs(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _schema_refs(item)
+
+
+def trimmed_discovery_document(document: Dict[str, Any]) -> Dict[str, Any]:
+    """The discovery document with only USED_METHODS and the schemas they refer to."""
+    resources = {
+        resource: {
+            "methods": {
+                method: document["resources"][resource]["methods"][method]
+                for method in methods
+            }
+        }
+        for resource, methods in USED_METHODS.items()
+    }
+    schemas: Dict[str, Any] = {}
+    pending = list(_schema_refs(resources))
+    while len(pending) > 0:
+        name = pending.pop()
+        if name not in schemas:
+            schemas[name] = document["schemas"][name]
+            pending.extend(_schema_refs(schemas[name]))
+    return {
+        **document,
+        "resources": resources,
+        "schemas": dict(sorted(schemas.items())),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Refresh the trimmed YouTube Data API discovery document"
+    )
+    parser.add_argument(
+        "--source",
+        help="Full discovery document to trim, instead of googleapiclient's copy",
+    )
+    args = parser.parse_args()
+
+    if args.source is not None:
+        with open(args.source, "r") as source_file:
+            document = json.load(source_file)
+    else:
+        from googleapiclient.discovery_cache import get_static_doc  # type: ignore
+
+        document = json.loads(get_static_doc("youtube", "v3"))
+    os.makedirs(os.path.dirname(DISCOVERY_DOCUMENT_PATH), exist_ok=True)
+    write_json_atomically(DISCOVERY_DOCUMENT_PATH, trimmed_discovery_document(document))
+    print(f"Wrote {DISCOVERY_DOCUMENT_PATH} from revision {document['revision']}")
+
+
+if __name__ == "__main__":
+    main()
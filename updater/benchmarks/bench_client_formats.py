@@ -0,0 +1,156 @@
+# Size and parse time of the client data in its JSON record format and its columnar format.
+#
+# Parse time covers decoding the JSON and turning it into per-stream and per-clip records
+# with durations in seconds, which is the work the client does before rendering.
+#
+# Usage: python -m updater.benchmarks.bench_client_formats [--client-data PATH]
+
+import argparse
+import gzip
+import json
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict
+
+from updater.holocraft_data import (
+    ClientHolocraftClip,
+    ClientHolocraftStream,
+    ClientMemberInfo,
+    HolocraftClientData,
+    duration_seconds,
+)
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+
+def load_client_data(path: str) -> HolocraftClientData:
+    raw = json.load(open(path, "r"))
+    return HolocraftClientData(
+        members={
+            member_id: ClientMemberInfo(
+                member["channelId"], member["name"], member["channelImageUrl"]
+            )
+            for member_id, member in raw["members"].items()
+        },
+        craft_streams=[
+            ClientHolocraftStream(
+                member=stream["member"],
+                published_at=datetime.fromisoformat(stream["publishedAt"]),
+                title=stream["title"],
+                duration=stream["duration"],
+                video_id=stream["videoId"],
+            )
+            for stream in raw["craftStreams"]
+        ],
+        craft_clips=[
+            ClientHolocraftClip(
+                source_streams=clip["sourceStreams"],
+                title=clip["title"],
+                duration=clip["duration"],
+                video_id=clip["videoId"],
+            )
+            for clip in raw["craftClips"]
+        ],
+    )
+
+
+def parse_records(content: bytes):
+    raw = json.loads(content)
+    streams = {
+        stream["videoId"]: (
+            stream["member"],
+            datetime.fromisoformat(stream["publishedAt"]).timestamp(),
+            stream["title"],
+            duration_seconds(stream["duration"]),
+        )
+        for stream in raw["craftStreams"]
+    }
+    clips = {
+        clip["videoId"]: (
+            [streams[stream_id] for stream_id in clip["sourceStreams"]],
+            clip["title"],
+            duration_seconds(clip["duration"]),
+        )
+        for clip in raw["craftClips"]
+    }
+    return streams, clips
+
+
+def parse_columnar(content: bytes):
+    raw = json.loads(content)
+    member_ids = raw["memberIds"]
+    columns = raw["streams"]
+    stream_records = list(
+        zip(
+            [member_ids[member] for member in columns["member"]],
+            columns["publishedAt"],
+            columns["title"],
+            columns["duration"],
+        )
+    )
+    streams = dict(zip(columns["videoId"], stream_records))
+    columns = raw["clips"]
+    clips = {
+        video_id: (
+            [stream_records[index] for index in source_streams],
+            title,
+            duration,
+        )
+        for video_id, source_streams, title, duration in zip(
+            columns["videoId"],
+            columns["sourceStreams"],
+            columns["title"],
+            columns["duration"],
+        )
+    }
+    return streams, clips
+
+
+def best_of(repeat: int, action: Callable[[], object]):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        action()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def sizes(content: bytes) -> Dict[str, Any]:
+    return {
+        "raw": len(content),
+        "gzip": len(gzip.compress(content, compresslevel=9)),
+        "brotli": len(brotli.compress(content, quality=11)) if brotli else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare client data formats")
+    parser.add_argument("--client-data", default="docs/holocraft.json")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    client_data = load_client_data(args.client_data)
+    records = json.dumps(client_data.to_dict(), indent=2).encode()
+    columnar = json.dumps(
+        client_data.to_columnar(), separators=(",", ":"), ensure_ascii=False
+    ).encode()
+
+    print(f"{'format':>10} {'raw':>10} {'gzip':>10} {'brotli':>10} {'parse':>10}")
+    for name, content, parse in [
+        ("records", records, parse_records),
+        ("columnar", columnar, parse_columnar),
+    ]:
+        size = sizes(content)
+        parse_time = best_of(args.repeat, lambda: parse(content))
+        brotli_size = "n/a" if size["brotli"] is None else f"{size['brotli']:,}"
+        print(
+            f"{name:>10} {size['raw']:>10,} {size['gzip']:>10,} {brotli_size:>10} "
+            f"{parse_time * 1000:>8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
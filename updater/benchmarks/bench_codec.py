@@ -0,0 +1,169 @@
+# Load and save timings of the sync data, comparing dataclasses_json with updater.codec,
+# sorted lists of seen video IDs with their compact packed form, and loading everything
+# with loading only the sections client data is made from.
+#
+# Uses an existing sync file if given, otherwise builds a realistically sized one from the
+# published client data in docs/holocraft.json.
+#
+# Usage: python -m updater.benchmarks.bench_codec [--sync-file PATH] [--repeat N]
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable
+
+from updater.checkpoint import indented_json
+from updater.codec import (
+    dumps_holocraft_data,
+    holocraft_data_to_dict,
+    loads_holocraft_data,
+)
+from updater.fake_youtube import fake_id
+from updater.holocraft_data import (
+    HolocraftClip,
+    HolocraftData,
+    HolocraftStream,
+    MemberInfo,
+)
+from updater.seen_ids import PackedIdSet
+from updater.sync_sections import CLIENT_DATA_SECTIONS, load_sections
+
+
+def sample_data(client_data_path: str, uploads_per_channel: int) -> HolocraftData:
+    client_data = json.load(open(client_data_path, "r"))
+    members = {
+        member_name: MemberInfo(
+            member["channelId"], member["name"], member["channelImageUrl"]
+        )
+        for member_name, member in client_data["members"].items()
+    }
+    clippers = [f"UC{fake_id('clipper', i)}{fake_id('tail', i)}" for i in range(30)]
+    data = HolocraftData(
+        members=members,
+        clippers=clippers,
+        upload_playlists={
+            channel_id: f"UU{channel_id[2:]}"
+            for channel_id in [member.channel_id for member in members.values()]
+            + clippers
+        },
+        craft_streams={
+            stream["videoId"]: HolocraftStream(
+                member=stream["member"],
+                published_at=datetime.fromisoformat(stream["publishedAt"]),
+                title=stream["title"],
+                duration=stream["duration"],
+            )
+            for stream in client_data["craftStreams"]
+        },
+        craft_clips={
+            clip["videoId"]: HolocraftClip(
+                source_streams=clip["sourceStreams"],
+                title=clip["title"],
+                duration=clip["duration"],
+            )
+            for clip in client_data["craftClips"]
+        },
+    )
+    # Every channel has seen far more videos than made it into the timeline
+    randomness = random.Random(0)
+    for channel_id in data.upload_playlists:
+        data.seen_videos[channel_id] = PackedIdSet(
+            fake_id(channel_id, randomness.random()) for _ in range(uploads_per_channel)
+        )
+    for video_id, stream in data.craft_streams.items():
+        data.seen_videos[members[stream.member].channel_id].add(video_id)
+    return data
+
+
+def best_of(repeat: int, action: Callable[[], object]):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        action()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sync data codec")
+    parser.add_argument("--sync-file", help="Existing sync file to load and save")
+    parser.add_argument("--client-data", default="docs/holocraft.json")
+    parser.add_argument("--uploads", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.sync_file is not None:
+        text = open(args.sync_file, "r").read()
+    else:
+        text = indented_json(sample_data(args.client_data, args.uploads).to_dict())
+    print(f"Sync data is {len(text) / 1_000_000:.1f} MB")
+
+    data = HolocraftData.from_json(text)
+    if loads_holocraft_data(text) != data:
+        raise SystemExit("codec load doesn't match HolocraftData.from_json")
+    if dumps_holocraft_data(holocraft_data_to_dict(data)) != text:
+        raise SystemExit("codec save isn't byte-identical to the current output")
+
+    results = [
+        ("load, dataclasses_json", best_of(args.repeat, lambda: data.from_json(text))),
+        ("load, codec", best_of(args.repeat, lambda: loads_holocraft_data(text))),
+        (
+            "save, dataclasses_json",
+            best_of(args.repeat, lambda: indented_json(data.to_dict())),
+        ),
+        (
+            "save, codec",
+            best_of(
+                args.repeat,
+                lambda: dumps_holocraft_data(holocraft_data_to_dict(data)),
+            ),
+        ),
+    ]
+    compact_text = dumps_holocraft_data(holocraft_data_to_dict(data, True))
+    if loads_holocraft_data(compact_text) != data:
+        raise SystemExit("compact seen videos don't round trip")
+    print(
+        f"With compact seen videos, sync data is {len(compact_text) / 1_000_000:.1f} MB"
+    )
+    results += [
+        (
+            "load, codec, compact",
+            best_of(args.repeat, lambda: loads_holocraft_data(compact_text)),
+        ),
+        (
+            "save, codec, compact",
+            best_of(
+                args.repeat,
+                lambda: dumps_holocraft_data(holocraft_data_to_dict(data, True)),
+            ),
+        ),
+    ]
+    # Loading only what emitting client data needs skips seen videos altogether
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as sync_file:
+        sync_file.write(text)
+    try:
+        if load_sections(sync_file.name, CLIENT_DATA_SECTIONS).craft_streams != (
+            data.craft_streams
+        ):
+            raise SystemExit("section loader doesn't match the full load")
+        results.append(
+            (
+                "load, client sections",
+                best_of(
+                    args.repeat,
+                    lambda: load_sections(sync_file.name, CLIENT_DATA_SECTIONS),
+                ),
+            )
+        )
+    finally:
+        os.remove(sync_file.name)
+    for name, seconds in results:
+        print(f"{name:>24}: {seconds * 1000:9.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Startup time of the updater's entry points, each measured in a fresh interpreter.
+#
+# The offline entry points only read and write local files. The online ones also build the
+# YouTube Data API client, either from the trimmed discovery document in the repo or from
+# googleapiclient's own copy of the full document.
+#
+# Usage: python -m updater.benchmarks.bench_startup [--repeat N]
+
+import argparse
+import subprocess
+import sys
+import time
+
+ENTRY_POINTS = [
+    ("interpreter", "pass"),
+    (
+        "offline, regenerate_client_json",
+        "import updater.migrations.regenerate_client_json",
+    ),
+    ("offline, regenerate_sync_json", "import updater.migrations.regenerate_sync_json"),
+    (
+        "online, trimmed discovery",
+        "import updater.update_holocraft\n"
+        "from updater.api_client import build_youtube\n"
+        "build_youtube('key')",
+    ),
+    (
+        "online, googleapiclient build",
+        "import updater.update_holocraft\n"
+        "import googleapiclient.discovery\n"
+        "googleapiclient.discovery.build('youtube', 'v3', developerKey='key')",
+    ),
+]
+
+
+def startup_time(code: str, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark updater startup time")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, code in ENTRY_POINTS:
+        seconds = startup_time(code, args.repeat)
+        print(f"{name:>32}: {seconds * 1000:7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
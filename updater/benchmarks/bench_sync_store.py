@@ -0,0 +1,80 @@
+# Load and checkpoint timings of the sync data in the JSON file and in the SQLite database.
+#
+# A checkpoint is timed after a page of new videos is merged, which is what the updater
+# saves after each page it scans. Uses the same realistically sized sync data as
+# bench_codec.
+#
+# Usage: python -m updater.benchmarks.bench_sync_store [--uploads N] [--repeat N]
+
+import argparse
+import os
+import tempfile
+from datetime import datetime, timezone
+
+from updater.benchmarks.bench_codec import best_of, sample_data
+from updater.codec import holocraft_data_to_dict
+from updater.fake_youtube import fake_id
+from updater.holocraft_data import HolocraftData, HolocraftStream
+from updater.sync_store import JsonSyncStore, SqliteSyncStore, SyncStore
+from updater.youtube import PLAYLIST_PAGE_SIZE
+
+
+def merge_page(data: HolocraftData, page: int):
+    # A page of new uploads to the first member's channel, one of which is a craft stream
+    member_name, member = next(iter(data.members.items()))
+    for index in range(PLAYLIST_PAGE_SIZE):
+        video_id = fake_id("bench", page, index)
+        if index == 0:
+            data.add_stream(
+                video_id,
+                HolocraftStream(
+                    member=member_name,
+                    published_at=datetime.now(timezone.utc),
+                    title=f"Minecraft {page}",
+                    duration="PT1H",
+                ),
+            )
+        data.mark_seen(member.channel_id, video_id)
+
+
+def checkpoint_time(store: SyncStore, repeat: int):
+    data = store.load()
+    pages = iter(range(repeat))
+
+    def checkpoint():
+        merge_page(data, next(pages))
+        store.save(data)
+
+    return best_of(repeat, checkpoint)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sync data stores")
+    parser.add_argument("--client-data", default="docs/holocraft.json")
+    parser.add_argument("--uploads", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = sample_data(args.client_data, args.uploads)
+    results = []
+    with tempfile.TemporaryDirectory() as workspace:
+        json_store = JsonSyncStore(os.path.join(workspace, "sync.json"))
+        sqlite_store = SqliteSyncStore(os.path.join(workspace, "sync.sqlite3"))
+        for name, store in [("json", json_store), ("sqlite", sqlite_store)]:
+            results.append(
+                (f"save everything, {name}", best_of(1, lambda: store.save(data)))
+            )
+            if holocraft_data_to_dict(store.load()) != holocraft_data_to_dict(data):
+                raise SystemExit(f"{name} store doesn't load back what it saved")
+            results.append((f"load, {name}", best_of(args.repeat, store.load)))
+            results.append(
+                (f"checkpoint a page, {name}", checkpoint_time(store, args.repeat))
+            )
+            size = os.path.getsize(store.path)
+            print(f"The {name} store is {size / 1_000_000:.1f} MB")
+    for name, seconds in results:
+        print(f"{name:>26}: {seconds * 1000:9.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
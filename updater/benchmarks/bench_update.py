@@ -0,0 +1,78 @@
+# End-to-end timings of the updater against a synthetic YouTube, with no network or API key.
+#
+# Usage: python -m updater.benchmarks.bench_update [--members N] [--uploads N] ...
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from typing import List
+
+from updater import update_holocraft
+from updater.fake_youtube import FakeYouTube
+from updater.metrics import run_metrics
+from updater.youtube import set_transports
+
+
+def timed_update(argv: List[str]):
+    output = io.StringIO()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        update_holocraft.main(["fake-api-key", *argv])
+    return time.perf_counter() - started, run_metrics.quota_units()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Holocraft updater")
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--clippers", type=int, default=10)
+    parser.add_argument("--uploads", type=int, default=1000)
+    parser.add_argument("--new-uploads", type=int, default=2)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Simulated seconds of network latency per request",
+    )
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    print(
+        f"Generating {args.members} member and {args.clippers} clipper channels "
+        f"with {args.uploads} uploads each"
+    )
+    fake = FakeYouTube(
+        num_members=args.members,
+        num_clippers=args.clippers,
+        uploads_per_channel=args.uploads,
+        latency=args.latency,
+    )
+    set_transports(fake.http, fake.watch_adapter)
+
+    original_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as workspace:
+        # The updater works with paths relative to the repository root
+        os.chdir(workspace)
+        try:
+            os.makedirs("updater")
+            os.makedirs("docs")
+            update_holocraft.write_with_schema(fake.holocraft_data().to_dict)
+
+            common_args = ["--workers", str(args.workers)]
+            results = []
+            results.append(("cold rebuild", *timed_update(["--full", *common_args])))
+
+            fake.upload_to_all(args.new_uploads)
+            results.append(("incremental update", *timed_update(common_args)))
+            results.append(("full update", *timed_update(["--full", *common_args])))
+        finally:
+            os.chdir(original_directory)
+
+    for name, seconds, quota in results:
+        print(f"{name:>20}: {seconds:8.3f}s {quota:6d} quota units")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+from timeit import default_timer
+from typing import Any, Callable, Optional, Sequence, Tuple
+
+
+def indented_json(payload: Any) -> str:
+    return json.dumps(payload, indent=2)
+
+
+def write_json_atomically(
+    path: str, payload: Any, dumps: Callable[[Any], str] = indented_json
+):
+    # Write next to the destination and rename over it, so a crash mid-write never
+    # leaves a truncated file behind
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as temp_file:
+        temp_file.write(dumps(payload))
+    os.replace(temp_path, path)
+
+
+class CheckpointError(Exception):
+    pass
+
+
+class CheckpointWriter:
+    """Writes checkpoints of the sync data on a background thread.
+
+    Checkpoints requested while a write is already underway are coalesced into a single
+    follow-up write. Anything that mutates the data must hold `lock`, which the writer only
+    takes while taking its snapshots; JSON encoding and disk I/O happen outside of it.
+
+    Each target is a (snapshot, write) pair. All targets are snapshotted together so they
+    agree with each other, then written in the order given.
+
+    A checkpoint that fails to write is retried with the next one, or when the writer is
+    closed. If the final attempt fails too, closing raises CheckpointError.
+    """
+
+    def __init__(
+        self,
+        targets: Sequence[Tuple[Callable[[], Any], Callable[[Any], None]]],
+    ):
+        self.targets = targets
+        self.lock = threading.RLock()
+        self.requests = 0
+        self.writes = 0
+        # Why the last checkpoint failed, if it did
+        self.error: Optional[Exception] = None
+        # Whether anything changed since the last checkpoint that was written
+        self._dirty = False
+        # Whether a checkpoint was requested since the writer last tried to write one
+        self._requested = False
+        self._closing = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name="checkpoint-writer", daemon=True
+        )
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # We're bailing out, so save whatever made it into the data
+            self.request()
+        self.close()
+
+    def request(self):
+        with self._condition:
+            self.requests += 1
+            self._dirty = True
+            self._requested = True
+            self._condition.notify()
+
+    def close(self):
+        """Flush any pending checkpoint and stop the writer."""
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self._thread.join()
+        if self.error is not None:
+            raise CheckpointError("The last checkpoint couldn't be written") from (
+                self.error
+            )
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._requested and not self._closing:
+                    self._condition.wait()
+                # Requests always leave the data dirty, so only closing gets us here
+                if not self._dirty:
+                    return
+                final = self._closing
+                self._requested = False
+                self._dirty = False
+            try:
+                self._write()
+                self.error = None
+            except Exception as error:
+                print(f"Failed to write a checkpoint: {error!r}")
+                with self._condition:
+                    self.error = error
+                    # Nothing since the last good checkpoint is saved, so try again
+                    self._dirty = True
+                if final:
+                    return
+
+    def _write(self):
+        started = default_timer()
+        with self.lock:
+            payloads = [(snapshot(), write) for snapshot, write in self.targets]
+        # Stops at the first failure, so later targets never get ahead of earlier ones
+        for payload, write in payloads:
+            write(payload)
+        self.writes += 1
+        print(f"Wrote sync metadata in {default_timer() - started} seconds")
@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+# Which check decided a classification
+SIGNAL_TITLE = "title"
+SIGNAL_WATCH_PAGE = "watch_page"
+
+
+@dataclass
+class Classification:
+    """A remembered verdict on whether a video is a Minecraft video."""
+
+    is_minecraft: bool
+    # SIGNAL_TITLE if a title keyword matched, SIGNAL_WATCH_PAGE if we had to fetch the page
+    signal: str
+    # When the verdict was reached, as an ISO 8601 string
+    classified_at: str
+
+
+class ClassificationCache:
+    """On-disk cache of game classifications keyed by video ID.
+
+    Entries older than the TTL are treated as misses so that videos which get their game
+    metadata added after upload are eventually re-checked. When the cache grows past
+    max_entries, the oldest classifications are evicted on save.
+    """
+
+    def __init__(self, path: str, ttl: timedelta, max_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Classification] = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as cache_file:
+            raw_entries = json.load(cache_file)
+        with self._lock:
+            self._entries = {
+                video_id: Classification(**entry)
+                for video_id, entry in raw_entries.items()
+            }
+
+    def _is_fresh(self, entry: Classification, now: datetime):
+        return now - datetime.fromisoformat(entry.classified_at) < self.ttl
+
+    def get(self, video_id: str) -> Optional[Classification]:
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is not None and self._is_fresh(entry, datetime.now(timezone.utc)):
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def put(self, video_id: str, is_minecraft: bool, signal: str):
+        entry = Classification(
+            is_minecraft, signal, datetime.now(timezone.utc).isoformat()
+        )
+        with self._lock:
+            self._entries[video_id] = entry
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def save(self):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            fresh_entries = sorted(
+                (
+                    (video_id, entry)
+                    for video_id, entry in self._entries.items()
+                    if self._is_fresh(entry, now)
+                ),
+                key=lambda item: item[1].classified_at,
+                reverse=True,
+            )[: self.max_entries]
+            self._entries = dict(fresh_entries)
+            serializable = {
+                video_id: asdict(entry) for video_id, entry in self._entries.items()
+            }
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as cache_file:
+            # Sorted by video ID so that daily runs only produce small diffs
+            cache_file.write(json.dumps(serializable, indent=2, sort_keys=True))
+        os.replace(temp_path, self.path)
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from dataclasses_json import DataClassJsonMixin, LetterCase, config
+
+
+@dataclass
+class ClientDataVersion(DataClassJsonMixin):
+    """Identifies the client data that was last emitted, and how it was emitted."""
+
+    dataclass_json_config = config(letter_case=LetterCase.CAMEL)["dataclasses_json"]
+
+    # Fingerprint of the normalized client data
+    fingerprint: str
+    # Fingerprint of the client data that was emitted before this, if it's known
+    previous_fingerprint: Optional[str]
+    # Single file or shard granularity
+    output: str
+    # JSON records or columnar
+    format: str
+
+
+# Keys of the client data which are derived from the others. Clients rebuild them after
+# patching with a delta, so they're left out of the fingerprint.
+DERIVED_CLIENT_DATA_KEYS = ("streamClips", "dateBuckets", "memberStreams")
+
+
+def _normalized(client_data: Dict[str, Any]) -> Dict[str, Any]:
+    # Order doesn't mean anything for clips, and only publish time does for streams
+    return {
+        **{
+            key: value
+            for key, value in client_data.items()
+            if key not in DERIVED_CLIENT_DATA_KEYS
+        },
+        "craftStreams": sorted(
+            client_data["craftStreams"],
+            key=lambda stream: (stream["publishedAt"], stream["videoId"]),
+        ),
+        "craftClips": sorted(
+            client_data["craftClips"], key=lambda clip: clip["videoId"]
+        ),
+        # Which fields are emitted still counts, so adding one triggers a rewrite
+        "keys": sorted(client_data.keys()),
+    }
+
+
+def client_data_fingerprint(client_data: Dict[str, Any]) -> str:
+    """A hash of the client data's content which ignores ordering and formatting.
+
+    Takes the output of HolocraftClientData.to_dict. Only the names of the derived keys
+    are hashed, not their values, so patching with a delta gives the same fingerprint.
+    """
+    normalized = json.dumps(
+        _normalized(client_data),
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def load_client_version(path: str) -> Optional[ClientDataVersion]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as version_file:
+        return ClientDataVersion.from_json(version_file.read())
+
+
+def _upserted_and_removed(
+    previous: List[Dict[str, Any]], current: List[Dict[str, Any]]
+):
+    previous_by_id = {record["videoId"]: record for record in previous}
+    current_ids = {record["videoId"] for record in current}
+    upserted = [
+        record for record in current if previous_by_id.get(record["videoId"]) != record
+    ]
+    removed = sorted(set(previous_by_id.keys()) - current_ids)
+    return upserted, removed
+
+
+def client_data_delta(
+    previous: Dict[str, Any],
+    current: Dict[str, Any],
+    previous_fingerprint: str,
+    fingerprint: str,
+) -> Dict[str, Any]:
+    """The changes that turn one version of the client data into another.
+
+    Both versions are the output of HolocraftClientData.to_dict. New and changed streams
+    and clips are listed in full, removed ones by video ID, and members are only
+    included if they changed. Applying a delta leaves streams out of date order, so
+    clients need to re-sort them after patching, and then rebuild the derived keys
+    (streamClips, dateBuckets and memberStreams) from the patched streams and clips.
+    """
+    upserted_streams, removed_streams = _upserted_and_removed(
+        previous["craftStreams"], current["craftStreams"]
+    )
+    upserted_clips, removed_clips = _upserted_and_removed(
+        previous["craftClips"], current["craftClips"]
+    )
+    delta: Dict[str, Any] = {
+        "from": previous_fingerprint,
+        "to": fingerprint,
+        "upsertedStreams": upserted_streams,
+        "removedStreams": removed_streams,
+        "upsertedClips": upserted_clips,
+        "removedClips": removed_clips,
+    }
+    if previous["members"] != current["members"]:
+        delta["members"] = current["members"]
+    return delta
+
+
+def is_same_emit(
+    version: Optional[ClientDataVersion], fingerprint: str, output: str, format: str
+):
+    return (
+        version is not None
+        and version.fingerprint == fingerprint
+        and version.output == output
+        and version.format == format
+    )
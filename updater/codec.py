@@ -0,0 +1,233 @@
+import json
+from datetime import datetime
+from json.encoder import encode_basestring_ascii
+from typing import Any, Callable, Dict, List
+
+from updater.holocraft_data import (
+    HolocraftClip,
+    HolocraftData,
+    HolocraftStream,
+    MemberInfo,
+)
+from updater.seen_ids import PackedIdSet
+
+# Schema-specialized replacements for HolocraftData.from_json, HolocraftData.to_dict and
+# json.dumps(..., indent=2) on the result. dataclasses_json reflects over every field of
+# every stream and clip, and the standard library only has a C encoder for unindented
+# output, so on a large sync file those dominate everything that isn't network I/O.
+# Everything here must produce exactly what the generic path does.
+
+_INDENT = "  "
+
+
+def loads_holocraft_data(text: str) -> HolocraftData:
+    """Equivalent to HolocraftData.from_json(text)."""
+    return holocraft_data_from_dict(json.loads(text))
+
+
+def stream_from_dict(stream: Dict[str, Any]) -> HolocraftStream:
+    return HolocraftStream(
+        member=stream["member"],
+        published_at=datetime.fromisoformat(stream["published_at"]),
+        title=stream["title"],
+        duration=stream["duration"],
+    )
+
+
+def clip_from_dict(clip: Dict[str, Any]) -> HolocraftClip:
+    return HolocraftClip(
+        source_streams=clip["source_streams"],
+        title=clip["title"],
+        duration=clip["duration"],
+    )
+
+
+def holocraft_data_from_dict(raw: Dict[str, Any]) -> HolocraftData:
+    """Equivalent to HolocraftData.from_dict(raw)."""
+    return HolocraftData(
+        members={
+            member_name: MemberInfo(
+                member.get("channel_id", ""),
+                member.get("name", ""),
+                member.get("channel_image_url", ""),
+            )
+            for member_name, member in raw.get("members", {}).items()
+        },
+        clippers=list(raw.get("clippers", [])),
+        upload_playlists=dict(raw.get("upload_playlists", {})),
+        seen_videos={
+            channel_id: PackedIdSet.from_json(video_ids)
+            for channel_id, video_ids in raw.get("seen_videos", {}).items()
+        },
+        craft_streams={
+            video_id: stream_from_dict(stream)
+            for video_id, stream in raw.get("craft_streams", {}).items()
+        },
+        craft_clips={
+            video_id: clip_from_dict(clip)
+            for video_id, clip in raw.get("craft_clips", {}).items()
+        },
+        incremental_runs=raw.get("incremental_runs", 0),
+    )
+
+
+def holocraft_data_to_dict(
+    data: HolocraftData, compact_seen_videos: bool = False
+) -> Dict[str, Any]:
+    """Equivalent to data.to_dict(), or with compact_seen_videos, the compact encoding
+    of seen video IDs that loads_holocraft_data and HolocraftData.from_json both accept.
+    """
+    return {
+        "members": {
+            member_name: {
+                "channel_id": member.channel_id,
+                "name": member.name,
+                "channel_image_url": member.channel_image_url,
+            }
+            for member_name, member in data.members.items()
+        },
+        "clippers": list(data.clippers),
+        "upload_playlists": dict(data.upload_playlists),
+        "seen_videos": {
+            channel_id: (
+                video_ids.to_compact_json()
+                if compact_seen_videos
+                else sorted(video_ids)
+            )
+            for channel_id, video_ids in data.seen_videos.items()
+        },
+        "craft_streams": {
+            video_id: {
+                "member": stream.member,
+                "published_at": stream.published_at.isoformat(),
+                "title": stream.title,
+                "duration": stream.duration,
+            }
+            for video_id, stream in data.craft_streams.items()
+        },
+        "craft_clips": {
+            video_id: {
+                "source_streams": list(clip.source_streams),
+                "title": clip.title,
+                "duration": clip.duration,
+            }
+            for video_id, clip in data.craft_clips.items()
+        },
+        "incremental_runs": data.incremental_runs,
+    }
+
+
+def _object(items: List[str], depth: int) -> str:
+    # items are already encoded '"key": value' members at depth + 1
+    if len(items) == 0:
+        return "{}"
+    inner = "\n" + _INDENT * (depth + 1)
+    return "{" + inner + ("," + inner).join(items) + "\n" + _INDENT * depth + "}"
+
+
+def _string_list(values: List[str], depth: int) -> str:
+    if len(values) == 0:
+        return "[]"
+    inner = "\n" + _INDENT * (depth + 1)
+    return (
+        "["
+        + inner
+        + ("," + inner).join(map(encode_basestring_ascii, values))
+        + "\n"
+        + _INDENT * depth
+        + "]"
+    )
+
+
+def _flat_object(value: Dict[str, Any], depth: int) -> str:
+    # Objects whose values are all strings
+    return _object(
+        [
+            f"{encode_basestring_ascii(key)}: {encode_basestring_ascii(item)}"
+            for key, item in value.items()
+        ],
+        depth,
+    )
+
+
+def _members(members: Dict[str, Any], depth: int) -> str:
+    return _object(
+        [
+            f"{encode_basestring_ascii(name)}: {_flat_object(member, depth + 1)}"
+            for name, member in members.items()
+        ],
+        depth,
+    )
+
+
+def _strings_and_lists(value: Dict[str, Any], depth: int) -> str:
+    # Objects whose values are strings or lists of strings
+    return _object(
+        [
+            f"{encode_basestring_ascii(key)}: "
+            + (
+                _string_list(item, depth + 1)
+                if isinstance(item, list)
+                else encode_basestring_ascii(item)
+            )
+            for key, item in value.items()
+        ],
+        depth,
+    )
+
+
+def _seen_videos(seen_videos: Dict[str, Any], depth: int) -> str:
+    return _object(
+        [
+            f"{encode_basestring_ascii(channel_id)}: "
+            + (
+                _string_list(ids, depth + 1)
+                if isinstance(ids, list)
+                else _strings_and_lists(ids, depth + 1)
+            )
+            for channel_id, ids in seen_videos.items()
+        ],
+        depth,
+    )
+
+
+def _craft_streams(craft_streams: Dict[str, Any], depth: int) -> str:
+    return _object(
+        [
+            f"{encode_basestring_ascii(video_id)}: {_flat_object(stream, depth + 1)}"
+            for video_id, stream in craft_streams.items()
+        ],
+        depth,
+    )
+
+
+def _craft_clips(craft_clips: Dict[str, Any], depth: int) -> str:
+    return _object(
+        [
+            f"{encode_basestring_ascii(video_id)}: {_strings_and_lists(clip, depth + 1)}"
+            for video_id, clip in craft_clips.items()
+        ],
+        depth,
+    )
+
+
+_SECTION_ENCODERS: Dict[str, Callable[[Any, int], str]] = {
+    "members": _members,
+    "clippers": _string_list,
+    "upload_playlists": _flat_object,
+    "seen_videos": _seen_videos,
+    "craft_streams": _craft_streams,
+    "craft_clips": _craft_clips,
+    "incremental_runs": lambda value, depth: json.dumps(value),
+}
+
+
+def dumps_holocraft_data(payload: Dict[str, Any]) -> str:
+    """Equivalent to json.dumps(payload, indent=2) for the output of holocraft_data_to_dict."""
+    return _object(
+        [
+            f"{encode_basestring_ascii(section)}: {_SECTION_ENCODERS[section](value, 1)}"
+            for section, value in payload.items()
+        ],
+        0,
+    )
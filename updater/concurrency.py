@@ -0,0 +1,46 @@
+import threading
+from contextlib import contextmanager
+
+
+class AdaptiveLimiter:
+    """Caps the number of concurrent API requests, backing off when YouTube pushes back.
+
+    The limit is halved whenever a request is throttled and creeps back up by one after
+    each full window of successful requests, up to the configured maximum.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self.throttle_events = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def on_success(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_limit:
+                self._successes = 0
+                self.limit += 1
+                self._condition.notify_all()
+
+    def on_throttle(self):
+        with self._condition:
+            self.throttle_events += 1
+            self._successes = 0
+            self.limit = max(self.min_limit, self.limit // 2)
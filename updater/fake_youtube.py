@@ -0,0 +1,335 @@
+import base64
+import hashlib
+import json
+import random
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import httplib2  # type: ignore
+import requests.adapters
+
+from updater.holocraft_data import HolocraftData, MemberInfo
+from updater.replay import build_response
+
+# How many of a channel's latest uploads its feed lists, like the real one
+FEED_SIZE = 15
+# Anything before the game metadata on a real watch page: player config, scripts, etc.
+_WATCH_PAGE_PREAMBLE = "<html><head><script>var ytInitialPlayerResponse = {};</script>"
+_WATCH_PAGE_GAME_BLOCK = (
+    '"richMetadataRenderer":{"style":"RICH_METADATA_RENDERER_STYLE_BOX_ART",'
+    '"title":{"simpleText":"Minecraft"}}'
+)
+
+
+@dataclass
+class FakeVideo:
+    id: str
+    channel_id: str
+    title: str
+    description: str
+    duration: str
+    published_at: datetime
+    # Whether the watch page carries the Minecraft game metadata block
+    has_game_block: bool
+
+
+def fake_id(*parts) -> str:
+    """An 11 character base64url ID shaped like a real YouTube video ID."""
+    digest = hashlib.sha256(":".join(map(str, parts)).encode()).digest()
+    return base64.urlsafe_b64encode(digest[:8]).decode()[:11]
+
+
+class FakeYouTube:
+    """Deterministic synthetic stand-in for the YouTube Data API and watch pages.
+
+    Generates member and clipper channels with large upload histories. A fraction of member
+    uploads are Minecraft streams (some only identifiable by their watch page), and clipper
+    uploads link back to member streams in their descriptions. Responses carry ETags and
+    honor If-None-Match, like the real API.
+    """
+
+    def __init__(
+        self,
+        num_members: int = 50,
+        num_clippers: int = 10,
+        uploads_per_channel: int = 1000,
+        minecraft_ratio: float = 0.1,
+        watch_page_bytes: int = 500_000,
+        latency: float = 0.0,
+        seed: int = 0,
+    ):
+        self.minecraft_ratio = minecraft_ratio
+        self.watch_page_bytes = watch_page_bytes
+        self.latency = latency
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._clock = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+        self.member_channels = [
+            f"UC{fake_id(seed, 'member', i)}{fake_id(seed, 'member-tail', i)}"
+            for i in range(num_members)
+        ]
+        self.clipper_channels = [
+            f"UC{fake_id(seed, 'clipper', i)}{fake_id(seed, 'clipper-tail', i)}"
+            for i in range(num_clippers)
+        ]
+        # Channel ID -> Video IDs, newest first
+        self.uploads: Dict[str, List[str]] = {
+            channel_id: []
+            for channel_id in self.member_channels + self.clipper_channels
+        }
+        self.videos: Dict[str, FakeVideo] = {}
+        for _ in range(uploads_per_channel):
+            self.upload_to_all(1)
+
+    def holocraft_data(self) -> HolocraftData:
+        """Sync data that tracks all of the fake channels but hasn't scanned any yet."""
+        return HolocraftData(
+            members={
+                f"MEMBER{i}": MemberInfo(channel_id, f"Member {i}", "")
+                for i, channel_id in enumerate(self.member_channels)
+            },
+            clippers=list(self.clipper_channels),
+        )
+
+    def upload_to_all(self, count: int):
+        for _ in range(count):
+            for channel_id in self.member_channels:
+                self._upload_member_video(channel_id)
+            for channel_id in self.clipper_channels:
+                self._upload_clip(channel_id)
+
+    def edit(self, video_id: str, **changes):
+        """Change a video's fields, like a live stream ending or a title being edited."""
+        self.videos[video_id] = replace(self.videos[video_id], **changes)
+
+    def delete(self, video_id: str):
+        video = self.videos.pop(video_id)
+        self.uploads[video.channel_id].remove(video_id)
+
+    def _next_published_at(self):
+        self._clock += timedelta(minutes=self._random.randint(1, 120))
+        return self._clock
+
+    def _add(self, video: FakeVideo):
+        self.videos[video.id] = video
+        self.uploads[video.channel_id].insert(0, video.id)
+
+    def _upload_member_video(self, channel_id: str):
+        index = len(self.uploads[channel_id])
+        roll = self._random.random()
+        is_minecraft = roll < self.minecraft_ratio
+        # Half of the Minecraft streams only say so in the watch page's game block
+        in_title = is_minecraft and roll < self.minecraft_ratio / 2
+        self._add(
+            FakeVideo(
+                id=fake_id(self.seed, channel_id, index),
+                channel_id=channel_id,
+                title=f"{'【Minecraft】' if in_title else '【Stream】'} #{index}",
+                description="",
+                duration=f"PT{self._random.randint(1, 4)}H{self._random.randint(0, 59)}M",
+                published_at=self._next_published_at(),
+                has_game_block=is_minecraft,
+            )
+        )
+
+    def _upload_clip(self, channel_id: str):
+        index = len(self.uploads[channel_id])
+        member_channel = self._random.choice(self.member_channels)
+        sources = self.uploads[member_channel][:20]
+        description = "Thanks for watching!"
+        if len(sources) > 0 and self._random.random() < 0.5:
+            source = self._random.choice(sources)
+            description = f"Source: https://www.youtube.com/watch?v={source}"
+        self._add(
+            FakeVideo(
+                id=fake_id(self.seed, channel_id, index),
+                channel_id=channel_id,
+                title=f"Clip #{index}",
+                description=description,
+                duration=f"PT{self._random.randint(1, 20)}M{self._random.randint(0, 59)}S",
+                published_at=self._next_published_at(),
+                has_game_block=False,
+            )
+        )
+
+    def _video_snippet(self, video: FakeVideo):
+        return {
+            "title": video.title,
+            "description": video.description,
+            "channelTitle": video.channel_id,
+            "thumbnails": {},
+            "publishedAt": video.published_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+
+    def _channels_list(self, params: Dict[str, str]):
+        items = []
+        for channel_id in params.get("id", "").split(","):
+            if channel_id not in self.uploads:
+                continue
+            items.append(
+                {
+                    "contentDetails": {
+                        "relatedPlaylists": {"uploads": f"UU{channel_id[2:]}"}
+                    },
+                    "snippet": {
+                        "title": channel_id,
+                        "thumbnails": {
+                            "default": {
+                                "url": f"https://yt3.example/{channel_id}",
+                                "width": 88,
+                                "height": 88,
+                            }
+                        },
+                    },
+                }
+            )
+        return {
+            "pageInfo": {"totalResults": len(items), "resultsPerPage": 5},
+            "items": items,
+        }
+
+    def _playlist_items_list(self, params: Dict[str, str]):
+        uploads = self.uploads.get(f"UC{params['playlistId'][2:]}", [])
+        page_size = int(params.get("maxResults", "5"))
+        offset = int(params.get("pageToken", "0") or "0")
+        page = uploads[offset : offset + page_size]
+        response = {
+            "pageInfo": {"totalResults": len(uploads), "resultsPerPage": page_size},
+            "items": [
+                {
+                    "contentDetails": {
+                        "videoId": video_id,
+                        "videoPublishedAt": self._video_snippet(self.videos[video_id])[
+                            "publishedAt"
+                        ],
+                    },
+                    "snippet": self._video_snippet(self.videos[video_id]),
+                }
+                for video_id in page
+            ],
+        }
+        if offset + page_size < len(uploads):
+            response["nextPageToken"] = str(offset + page_size)
+        return response
+
+    def _videos_list(self, params: Dict[str, str]):
+        items = [
+            {
+                "id": video_id,
+                "contentDetails": {"duration": self.videos[video_id].duration},
+                "snippet": self._video_snippet(self.videos[video_id]),
+            }
+            for video_id in params.get("id", "").split(",")
+            if video_id in self.videos
+        ]
+        return {
+            "pageInfo": {"totalResults": len(items), "resultsPerPage": len(items)},
+            "items": items,
+        }
+
+    def api_response(self, uri: str, headers: Optional[Dict[str, str]] = None):
+        """Answer a Data API request, returning (status, body bytes)."""
+        if self.latency > 0:
+            time.sleep(self.latency)
+        split_uri = urlsplit(uri)
+        params = {name: values[0] for name, values in parse_qs(split_uri.query).items()}
+        resource = split_uri.path.rsplit("/", 1)[-1]
+        handlers = {
+            "channels": self._channels_list,
+            "playlistItems": self._playlist_items_list,
+            "videos": self._videos_list,
+        }
+        if resource not in handlers:
+            return 404, json.dumps({"error": {"code": 404}}).encode()
+
+        body = handlers[resource](params)
+        etag = hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()
+        body["etag"] = etag
+        if (headers or {}).get("If-None-Match") == etag:
+            return 304, b""
+        return 200, json.dumps(body).encode()
+
+    def watch_page(self, video_id: str) -> bytes:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        video = self.videos.get(video_id)
+        game_block = _WATCH_PAGE_GAME_BLOCK if video and video.has_game_block else ""
+        initial_data = (
+            f"<script>var ytInitialData = {{{game_block}}};</script></head><body>"
+        )
+        # Pad out the rest of the page so fetches cost roughly what real ones do
+        filler = max(
+            0, self.watch_page_bytes - len(_WATCH_PAGE_PREAMBLE) - len(initial_data)
+        )
+        return (
+            _WATCH_PAGE_PREAMBLE + initial_data + " " * filler + "</body></html>"
+        ).encode()
+
+    def feed(self, channel_id: str) -> Optional[bytes]:
+        """A channel's Atom feed of its latest uploads, or None for unknown channels."""
+        if channel_id not in self.uploads:
+            return None
+        entries = "".join(
+            f"<entry><yt:videoId>{video_id}</yt:videoId>"
+            f"<title>{self.videos[video_id].title}</title></entry>"
+            for video_id in self.uploads[channel_id][:FEED_SIZE]
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" '
+            f'xmlns="http://www.w3.org/2005/Atom">{entries}</feed>'
+        ).encode()
+
+    def http(self) -> "FakeApiHttp":
+        return FakeApiHttp(self)
+
+    def watch_adapter(self, max_in_flight: int = 1) -> "FakeWatchAdapter":
+        return FakeWatchAdapter(self)
+
+
+class FakeApiHttp:
+    """httplib2-style client that routes API requests to a FakeYouTube."""
+
+    def __init__(self, fake: FakeYouTube):
+        self.fake = fake
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        status, content = self.fake.api_response(uri, headers)
+        return httplib2.Response({"status": status}), content
+
+
+class FakeWatchAdapter(requests.adapters.BaseAdapter):
+    """requests transport that serves watch pages and channel feeds from a FakeYouTube."""
+
+    def __init__(self, fake: FakeYouTube):
+        super().__init__()
+        self.fake = fake
+
+    def send(self, request, stream=False, **kwargs):
+        url = urlsplit(request.url)
+        params = parse_qs(url.query)
+        if url.path.endswith("/feeds/videos.xml"):
+            feed = self.fake.feed(params.get("channel_id", [""])[0])
+            if feed is None:
+                return build_response(request, 404, {}, b"")
+            return build_response(
+                request, 200, {"Content-Type": "application/atom+xml"}, feed
+            )
+        video_id = params.get("v", [""])[0]
+        body = self.fake.watch_page(video_id)
+        return build_response(
+            request,
+            200,
+            {
+                "Content-Type": "text/html; charset=utf-8",
+                "Content-Length": str(len(body)),
+            },
+            body,
+        )
+
+    def close(self):
+        pass
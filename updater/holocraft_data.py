@@ -1,11 +1,15 @@
+import re
+from bisect import bisect_left, insort
 from dataclasses import dataclass, field
-from datetime import datetime
-from typing import Dict, List, Set
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 from dataclasses_json import DataClassJsonMixin, config
 from dataclasses_json.api import LetterCase, dataclass_json
 from marshmallow import fields
 
+from updater.seen_ids import PackedIdSet
+
 
 @dataclass
 class HolocraftStream:
@@ -57,16 +61,251 @@ class HolocraftData(DataClassJsonMixin):
     # Channel ID -> Upload Playlist ID
     upload_playlists: Dict[str, str] = field(default_factory=dict)
     # Channel ID -> Video ID
-    seen_videos: Dict[str, Set[str]] = field(
+    seen_videos: Dict[str, PackedIdSet] = field(
         default_factory=dict,
-        # We only want changes to show up in these sets when their membership changes,
-        # so we sort them to get a more stable serialization output
-        metadata=config(encoder=lambda d: {k: sorted(v) for k, v in d.items()}),
+        metadata=config(
+            # We only want changes to show up in these sets when their membership changes,
+            # so we sort them to get a more stable serialization output
+            encoder=lambda d: {k: sorted(v) for k, v in d.items()},
+            decoder=lambda d: {k: PackedIdSet.from_json(v) for k, v in d.items()},
+        ),
     )
     # Video ID -> HolocraftStream
     craft_streams: Dict[str, HolocraftStream] = field(default_factory=dict)
     # Video ID -> [Source Stream IDs]
     craft_clips: Dict[str, HolocraftClip] = field(default_factory=dict)
+    # Number of incremental runs since the last full reconciliation
+    incremental_runs: int = 0
+
+    def __post_init__(self):
+        # Built on first use, then kept up to date by the add and remove methods
+        self._index: Optional[CraftIndex] = None
+        # Only kept once a store that saves incrementally starts tracking changes
+        self._changes: Optional[SyncChanges] = None
+
+    def index(self) -> "CraftIndex":
+        if self._index is None:
+            self._index = CraftIndex(self)
+        return self._index
+
+    def copy(self) -> "HolocraftData":
+        """A copy to read from while this one goes on changing, which is cheap to take.
+
+        Streams, clips and members are shared, since they're only ever replaced.
+        """
+        return HolocraftData(
+            members=dict(self.members),
+            clippers=list(self.clippers),
+            upload_playlists=dict(self.upload_playlists),
+            seen_videos={
+                channel_id: video_ids.copy()
+                for channel_id, video_ids in self.seen_videos.items()
+            },
+            craft_streams=dict(self.craft_streams),
+            craft_clips=dict(self.craft_clips),
+            incremental_runs=self.incremental_runs,
+        )
+
+    def track_changes(self):
+        """Start keeping track of changes, for take_changes to return."""
+        self._changes = SyncChanges()
+
+    def take_changes(self) -> "Optional[SyncChanges]":
+        """What changed since changes were last taken, or None if they aren't tracked."""
+        changes = self._changes
+        if changes is not None:
+            self._changes = SyncChanges()
+        return changes
+
+    def add_stream(self, video_id: str, stream: HolocraftStream):
+        if self._index is not None:
+            self._index.add_stream(video_id, stream)
+        if self._changes is not None:
+            _record_added(
+                self._changes.streams, video_id, replaced=video_id in self.craft_streams
+            )
+        self.craft_streams[video_id] = stream
+
+    def remove_stream(self, video_id: str):
+        if self._index is not None:
+            self._index.remove_stream(video_id)
+        if self._changes is not None:
+            self._changes.streams[video_id] = True
+        del self.craft_streams[video_id]
+
+    def add_clip(self, video_id: str, clip: HolocraftClip):
+        if self._index is not None:
+            self._index.add_clip(video_id, clip)
+        if self._changes is not None:
+            _record_added(
+                self._changes.clips, video_id, replaced=video_id in self.craft_clips
+            )
+        self.craft_clips[video_id] = clip
+
+    def remove_clip(self, video_id: str):
+        if self._index is not None:
+            self._index.remove_clip(video_id)
+        if self._changes is not None:
+            self._changes.clips[video_id] = True
+        del self.craft_clips[video_id]
+
+    def mark_seen(self, channel_id: str, video_id: str):
+        self.seen_videos[channel_id].add(video_id)
+        if self._changes is not None:
+            self._changes.seen_added.setdefault(channel_id, set()).add(video_id)
+            self._changes.seen_removed.get(channel_id, set()).discard(video_id)
+
+    def forget_seen(self, channel_id: str, video_ids: Set[str]):
+        self.seen_videos[channel_id] = self.seen_videos[channel_id] - video_ids
+        if self._changes is not None:
+            self._changes.seen_removed.setdefault(channel_id, set()).update(video_ids)
+            self._changes.seen_added.get(channel_id, set()).difference_update(video_ids)
+
+
+def _record_added(changes: Dict[str, bool], video_id: str, replaced: bool):
+    if replaced:
+        changes.setdefault(video_id, False)
+    else:
+        # Moved to the end, so additions stay in the order they were last made
+        changes.pop(video_id, None)
+        changes[video_id] = True
+
+
+class SyncChanges:
+    """Streams, clips and seen videos changed since the sync data was last saved.
+
+    Lets a store save only what changed. Everything else in the sync data is small enough
+    to save whole every time.
+    """
+
+    def __init__(self):
+        # Video ID -> Whether it was added or removed rather than replaced in place. Added
+        # ones go after everything else, in the order they were last added, as in a dict.
+        self.streams: Dict[str, bool] = {}
+        self.clips: Dict[str, bool] = {}
+        # Channel ID -> Video IDs
+        self.seen_added: Dict[str, Set[str]] = {}
+        self.seen_removed: Dict[str, Set[str]] = {}
+
+    def merge(self, later: "SyncChanges"):
+        """Add the changes made after these, as if they'd been tracked together."""
+        for changes, later_changes in [
+            (self.streams, later.streams),
+            (self.clips, later.clips),
+        ]:
+            for video_id, moved in later_changes.items():
+                _record_added(changes, video_id, replaced=not moved)
+        for channel_id, video_ids in later.seen_added.items():
+            self.seen_added.setdefault(channel_id, set()).update(video_ids)
+            self.seen_removed.get(channel_id, set()).difference_update(video_ids)
+        for channel_id, video_ids in later.seen_removed.items():
+            self.seen_removed.setdefault(channel_id, set()).update(video_ids)
+            self.seen_added.get(channel_id, set()).difference_update(video_ids)
+
+
+class CraftIndex:
+    """Craft streams in publish order, and the clips which use each stream as a source.
+
+    Maintained as streams and clips are added and removed, so emitting client data doesn't
+    have to sort every stream or join every clip to its source streams.
+    """
+
+    def __init__(self, data: HolocraftData):
+        # (Published at, Sequence, Video ID) of every craft stream, in order. Streams
+        # published at the same time keep the order they were added in.
+        self.stream_order: List[Tuple[datetime, int, str]] = sorted(
+            (stream.published_at, sequence, video_id)
+            for sequence, (video_id, stream) in enumerate(data.craft_streams.items())
+        )
+        self._stream_keys: Dict[str, Tuple[datetime, int, str]] = {
+            key[2]: key for key in self.stream_order
+        }
+        self._next_sequence = len(self.stream_order)
+        # Stream Video ID -> Clip Video IDs, in the order the clips were added
+        self.clips_by_stream: Dict[str, Dict[str, None]] = {}
+        # Clip Video ID -> Source streams which are craft streams, for clips with any
+        self.known_sources: Dict[str, List[str]] = {}
+        self._clip_sources: Dict[str, List[str]] = {}
+        for video_id, clip in data.craft_clips.items():
+            self.add_clip(video_id, clip)
+
+    def add_stream(self, video_id: str, stream: HolocraftStream):
+        previous_key = self._stream_keys.get(video_id)
+        if previous_key is not None:
+            # Replacing a stream keeps its place among streams published at the same time
+            self._remove_stream_key(previous_key)
+            sequence = previous_key[1]
+        else:
+            sequence = self._next_sequence
+            self._next_sequence += 1
+        key = (stream.published_at, sequence, video_id)
+        insort(self.stream_order, key)
+        self._stream_keys[video_id] = key
+        if previous_key is None:
+            self._update_clips_of(video_id)
+
+    def remove_stream(self, video_id: str):
+        self._remove_stream_key(self._stream_keys.pop(video_id))
+        self._update_clips_of(video_id)
+
+    def _remove_stream_key(self, key: Tuple[datetime, int, str]):
+        del self.stream_order[bisect_left(self.stream_order, key)]
+
+    def add_clip(self, video_id: str, clip: HolocraftClip):
+        if video_id in self._clip_sources:
+            self.remove_clip(video_id)
+        self._clip_sources[video_id] = list(clip.source_streams)
+        # A clip can list the same source stream more than once
+        for stream_id in dict.fromkeys(clip.source_streams):
+            self.clips_by_stream.setdefault(stream_id, {})[video_id] = None
+        self._update_known_sources(video_id)
+
+    def remove_clip(self, video_id: str):
+        for stream_id in dict.fromkeys(self._clip_sources.pop(video_id)):
+            clips = self.clips_by_stream[stream_id]
+            clips.pop(video_id, None)
+            if len(clips) == 0:
+                del self.clips_by_stream[stream_id]
+        self.known_sources.pop(video_id, None)
+
+    def _update_known_sources(self, clip_id: str):
+        known = [
+            stream_id
+            for stream_id in self._clip_sources[clip_id]
+            if stream_id in self._stream_keys
+        ]
+        if len(known) > 0:
+            self.known_sources[clip_id] = known
+        else:
+            self.known_sources.pop(clip_id, None)
+
+    def _update_clips_of(self, stream_id: str):
+        # Only the clips citing a stream are affected by it coming or going
+        for clip_id in self.clips_by_stream.get(stream_id, {}):
+            self._update_known_sources(clip_id)
+
+    def ordered_stream_ids(self) -> List[str]:
+        return [video_id for _, _, video_id in self.stream_order]
+
+
+# The only ISO-8601 duration components YouTube uses
+_DURATION_PATTERN = re.compile(
+    r"P(?:(?P<days>\d+)D)?(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?"
+)
+
+
+def duration_seconds(duration: str) -> int:
+    """Length in seconds of a YouTube ISO-8601 duration like "PT1H2M3S" or "P0D"."""
+    match = _DURATION_PATTERN.fullmatch(duration)
+    if match is None:
+        raise ValueError(f"Unsupported duration: {duration}")
+    parts = {unit: int(value or 0) for unit, value in match.groupdict().items()}
+    return (
+        parts["days"] * 86400
+        + parts["hours"] * 3600
+        + parts["minutes"] * 60
+        + parts["seconds"]
+    )
 
 
 @dataclass_json(letter_case=LetterCase.CAMEL)
@@ -87,6 +326,33 @@ class ClientMemberInfo(MemberInfo):
     pass
 
 
+def date_buckets(streams: List[ClientHolocraftStream]) -> Dict[str, Any]:
+    """Group streams, which must be in date order, by the UTC year, month and day they
+    were published.
+
+    Each year and month is {"start": index, "count": n, "months" or "days": {...}}, and
+    each day is [start index, count]. Every bucket covers the streams from start up to,
+    but not including, start + count. Months and days are numbered from 1.
+
+    Clients show dates in local time, so they split the UTC days at local midnight
+    rather than using these buckets as they are.
+    """
+    years: Dict[str, Any] = {}
+    for stream_index, stream in enumerate(streams):
+        published_at = stream.published_at.astimezone(timezone.utc)
+        year = years.setdefault(
+            str(published_at.year), {"start": stream_index, "count": 0, "months": {}}
+        )
+        month = year["months"].setdefault(
+            str(published_at.month), {"start": stream_index, "count": 0, "days": {}}
+        )
+        day = month["days"].setdefault(str(published_at.day), [stream_index, 0])
+        year["count"] += 1
+        month["count"] += 1
+        day[1] += 1
+    return years
+
+
 @dataclass_json(letter_case=LetterCase.CAMEL)
 @dataclass
 class HolocraftClientData:
@@ -95,6 +361,12 @@ class HolocraftClientData:
     members: Dict[str, ClientMemberInfo]
     craft_streams: List[ClientHolocraftStream]
     craft_clips: List[ClientHolocraftClip]
+    # Stream Video ID -> Video IDs of the clips sourced from it, for streams with clips
+    stream_clips: Dict[str, List[str]] = field(default_factory=dict)
+    # Year -> Bucket of the streams published that year (in UTC), see date_buckets
+    date_buckets: Dict[str, Any] = field(default_factory=dict)
+    # Member -> Indexes into craft_streams of that member's streams, in date order
+    member_streams: Dict[str, List[int]] = field(default_factory=dict)
 
     @classmethod
     def from_holocraft_data(cls, data: HolocraftData):
@@ -104,37 +376,198 @@ class HolocraftClientData:
             )
             for member_id, member_info in data.members.items()
         }
+        index = data.index()
+        # We only take clips which have at least 1 known holocraft source stream, and
+        # only list those source streams which are known holocraft source streams
         filtered_craft_clips = [
             ClientHolocraftClip(
-                source_streams=source_streams,
+                source_streams=list(source_streams),
                 title=clip.title,
                 video_id=clip_id,
                 duration=clip.duration,
             )
             for clip_id, clip in data.craft_clips.items()
-            # We only take clips which have at least 1 known holocraft source stream
-            if len(
-                #  And we only list those source streams which are known holocraft source streams
-                source_streams := [
-                    craft_stream
-                    for craft_stream in clip.source_streams
-                    if craft_stream in data.craft_streams
-                ]
+            if (source_streams := index.known_sources.get(clip_id)) is not None
+        ]
+        ordered_stream_ids = index.ordered_stream_ids()
+        ordered_craft_streams = [
+            ClientHolocraftStream(
+                member=source_stream.member,
+                published_at=source_stream.published_at,
+                title=source_stream.title,
+                video_id=source_stream_id,
+                duration=source_stream.duration,
+            )
+            # Already sorted by date
+            for source_stream_id, source_stream in (
+                (stream_id, data.craft_streams[stream_id])
+                for stream_id in ordered_stream_ids
             )
-            > 0
         ]
-        ordered_craft_streams = sorted(
-            [
-                ClientHolocraftStream(
-                    member=source_stream.member,
-                    published_at=source_stream.published_at,
-                    title=source_stream.title,
-                    video_id=source_stream_id,
-                    duration=source_stream.duration,
+        # Every clip sourced from a craft stream made it into the filtered clips
+        stream_clips = {
+            stream_id: list(index.clips_by_stream[stream_id])
+            for stream_id in ordered_stream_ids
+            if stream_id in index.clips_by_stream
+        }
+        member_streams: Dict[str, List[int]] = {}
+        for stream_index, stream in enumerate(ordered_craft_streams):
+            member_streams.setdefault(stream.member, []).append(stream_index)
+        return cls(
+            members,
+            ordered_craft_streams,
+            filtered_craft_clips,
+            stream_clips,
+            date_buckets(ordered_craft_streams),
+            member_streams,
+        )
+
+    def to_columnar(self) -> Dict[str, Any]:
+        """A compact struct-of-arrays alternative to to_dict.
+
+        Each stream and clip field is one array, indexed by the position of the stream or
+        clip. Members are indexes into memberIds, source streams are indexes into the
+        stream arrays, durations are in seconds and publish times are Unix timestamps.
+        """
+        member_ids = list(self.members.keys())
+        member_indexes = {
+            member_id: index for index, member_id in enumerate(member_ids)
+        }
+        stream_indexes = {
+            stream.video_id: index for index, stream in enumerate(self.craft_streams)
+        }
+        return {
+            "version": COLUMNAR_FORMAT_VERSION,
+            "memberIds": member_ids,
+            "members": [
+                {
+                    "channelId": self.members[member_id].channel_id,
+                    "name": self.members[member_id].name,
+                    "channelImageUrl": self.members[member_id].channel_image_url,
+                }
+                for member_id in member_ids
+            ],
+            "streams": {
+                "videoId": [stream.video_id for stream in self.craft_streams],
+                "member": [
+                    member_indexes[stream.member] for stream in self.craft_streams
+                ],
+                "publishedAt": [
+                    int(stream.published_at.timestamp())
+                    for stream in self.craft_streams
+                ],
+                "title": [stream.title for stream in self.craft_streams],
+                "duration": [
+                    duration_seconds(stream.duration) for stream in self.craft_streams
+                ],
+            },
+            "clips": {
+                "videoId": [clip.video_id for clip in self.craft_clips],
+                "sourceStreams": [
+                    [stream_indexes[stream_id] for stream_id in clip.source_streams]
+                    for clip in self.craft_clips
+                ],
+                "title": [clip.title for clip in self.craft_clips],
+                "duration": [
+                    duration_seconds(clip.duration) for clip in self.craft_clips
+                ],
+            },
+        }
+
+    def shard(
+        self, granularity: str, shard_path: Callable[[str], str]
+    ) -> Tuple["HolocraftClientManifest", Dict[str, "HolocraftClientShard"]]:
+        """Split the streams and clips up by the year or month they were published.
+
+        Clips go in the shard of their newest source stream. shard_path gives the path a
+        shard is fetched from, given its period.
+        """
+        period_format = SHARD_PERIOD_FORMATS[granularity]
+        shards: Dict[str, HolocraftClientShard] = {}
+        stream_periods = {}
+        # Streams are in date order, so shards are created in date order too
+        for stream in self.craft_streams:
+            period = stream.published_at.strftime(period_format)
+            shards.setdefault(period, HolocraftClientShard([], []))
+            shards[period].craft_streams.append(stream)
+            stream_periods[stream.video_id] = (stream.published_at, period)
+        for clip in self.craft_clips:
+            _, period = max(
+                stream_periods[source_stream] for source_stream in clip.source_streams
+            )
+            shards[period].craft_clips.append(clip)
+
+        manifest = HolocraftClientManifest(
+            members=self.members,
+            granularity=granularity,
+            shards=[
+                ClientShardInfo(
+                    period=period,
+                    path=shard_path(period),
+                    first_published_at=shard.craft_streams[0].published_at,
+                    last_published_at=shard.craft_streams[-1].published_at,
+                    stream_count=len(shard.craft_streams),
+                    clip_count=len(shard.craft_clips),
                 )
-                for source_stream_id, source_stream in data.craft_streams.items()
+                for period, shard in shards.items()
             ],
-            # Sorted by date
-            key=lambda stream: stream.published_at,
         )
-        return cls(members, ordered_craft_streams, filtered_craft_clips)
+        return manifest, shards
+
+
+# Bumped whenever the layout of HolocraftClientData.to_columnar changes
+COLUMNAR_FORMAT_VERSION = 1
+
+# Client data shard granularity -> How shards of that granularity are named
+SHARD_PERIOD_FORMATS = {"year": "%Y", "month": "%Y-%m"}
+
+
+@dataclass_json(letter_case=LetterCase.CAMEL)
+@dataclass
+class HolocraftClientShard:
+    """The streams and clips of one period of the timeline."""
+
+    craft_streams: List[ClientHolocraftStream]
+    craft_clips: List[ClientHolocraftClip]
+
+
+@dataclass_json(letter_case=LetterCase.CAMEL)
+@dataclass
+class ClientShardInfo:
+    # Year or month covered by the shard, e.g. "2021" or "2021-06"
+    period: str
+    # Where to fetch the shard from, relative to the client
+    path: str
+    # When the shard's first stream was published
+    first_published_at: datetime = field(
+        metadata=config(
+            encoder=datetime.isoformat,
+            decoder=datetime.fromisoformat,
+            mm_field=fields.DateTime(format="iso"),
+        )
+    )
+    # When the shard's last stream was published
+    last_published_at: datetime = field(
+        metadata=config(
+            encoder=datetime.isoformat,
+            decoder=datetime.fromisoformat,
+            mm_field=fields.DateTime(format="iso"),
+        )
+    )
+    stream_count: int
+    clip_count: int
+
+
+@dataclass_json(letter_case=LetterCase.CAMEL)
+@dataclass
+class HolocraftClientManifest:
+    """The index of sharded client data, fetched before any of the shards.
+
+    Lets the client fetch the most recent shards first and lazily load older history.
+    """
+
+    members: Dict[str, ClientMemberInfo]
+    # "year" or "month"
+    granularity: str
+    # In date order
+    shards: List[ClientShardInfo]
@@ -0,0 +1,148 @@
+import json
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+# Upper bounds (in milliseconds) of the latency histogram buckets
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# Endpoint names used when recording calls
+CHANNELS_LIST = "channels.list"
+PLAYLIST_ITEMS_LIST = "playlistItems.list"
+VIDEOS_LIST = "videos.list"
+WATCH_PAGE = "watch_page"
+FEED = "feed"
+
+
+@dataclass
+class CallMetrics:
+    """Aggregate measurements for one kind of outgoing request."""
+
+    calls: int = 0
+    quota_units: int = 0
+    bytes: int = 0
+    # Bytes of responses left unread because we already had what we needed
+    bytes_saved: int = 0
+    errors: int = 0
+    latency_ms_total: float = 0.0
+    # Bucket upper bound in ms ("inf" for the overflow bucket) -> Number of calls
+    latency_histogram: Dict[str, int] = field(default_factory=dict)
+
+    def observe(
+        self,
+        quota_units: int,
+        num_bytes: int,
+        bytes_saved: int,
+        latency_ms: float,
+        error: bool,
+    ):
+        self.calls += 1
+        self.quota_units += quota_units
+        self.bytes += num_bytes
+        self.bytes_saved += bytes_saved
+        self.latency_ms_total += latency_ms
+        if error:
+            self.errors += 1
+        bucket = next(
+            (str(bound) for bound in LATENCY_BUCKETS_MS if latency_ms <= bound), "inf"
+        )
+        self.latency_histogram[bucket] = self.latency_histogram.get(bucket, 0) + 1
+
+
+class RunMetrics:
+    """Everything measured about a single updater run, written out as the run report."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.now(timezone.utc)
+            self.endpoints: Dict[str, CallMetrics] = {}
+            # Channel ID -> Endpoint -> Metrics
+            self.channels: Dict[str, Dict[str, CallMetrics]] = {}
+            # Extra named counters, e.g. cache hit rates
+            self.counters: Dict[str, Any] = {}
+
+    def record(
+        self,
+        endpoint: str,
+        quota_units: int = 0,
+        num_bytes: int = 0,
+        latency_seconds: float = 0.0,
+        error: bool = False,
+        bytes_saved: int = 0,
+    ):
+        channel_id = current_channel()
+        latency_ms = latency_seconds * 1000
+        with self._lock:
+            self.endpoints.setdefault(endpoint, CallMetrics()).observe(
+                quota_units, num_bytes, bytes_saved, latency_ms, error
+            )
+            if channel_id is not None:
+                self.channels.setdefault(channel_id, {}).setdefault(
+                    endpoint, CallMetrics()
+                ).observe(quota_units, num_bytes, bytes_saved, latency_ms, error)
+
+    def set_counter(self, name: str, value: Any):
+        with self._lock:
+            self.counters[name] = value
+
+    def calls(self, endpoint: str):
+        with self._lock:
+            return self.endpoints[endpoint].calls if endpoint in self.endpoints else 0
+
+    def quota_units(self):
+        with self._lock:
+            return sum(metrics.quota_units for metrics in self.endpoints.values())
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "started_at": self.started_at.isoformat(),
+                "finished_at": datetime.now(timezone.utc).isoformat(),
+                "total_quota_units": sum(
+                    metrics.quota_units for metrics in self.endpoints.values()
+                ),
+                "endpoints": {
+                    endpoint: asdict(metrics)
+                    for endpoint, metrics in sorted(self.endpoints.items())
+                },
+                "channels": {
+                    channel_id: {
+                        endpoint: asdict(metrics)
+                        for endpoint, metrics in sorted(endpoints.items())
+                    }
+                    for channel_id, endpoints in sorted(self.channels.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def write(self, path: str):
+        with open(path, "w") as report_file:
+            report_file.write(json.dumps(self.to_dict(), indent=2))
+
+
+_current = threading.local()
+
+
+def current_channel() -> Optional[str]:
+    return getattr(_current, "channel_id", None)
+
+
+@contextmanager
+def channel_context(channel_id: Optional[str]):
+    """Attribute requests made on this thread to a channel."""
+    previous = current_channel()
+    _current.channel_id = channel_id
+    try:
+        yield
+    finally:
+        _current.channel_id = previous
+
+
+# Metrics for the current run
+run_metrics = RunMetrics()
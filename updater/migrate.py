@@ -0,0 +1,166 @@
+# Apply pending migrations to the sync data, in order, recording each one as it's applied.
+#
+# Usage: python -m updater.migrate [API_KEY] [--dry-run] [--list] [--storage STORAGE]
+
+import argparse
+import copy
+import json
+import os
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from updater.api_client import build_youtube
+from updater.checkpoint import write_json_atomically
+from updater.codec import holocraft_data_from_dict
+from updater.metrics import VIDEOS_LIST, run_metrics
+from updater.migration import Migration, MigrationContext
+from updater.migrations import backfill_video_duration
+from updater.response_cache import ResponseCache
+from updater.update_holocraft import (
+    RESPONSE_CACHE_DIR,
+    RESPONSE_CACHE_MAX_BYTES,
+    STORAGE_JSON,
+    STORAGE_SQLITE,
+    emit_client_data,
+    load_raw_data,
+    set_sync_store,
+    sync_store_for,
+    write_data,
+)
+from updater.youtube import set_response_cache
+
+if TYPE_CHECKING:
+    import googleapiclient.discovery as api  # type: ignore
+
+# Migration name -> When it was applied
+APPLIED_MIGRATIONS_PATH = "updater/migrations/applied.json"
+
+# Every migration, in the order they're applied
+MIGRATIONS: List[Migration] = [
+    backfill_video_duration.MIGRATION,
+]
+
+# Sections of the sync data whose changes are reported record by record
+_SUMMARIZED_SECTIONS = ["members", "craft_streams", "craft_clips"]
+
+
+def load_applied_migrations(path: str) -> Dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as applied_file:
+        return json.load(applied_file)
+
+
+def pending_migrations(
+    migrations: List[Migration], applied: Dict[str, str]
+) -> List[Migration]:
+    return sorted(
+        (migration for migration in migrations if migration.name not in applied),
+        key=lambda migration: migration.name,
+    )
+
+
+def _summarize_changes(before: Dict[str, Any], after: Dict[str, Any]):
+    for section in _SUMMARIZED_SECTIONS:
+        previous = before.get(section, {})
+        current = after.get(section, {})
+        added = len(current.keys() - previous.keys())
+        removed = len(previous.keys() - current.keys())
+        changed = sum(
+            1
+            for key in current.keys() & previous.keys()
+            if current[key] != previous[key]
+        )
+        if added or removed or changed:
+            print(f"  {section}: {added} added, {changed} changed, {removed} removed")
+
+
+def run_migrations(
+    youtube: "api.Resource",
+    migrations: List[Migration],
+    dry_run: bool,
+    response_cache: Optional[ResponseCache],
+):
+    applied = load_applied_migrations(APPLIED_MIGRATIONS_PATH)
+    pending = pending_migrations(migrations, applied)
+    if not pending:
+        print("No pending migrations")
+        return
+
+    sync_data = load_raw_data()
+    context = MigrationContext(youtube, sync_data, response_cache)
+    data = None
+    for migration in pending:
+        print(f"Applying {migration.name}: {migration.description}")
+        before = {
+            section: copy.deepcopy(sync_data.get(section, {}))
+            for section in _SUMMARIZED_SECTIONS
+        }
+        migration.migrate(context)
+        _summarize_changes(before, sync_data)
+        # Whatever a migration did, the result has to load with the current schema
+        data = holocraft_data_from_dict(sync_data)
+        if dry_run:
+            continue
+        # Save after every migration so the record never runs ahead of the data
+        write_data(data)
+        applied[migration.name] = datetime.now(timezone.utc).isoformat()
+        write_json_atomically(APPLIED_MIGRATIONS_PATH, applied)
+
+    if dry_run:
+        print(f"Dry run, so nothing was written for {len(pending)} migrations")
+    elif data is not None:
+        emit_client_data(data)
+    print(
+        f"API calls: {run_metrics.calls(VIDEOS_LIST)} videos.list "
+        f"({run_metrics.quota_units()} quota units)"
+    )
+
+
+def list_migrations(migrations: List[Migration]):
+    applied = load_applied_migrations(APPLIED_MIGRATIONS_PATH)
+    for migration in sorted(migrations, key=lambda migration: migration.name):
+        applied_at = applied.get(migration.name)
+        status = f"applied {applied_at}" if applied_at else "pending"
+        print(f"{migration.name} ({status}): {migration.description}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Migrate the Holocraft sync data")
+    parser.add_argument("api_key", nargs="?", help="YouTube Data API key")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Report what pending migrations would change without writing anything",
+    )
+    parser.add_argument(
+        "--list",
+        action="store_true",
+        help="List migrations and whether they've been applied",
+    )
+    parser.add_argument(
+        "--storage",
+        choices=[STORAGE_JSON, STORAGE_SQLITE],
+        default=STORAGE_JSON,
+        help="Where the sync data is kept, as for updater.update_holocraft",
+    )
+    args = parser.parse_args(argv)
+    if args.list:
+        list_migrations(MIGRATIONS)
+        return
+    if args.api_key is None:
+        parser.error("an API key is needed to apply migrations")
+
+    run_metrics.reset()
+    set_sync_store(sync_store_for(args.storage))
+    youtube = build_youtube(args.api_key)
+    # Lookups revalidate against responses the updater already cached, and vice versa
+    response_cache = ResponseCache(RESPONSE_CACHE_DIR, RESPONSE_CACHE_MAX_BYTES)
+    set_response_cache(response_cache)
+    run_migrations(youtube, MIGRATIONS, args.dry_run, response_cache)
+    if not args.dry_run:
+        response_cache.prune()
+
+
+if __name__ == "__main__":
+    main()
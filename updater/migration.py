@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Optional
+
+from updater.response_cache import ResponseCache
+from updater.youtube import YouTubeVideoItemResource, get_videos
+
+if TYPE_CHECKING:
+    import googleapiclient.discovery as api  # type: ignore
+
+
+class MigrationContext:
+    """What a migration gets to work with: the raw sync data, and video lookups.
+
+    Migrations edit sync_data in place. It's the sync file as loaded by json, so a
+    migration can add fields the current schema requires before anything parses it.
+    """
+
+    def __init__(
+        self,
+        youtube: "api.Resource",
+        sync_data: Dict[str, Any],
+        response_cache: Optional[ResponseCache],
+    ):
+        self.youtube = youtube
+        self.sync_data = sync_data
+        self.response_cache = response_cache
+        self._cached_videos: Optional[Dict[str, Any]] = None
+
+    def fetch_videos(
+        self, video_ids: Iterable[str]
+    ) -> Dict[str, YouTubeVideoItemResource]:
+        """Video ID -> Video, for every one of video_ids which still exists.
+
+        Videos already in a cached videos.list response are taken from there, and the
+        rest are looked up 50 at a time instead of scanning whole upload playlists.
+        """
+        if self._cached_videos is None:
+            self._cached_videos = (
+                self.response_cache.cached_videos() if self.response_cache else {}
+            )
+        videos = {}
+        uncached_ids = []
+        for video_id in dict.fromkeys(video_ids):
+            cached_video = self._cached_videos.get(video_id)
+            if cached_video is not None:
+                videos[video_id] = YouTubeVideoItemResource.from_dict(cached_video)
+            else:
+                uncached_ids.append(video_id)
+        print(
+            f"Found {len(videos)} videos in cached responses, "
+            f"looking up {len(uncached_ids)}"
+        )
+        for video in get_videos(self.youtube, uncached_ids):
+            videos[video.id] = video
+        return videos
+
+
+@dataclass
+class Migration:
+    """A one-off change to the sync data, applied once by updater.migrate."""
+
+    # Migrations are applied in order of name, so names start with the date they're from
+    name: str
+    # What the migration does, shown when listing migrations
+    description: str
+    # Changes the sync data in the context
+    migrate: Callable[[MigrationContext], None]
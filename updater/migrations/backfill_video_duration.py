@@ -0,0 +1,68 @@
+from typing import Any, Dict, Iterable, List, Set
+
+from updater.migration import Migration, MigrationContext
+from updater.seen_ids import PackedIdSet
+
+
+def _owning_channels(sync_data: Dict[str, Any], section: str) -> List[str]:
+    # The channels whose uploads a full sync would have found the records in
+    if section == "craft_streams":
+        return [member["channel_id"] for member in sync_data["members"].values()]
+    return list(sync_data["clippers"])
+
+
+def _forget_seen(
+    sync_data: Dict[str, Any], channel_ids: Iterable[str], video_ids: Set[str]
+):
+    # Like HolocraftData.forget_seen, so the videos are looked at again if they return
+    seen_videos = sync_data.get("seen_videos", {})
+    for channel_id in channel_ids:
+        if channel_id in seen_videos:
+            seen_videos[channel_id] = sorted(
+                PackedIdSet.from_json(seen_videos[channel_id]) - video_ids
+            )
+
+
+def backfill_video_duration(context: MigrationContext):
+    # Only records from before durations were tracked need looking up
+    sync_data = context.sync_data
+    stream_ids = [
+        video_id
+        for video_id, stream in sync_data["craft_streams"].items()
+        if not stream.get("duration")
+    ]
+    clip_ids = [
+        video_id
+        for video_id, clip in sync_data["craft_clips"].items()
+        if not clip.get("duration")
+    ]
+    videos = context.fetch_videos(stream_ids + clip_ids)
+    for section, video_ids in [
+        ("craft_streams", stream_ids),
+        ("craft_clips", clip_ids),
+    ]:
+        records = sync_data[section]
+        missing_ids = []
+        for video_id in video_ids:
+            video = videos.get(video_id)
+            if video is None:
+                # Gone or private, like a full sync would find
+                del records[video_id]
+                missing_ids.append(video_id)
+            else:
+                records[video_id]["duration"] = video.contentDetails.duration
+        print(f"Backfilled {len(video_ids) - len(missing_ids)} {section} durations")
+        if missing_ids:
+            _forget_seen(
+                sync_data, _owning_channels(sync_data, section), set(missing_ids)
+            )
+            print(
+                f"Removed {len(missing_ids)} missing {section}: {', '.join(missing_ids)}"
+            )
+
+
+MIGRATION = Migration(
+    "2021_06_12_backfill_video_duration",
+    "Add durations to streams and clips recorded without one",
+    backfill_video_duration,
+)
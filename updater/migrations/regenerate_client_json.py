@@ -1,9 +1,10 @@
+from updater.sync_sections import CLIENT_DATA_SECTIONS
 from updater.update_holocraft import emit_client_data, load_data
 
 
 def main():
-    # Load existing data
-    data = load_data()
+    # Load only what the client data is made from
+    data = load_data(CLIENT_DATA_SECTIONS)
     emit_client_data(data)
 
 
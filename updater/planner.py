@@ -0,0 +1,192 @@
+import math
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from dataclasses_json import DataClassJsonMixin, config
+from marshmallow import fields
+
+from updater.holocraft_data import HolocraftData
+from updater.youtube import API_CALL_QUOTA_COST, PLAYLIST_PAGE_SIZE
+
+# Upload rate assumed for channels we know nothing about, so they're scanned again soon
+NEW_CHANNEL_UPLOADS_PER_DAY = 1.0
+# Upload rates are never assumed to be lower than this, so dormant channels still get
+# looked at now and then
+MIN_UPLOADS_PER_DAY = 1 / 30
+# Longest a channel goes without being scanned
+MAX_POLL_INTERVAL = timedelta(days=14)
+# Weight of the latest observation in a channel's smoothed upload rate
+RATE_SMOOTHING = 0.3
+
+# Why a channel wasn't scanned on this run
+DEFERRED_NOT_DUE = "not due"
+DEFERRED_OVER_BUDGET = "over budget"
+
+
+@dataclass
+class ChannelSchedule:
+    """What we've learned about how often a channel uploads."""
+
+    # When the channel was last scanned to completion
+    last_scanned_at: datetime = field(
+        metadata=config(
+            encoder=datetime.isoformat,
+            decoder=datetime.fromisoformat,
+            mm_field=fields.DateTime(format="iso"),
+        )
+    )
+    # How many of the channel's videos we'd seen as of that scan
+    seen_count: int
+    # Smoothed estimate of how many videos the channel uploads per day
+    uploads_per_day: float
+
+
+@dataclass
+class PlannerState(DataClassJsonMixin):
+    """Per-channel upload rates, kept between runs to plan incremental scans."""
+
+    # Channel ID -> Schedule
+    channels: Dict[str, ChannelSchedule] = field(default_factory=dict)
+
+
+@dataclass
+class ScanPlan:
+    """Which channels to scan on this run, and which to leave for a later one."""
+
+    # Channels to scan, most likely to have new videos first
+    scheduled: List[str]
+    # Channel ID -> Why it's deferred
+    deferred: Dict[str, str]
+    # Channel ID -> Quota units we expect its scan to cost
+    allocations: Dict[str, int]
+
+    def planned_units(self):
+        return sum(self.allocations.values())
+
+
+def load_planner_state(path: str) -> PlannerState:
+    if not os.path.exists(path):
+        return PlannerState()
+    with open(path, "r") as state_file:
+        return PlannerState.from_json(state_file.read())
+
+
+def _prior_uploads_per_day(data: HolocraftData, channel_id: str, now: datetime):
+    # Until we've timed a channel ourselves, spread the videos we've seen from it over the
+    # time since its oldest craft stream. That's at most the channel's age, so this errs
+    # towards scanning too often.
+    member_names = {
+        member_name
+        for member_name, member_info in data.members.items()
+        if member_info.channel_id == channel_id
+    }
+    published = [
+        stream.published_at
+        for stream in data.craft_streams.values()
+        if stream.member in member_names
+    ]
+    if len(published) == 0:
+        return NEW_CHANNEL_UPLOADS_PER_DAY
+    days = max(1.0, (now - min(published)) / timedelta(days=1))
+    seen_count = len(data.seen_videos.get(channel_id, ()))
+    return max(MIN_UPLOADS_PER_DAY, seen_count / days)
+
+
+def poll_interval(uploads_per_day: float) -> timedelta:
+    """How long to wait between scans of a channel, about the time it takes to upload once."""
+    rate = max(uploads_per_day, MIN_UPLOADS_PER_DAY)
+    return min(MAX_POLL_INTERVAL, timedelta(days=1 / rate))
+
+
+def estimated_scan_units(expected_new_videos: float) -> int:
+    # Pages with new videos cost a playlistItems.list and a videos.list call, and the scan
+    # stops after one more page of videos it has already seen
+    pages_with_new = math.ceil(expected_new_videos / PLAYLIST_PAGE_SIZE)
+    return API_CALL_QUOTA_COST * (2 * pages_with_new + 1)
+
+
+def plan_scans(
+    data: HolocraftData,
+    state: PlannerState,
+    channel_ids: List[str],
+    budget: int,
+    now: datetime,
+) -> ScanPlan:
+    """Pick the channels worth scanning on an incremental run within a quota budget.
+
+    Channels we haven't scanned before are always due. The rest are due once their poll
+    interval has passed, and due channels are scheduled in order of how many new videos
+    they're expected to have until the budget runs out.
+    """
+    candidates = []
+    deferred = {}
+    for channel_id in channel_ids:
+        schedule = state.channels.get(channel_id)
+        if schedule is None:
+            # Unknown channels go first, with an estimate from what we know of them
+            expected = _prior_uploads_per_day(data, channel_id, now)
+            candidates.append((math.inf, expected, channel_id))
+            continue
+        elapsed = now - schedule.last_scanned_at
+        if elapsed < poll_interval(schedule.uploads_per_day):
+            deferred[channel_id] = DEFERRED_NOT_DUE
+            continue
+        expected = schedule.uploads_per_day * elapsed / timedelta(days=1)
+        candidates.append((expected, expected, channel_id))
+
+    scheduled = []
+    allocations = {}
+    remaining = budget
+    for _, expected, channel_id in sorted(candidates, reverse=True):
+        units = estimated_scan_units(expected)
+        if units > remaining:
+            deferred[channel_id] = DEFERRED_OVER_BUDGET
+            continue
+        scheduled.append(channel_id)
+        allocations[channel_id] = units
+        remaining -= units
+    return ScanPlan(scheduled, deferred, allocations)
+
+
+def record_scans(
+    data: HolocraftData,
+    state: PlannerState,
+    channel_ids: List[str],
+    now: datetime,
+):
+    """Learn from channels that were just scanned how often they upload."""
+    for channel_id in channel_ids:
+        seen_count = len(data.seen_videos.get(channel_id, ()))
+        schedule = state.channels.get(channel_id)
+        if schedule is None:
+            uploads_per_day = _prior_uploads_per_day(data, channel_id, now)
+        else:
+            elapsed_days = (now - schedule.last_scanned_at) / timedelta(days=1)
+            if elapsed_days <= 0:
+                continue
+            observed = max(0, seen_count - schedule.seen_count) / elapsed_days
+            uploads_per_day = (
+                RATE_SMOOTHING * observed
+                + (1 - RATE_SMOOTHING) * schedule.uploads_per_day
+            )
+        state.channels[channel_id] = ChannelSchedule(
+            last_scanned_at=now,
+            seen_count=seen_count,
+            uploads_per_day=uploads_per_day,
+        )
+
+
+def describe_plan(plan: ScanPlan, budget: int):
+    not_due = [c for c, reason in plan.deferred.items() if reason == DEFERRED_NOT_DUE]
+    over_budget = [
+        c for c, reason in plan.deferred.items() if reason == DEFERRED_OVER_BUDGET
+    ]
+    print(
+        f"Scan plan: {len(plan.scheduled)} channels for ~{plan.planned_units()} of "
+        f"{budget} quota units, {len(not_due)} not due, "
+        f"{len(over_budget)} deferred over budget"
+    )
+    if len(over_budget) > 0:
+        print("Deferred over budget:", ", ".join(over_budget))
@@ -0,0 +1,183 @@
+# Record YouTube traffic to fixtures and play it back, so the updater can run offline.
+#
+# API requests go through httplib2-style objects (what googleapiclient takes as `http=`),
+# and watch page fetches go through requests transport adapters. Fixtures are keyed the
+# same way as the response cache, so the API key never ends up in them.
+
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import httplib2  # type: ignore
+import requests
+import requests.adapters
+from requests.structures import CaseInsensitiveDict
+
+from updater.response_cache import cache_key
+
+API_FIXTURES = "api"
+WATCH_FIXTURES = "watch"
+
+
+class MissingFixtureError(Exception):
+    pass
+
+
+def _fixture_path(fixture_dir: str, kind: str, method: str, uri: str):
+    return os.path.join(fixture_dir, kind, f"{cache_key(method, uri)}.json")
+
+
+def _save_fixture(
+    fixture_dir: str,
+    kind: str,
+    method: str,
+    uri: str,
+    status: int,
+    headers: Dict[str, str],
+    body: bytes,
+):
+    path = _fixture_path(fixture_dir, kind, method, uri)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as fixture_file:
+        json.dump(
+            {
+                "status": status,
+                "headers": headers,
+                "body": body.decode("utf-8"),
+            },
+            fixture_file,
+        )
+    os.replace(temp_path, path)
+
+
+def _load_fixture(fixture_dir: str, kind: str, method: str, uri: str):
+    path = _fixture_path(fixture_dir, kind, method, uri)
+    try:
+        with open(path, "r") as fixture_file:
+            return json.load(fixture_file)
+    except FileNotFoundError:
+        raise MissingFixtureError(f"No recorded response for {method} {uri}")
+
+
+# Headers which describe the original transfer rather than the content we replay
+_TRANSFER_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+class RecordingHttp:
+    """Passes API requests through to a real HTTP client, saving every response."""
+
+    def __init__(self, fixture_dir: str, inner: Any):
+        self.fixture_dir = fixture_dir
+        self.inner = inner
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        # Recordings should hold full responses rather than 304s
+        headers = {
+            name: value
+            for name, value in (headers or {}).items()
+            if name.lower() != "if-none-match"
+        }
+        response, content = self.inner.request(
+            uri, method=method, body=body, headers=headers, **kwargs
+        )
+        _save_fixture(
+            self.fixture_dir,
+            API_FIXTURES,
+            method,
+            uri,
+            response.status,
+            {
+                name: value
+                for name, value in response.items()
+                if name.lower() not in _TRANSFER_HEADERS and name != "status"
+            },
+            content,
+        )
+        return response, content
+
+
+class ReplayHttp:
+    """Answers API requests from recorded fixtures without touching the network."""
+
+    def __init__(self, fixture_dir: str):
+        self.fixture_dir = fixture_dir
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        fixture = _load_fixture(self.fixture_dir, API_FIXTURES, method, uri)
+        response = httplib2.Response(
+            {**fixture["headers"], "status": fixture["status"]}
+        )
+        return response, fixture["body"].encode("utf-8")
+
+
+def build_response(
+    request: requests.PreparedRequest,
+    status: int,
+    headers: Dict[str, str],
+    body: bytes,
+) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response.url = request.url or ""
+    response.request = request
+    response.encoding = "utf-8"
+    # Marking the content as consumed makes iter_content serve it from memory
+    response._content = body
+    response._content_consumed = True
+    return response
+
+
+class RecordingAdapter(requests.adapters.BaseAdapter):
+    """Passes watch page fetches through to a real adapter, saving every response."""
+
+    def __init__(self, fixture_dir: str, inner: requests.adapters.BaseAdapter):
+        super().__init__()
+        self.fixture_dir = fixture_dir
+        self.inner = inner
+
+    def send(self, request, stream=False, **kwargs):
+        response = self.inner.send(request, stream=stream, **kwargs)
+        body = response.content
+        headers = {
+            name: value
+            for name, value in response.headers.items()
+            if name.lower() not in _TRANSFER_HEADERS
+        }
+        _save_fixture(
+            self.fixture_dir,
+            WATCH_FIXTURES,
+            request.method,
+            request.url,
+            response.status_code,
+            headers,
+            body,
+        )
+        return build_response(request, response.status_code, headers, body)
+
+    def close(self):
+        self.inner.close()
+
+
+class ReplayAdapter(requests.adapters.BaseAdapter):
+    """Answers watch page fetches from recorded fixtures without touching the network."""
+
+    def __init__(self, fixture_dir: str):
+        super().__init__()
+        self.fixture_dir = fixture_dir
+
+    def send(self, request, stream=False, **kwargs):
+        fixture = _load_fixture(
+            self.fixture_dir, WATCH_FIXTURES, request.method, request.url
+        )
+        return build_response(
+            request,
+            fixture["status"],
+            fixture["headers"],
+            fixture["body"].encode("utf-8"),
+        )
+
+    def close(self):
+        pass
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+def cache_key(method: str, uri: str):
+    """Identify a request by everything except the API key, which must never hit disk."""
+    scheme, netloc, path, query, _ = urlsplit(uri)
+    params = sorted((k, v) for k, v in parse_qsl(query) if k != "key")
+    normalized_uri = urlunsplit((scheme, netloc, path, urlencode(params), ""))
+    return hashlib.sha256(f"{method} {normalized_uri}".encode()).hexdigest()
+
+
+class ResponseCache:
+    """On-disk store of YouTube Data API response bodies along with their ETags.
+
+    Every entry is its own file so that concurrent workers never contend over an index.
+    Files are touched when they're served, and prune() drops the least recently used ones
+    until the store fits within max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Tuple[str, Any]]:
+        try:
+            with open(self._path(key), "r") as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+        return entry["etag"], entry["body"]
+
+    def put(self, key: str, etag: str, body: Any):
+        path = self._path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as entry_file:
+            json.dump({"etag": etag, "body": body}, entry_file)
+        os.replace(temp_path, path)
+
+    def touch(self, key: str):
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def cached_videos(self) -> Dict[str, Any]:
+        """Video ID -> Raw video resource, for every video in a cached videos.list response.
+
+        Only resources with both their snippet and contentDetails parts are included.
+        """
+        videos = {}
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "r") as entry_file:
+                    body = json.load(entry_file)["body"]
+            except (OSError, ValueError, KeyError):
+                continue
+            for item in body.get("items", []):
+                if (
+                    item.get("kind", "youtube#video") == "youtube#video"
+                    and isinstance(item.get("id"), str)
+                    and "snippet" in item
+                    and "contentDetails" in item
+                    and "duration" in item["contentDetails"]
+                ):
+                    videos[item["id"]] = item
+        return videos
+
+    def prune(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        # Oldest first
+        for _, size, name in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total_bytes -= size
@@ -0,0 +1,76 @@
+import os
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional
+
+from dataclasses_json import DataClassJsonMixin, config
+
+from updater.seen_ids import PackedIdSet
+
+
+@dataclass
+class ChannelCursor:
+    """Where to continue scanning a channel whose scan was cut short."""
+
+    # Page to continue from, or None to start over from the first page
+    page_token: Optional[str] = None
+    # How many times scanning this channel has been interrupted
+    attempts: int = 0
+
+
+@dataclass
+class StageProgress:
+    """Progress through one stage of a run: scanning streams or scanning clips."""
+
+    # Channels which have been scanned to the end and merged
+    completed_channels: List[str] = field(default_factory=list)
+    # Channels which were given up on for this run without being scanned to the end
+    failed_channels: List[str] = field(default_factory=list)
+    # Channel ID -> Cursor for channels that were only partially scanned
+    cursors: Dict[str, ChannelCursor] = field(default_factory=dict)
+    # Every video ID encountered so far, needed to reconcile deletions at the end
+    seen_ids: PackedIdSet = field(
+        default_factory=PackedIdSet,
+        metadata=config(
+            encoder=PackedIdSet.to_compact_json, decoder=PackedIdSet.from_json
+        ),
+    )
+    # Whether the stage ran to completion, including reconciliation
+    finished: bool = False
+
+    def copy(self) -> "StageProgress":
+        return StageProgress(
+            completed_channels=list(self.completed_channels),
+            failed_channels=list(self.failed_channels),
+            cursors={
+                channel_id: replace(cursor)
+                for channel_id, cursor in self.cursors.items()
+            },
+            seen_ids=self.seen_ids.copy(),
+            finished=self.finished,
+        )
+
+
+@dataclass
+class ResumeJournal(DataClassJsonMixin):
+    """Everything needed to pick up an interrupted run where it stopped."""
+
+    # Whether the interrupted run was an incremental one
+    incremental: bool = False
+    streams: StageProgress = field(default_factory=StageProgress)
+    clips: StageProgress = field(default_factory=StageProgress)
+
+    def copy(self) -> "ResumeJournal":
+        """A copy to encode while this one goes on changing, which is cheap to take."""
+        return ResumeJournal(self.incremental, self.streams.copy(), self.clips.copy())
+
+
+def load_journal(path: str) -> Optional[ResumeJournal]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as journal_file:
+        return ResumeJournal.from_json(journal_file.read())
+
+
+def delete_journal(path: str):
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,189 @@
+import base64
+import re
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Any, Iterable, Iterator, List, Set, Union
+
+# YouTube video IDs are 11 base64url characters encoding 64 bits, so the last character
+# only carries 4 bits and its low 2 bits are always zero. Anything else stays a string.
+_PACKABLE_ID = re.compile(r"[A-Za-z0-9_-]{10}[AEIMQUYcgkosw048]")
+_ALL_PACKABLE_IDS = re.compile(r"(?:[A-Za-z0-9_-]{10}[AEIMQUYcgkosw048]\n)*")
+# Buffered additions are merged into the sorted array once there are this many
+_MAX_PENDING = 1024
+
+
+def _to_big_endian(packed: array) -> bytes:
+    if sys.byteorder == "little":
+        packed = array("Q", packed)
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _from_big_endian(raw: bytes) -> array:
+    packed = array("Q")
+    packed.frombytes(raw)
+    if sys.byteorder == "little":
+        packed.byteswap()
+    return packed
+
+
+def pack_ids(video_ids: List[str]) -> array:
+    """Decode packable video IDs to 64-bit integers, in the same order."""
+    # Each ID is 66 bits of base64, i.e. 8 bytes and 2 zero bits. Appending an "A" makes
+    # it exactly 9 bytes, so a whole list decodes in one go and the IDs stay aligned.
+    raw = base64.urlsafe_b64decode("A".join(video_ids) + "A" if video_ids else "")
+    ids = bytearray(8 * len(video_ids))
+    for byte in range(8):
+        ids[byte::8] = raw[byte::9]
+    return _from_big_endian(bytes(ids))
+
+
+def unpack_ids(packed: array) -> List[str]:
+    """Encode 64-bit integers back to video IDs, in the same order."""
+    ids = _to_big_endian(packed)
+    raw = bytearray(9 * len(packed))
+    for byte in range(8):
+        raw[byte::9] = ids[byte::8]
+    encoded = base64.urlsafe_b64encode(bytes(raw)).decode()
+    return [encoded[start : start + 11] for start in range(0, len(encoded), 12)]
+
+
+class PackedIdSet:
+    """A set of video IDs stored as a sorted array of 64-bit integers.
+
+    Uses about 8 bytes per ID, where a set of strings uses over 100. IDs that don't look
+    like YouTube video IDs are kept as strings on the side, so nothing is lost.
+
+    Additions go into a small buffer which is merged into the array in batches. Membership
+    tests are safe to run on other threads while one thread adds IDs, since the buffer is
+    always read before the array and the array is always replaced before the buffer.
+    """
+
+    def __init__(self, video_ids: Iterable[str] = ()):
+        self._packed = array("Q")
+        self._pending: Set[int] = set()
+        self._unpackable: Set[str] = set()
+        self.update(video_ids)
+
+    @classmethod
+    def from_json(cls, value: Union[List[str], Any]) -> "PackedIdSet":
+        """Read either a list of IDs, or the output of to_compact_json."""
+        if isinstance(value, list):
+            return cls(value)
+        id_set = cls()
+        id_set._packed = _from_big_endian(base64.b64decode(value["packed"]))
+        id_set._unpackable = set(value["unpackable"])
+        return id_set
+
+    def to_compact_json(self):
+        """A much smaller alternative to a list of IDs, readable by from_json."""
+        self._merge_pending()
+        return {
+            "packed": base64.b64encode(_to_big_endian(self._packed)).decode(),
+            "unpackable": sorted(self._unpackable),
+        }
+
+    def copy(self) -> "PackedIdSet":
+        id_set = PackedIdSet()
+        # Arrays are always replaced rather than changed in place, so they can be shared
+        id_set._packed = self._packed
+        id_set._pending = set(self._pending)
+        id_set._unpackable = set(self._unpackable)
+        return id_set
+
+    def _merge_pending(self):
+        if len(self._pending) == 0:
+            return
+        merged = array("Q", sorted(self._packed + array("Q", self._pending)))
+        self._packed = merged
+        self._pending = set()
+
+    def _contains_packed(self, packed_id: int):
+        pending = self._pending
+        packed = self._packed
+        if packed_id in pending:
+            return True
+        index = bisect_left(packed, packed_id)
+        return index < len(packed) and packed[index] == packed_id
+
+    def add(self, video_id: str):
+        if _PACKABLE_ID.fullmatch(video_id) is None:
+            self._unpackable.add(video_id)
+            return
+        packed_id = pack_ids([video_id])[0]
+        if self._contains_packed(packed_id):
+            return
+        self._pending.add(packed_id)
+        if len(self._pending) >= _MAX_PENDING:
+            self._merge_pending()
+
+    def update(self, video_ids: Iterable[str]):
+        packable = list(video_ids)
+        # Checking the IDs all at once is much faster, and they're almost always all valid
+        if _ALL_PACKABLE_IDS.fullmatch("\n".join(packable) + "\n") is None:
+            self._unpackable.update(
+                video_id
+                for video_id in packable
+                if _PACKABLE_ID.fullmatch(video_id) is None
+            )
+            packable = [
+                video_id
+                for video_id in packable
+                if _PACKABLE_ID.fullmatch(video_id) is not None
+            ]
+        if len(packable) == 0:
+            return
+        self._merge_pending()
+        added = set(pack_ids(packable))
+        if len(self._packed) > 0:
+            added.update(self._packed)
+        self._packed = array("Q", sorted(added))
+
+    def __contains__(self, video_id: object):
+        if not isinstance(video_id, str):
+            return False
+        if _PACKABLE_ID.fullmatch(video_id) is None:
+            return video_id in self._unpackable
+        return self._contains_packed(pack_ids([video_id])[0])
+
+    def __len__(self):
+        return len(self._packed) + len(self._pending) + len(self._unpackable)
+
+    def __iter__(self) -> Iterator[str]:
+        self._merge_pending()
+        yield from unpack_ids(self._packed)
+        yield from self._unpackable
+
+    def __sub__(self, video_ids: Iterable[str]) -> "PackedIdSet":
+        to_remove = PackedIdSet(video_ids)
+        to_remove._merge_pending()
+        self._merge_pending()
+        # Walk both sorted arrays, copying the runs between removed IDs in bulk
+        packed = self._packed
+        kept = array("Q")
+        start = 0
+        for packed_id in to_remove._packed:
+            index = bisect_left(packed, packed_id, start)
+            if index < len(packed) and packed[index] == packed_id:
+                kept += packed[start:index]
+                start = index + 1
+        kept += packed[start:]
+        difference = PackedIdSet()
+        difference._packed = kept
+        difference._unpackable = self._unpackable - to_remove._unpackable
+        return difference
+
+    def __eq__(self, other: object):
+        if isinstance(other, PackedIdSet):
+            self._merge_pending()
+            other._merge_pending()
+            return (
+                self._packed == other._packed and self._unpackable == other._unpackable
+            )
+        if isinstance(other, (set, frozenset)):
+            return set(self) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"PackedIdSet({sorted(self)!r})"
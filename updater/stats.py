@@ -1,2 +0,0 @@
-total_quota_usage = 0
-total_html_requests = 0
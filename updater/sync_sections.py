@@ -0,0 +1,122 @@
+import json
+import re
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from updater.codec import clip_from_dict, holocraft_data_from_dict, stream_from_dict
+from updater.holocraft_data import HolocraftClip, HolocraftData, HolocraftStream
+
+# Reads parts of the sync file without parsing the rest of it.
+#
+# The sync file is written with json.dumps(..., indent=2), so every top-level key starts a
+# line indented by exactly two spaces, and every record in a section one indented by four.
+# Strings can't contain raw newlines, so nothing else can look like those lines. Files in
+# any other layout are parsed whole instead.
+
+# Everything emitting client data needs from the sync data
+CLIENT_DATA_SECTIONS = ["members", "craft_streams", "craft_clips"]
+# How much of the file to read at a time
+CHUNK_BYTES = 1024 * 1024
+# Longer than any line that starts a section, so one split across chunks is always found
+_CARRY_BYTES = 256
+_LAYOUT_PREFIX = b'{\n  "'
+_SECTION_START = re.compile(rb'\n  ("(?:[^"\\]|\\.)*"): ')
+_RECORD_START = re.compile(rb'\n    ("(?:[^"\\]|\\.)*"): ')
+
+
+def _trim_value(value: bytes, is_last: bool) -> bytes:
+    value = value.rstrip()
+    if is_last:
+        # The last section runs up to the end of the top-level object
+        value = value[:-1].rstrip()
+    return value[:-1] if value.endswith(b",") else value
+
+
+def _section_values(
+    sync_file: IO[bytes], sections: Iterable[str]
+) -> Iterator[Tuple[str, bytes]]:
+    # Yields the encoded value of each wanted section. Unwanted sections are read past a
+    # chunk at a time, without being kept or parsed.
+    wanted = set(sections)
+    name: Optional[str] = None
+    parts: List[bytes] = []
+    carry = sync_file.read(len(_LAYOUT_PREFIX))
+    while True:
+        chunk = sync_file.read(CHUNK_BYTES)
+        data = carry + chunk
+        position = 0
+        # Starts of sections past the cutoff might be split, so they wait for the next chunk
+        cutoff = len(data) - _CARRY_BYTES if chunk else len(data)
+        for match in _SECTION_START.finditer(data):
+            if match.start() >= cutoff:
+                break
+            if name in wanted:
+                parts.append(data[position : match.start()])
+                yield name, _trim_value(b"".join(parts), False)
+                parts = []
+            name = json.loads(match.group(1))
+            position = match.end()
+        cutoff = max(cutoff, position)
+        if name in wanted:
+            parts.append(data[position:cutoff])
+        carry = data[cutoff:]
+        if not chunk:
+            break
+    if name in wanted:
+        yield name, _trim_value(b"".join(parts), True)
+
+
+def _has_layout(sync_file: IO[bytes]) -> bool:
+    is_indented = sync_file.read(len(_LAYOUT_PREFIX)) == _LAYOUT_PREFIX
+    sync_file.seek(0)
+    return is_indented
+
+
+def load_raw_sections(path: str, sections: Iterable[str]) -> Dict[str, Any]:
+    """Top-level section name -> Decoded JSON value, for each of sections in the file."""
+    sections = list(sections)
+    with open(path, "rb") as sync_file:
+        if not _has_layout(sync_file):
+            raw = json.load(sync_file)
+            return {section: raw[section] for section in sections if section in raw}
+        return {
+            section: json.loads(value)
+            for section, value in _section_values(sync_file, sections)
+        }
+
+
+def load_sections(path: str, sections: Iterable[str]) -> HolocraftData:
+    """Sync data with only the given sections loaded, and everything else left empty.
+
+    Data loaded this way must never be written back over the sync file.
+    """
+    return holocraft_data_from_dict(load_raw_sections(path, sections))
+
+
+def _records(section: bytes) -> Iterator[Tuple[str, Any]]:
+    matches = list(_RECORD_START.finditer(section))
+    for index, match in enumerate(matches):
+        is_last = index + 1 == len(matches)
+        end = len(section) if is_last else matches[index + 1].start()
+        yield json.loads(match.group(1)), json.loads(
+            _trim_value(section[match.end() : end], is_last)
+        )
+
+
+def iter_raw_records(path: str, section: str) -> Iterator[Tuple[str, Any]]:
+    """(Key, Decoded JSON value) for each record of a section, decoded one at a time."""
+    with open(path, "rb") as sync_file:
+        if not _has_layout(sync_file):
+            yield from json.load(sync_file).get(section, {}).items()
+            return
+        for _, value in _section_values(sync_file, [section]):
+            yield from _records(value)
+
+
+def iter_craft_streams(path: str) -> Iterator[Tuple[str, HolocraftStream]]:
+    for video_id, stream in iter_raw_records(path, "craft_streams"):
+        yield video_id, stream_from_dict(stream)
+
+
+def iter_craft_clips(path: str) -> Iterator[Tuple[str, HolocraftClip]]:
+    for video_id, clip in iter_raw_records(path, "craft_clips"):
+        yield video_id, clip_from_dict(clip)
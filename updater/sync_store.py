@@ -0,0 +1,567 @@
+# Where the sync data is kept between runs: the JSON sync file, or a SQLite database.
+#
+# The JSON file is rewritten whole on every save. The SQLite database keeps streams, clips,
+# the source streams of each clip and seen videos in indexed tables, and each save only
+# writes the rows that changed since the last one, in a single transaction.
+#
+# Usage, to move the sync data between the two without losing anything:
+#   python -m updater.sync_store import [--json PATH] [--sqlite PATH]
+#   python -m updater.sync_store export [--json PATH] [--sqlite PATH]
+
+import argparse
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import closing
+from dataclasses import dataclass
+from timeit import default_timer
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from updater.checkpoint import write_json_atomically
+from updater.codec import (
+    dumps_holocraft_data,
+    holocraft_data_from_dict,
+    holocraft_data_to_dict,
+    loads_holocraft_data,
+)
+from updater.holocraft_data import HolocraftData, SyncChanges
+from updater.sync_sections import load_raw_sections, load_sections
+
+# Bumped whenever the tables change in a way older code can't read
+SQLITE_SCHEMA_VERSION = 1
+
+# Rows are kept in the order they were added, so the sync data loads back exactly as it
+# was saved. Replacing a row keeps its position, like replacing a key in a dict does.
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS members (
+    position INTEGER PRIMARY KEY,
+    member TEXT NOT NULL UNIQUE,
+    channel_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    channel_image_url TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS clippers (
+    position INTEGER PRIMARY KEY,
+    channel_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS upload_playlists (
+    position INTEGER PRIMARY KEY,
+    channel_id TEXT NOT NULL UNIQUE,
+    playlist_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS seen_channels (
+    position INTEGER PRIMARY KEY,
+    channel_id TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS seen_videos (
+    channel_id TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    PRIMARY KEY (channel_id, video_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS streams (
+    position INTEGER PRIMARY KEY,
+    video_id TEXT NOT NULL UNIQUE,
+    member TEXT NOT NULL,
+    published_at TEXT NOT NULL,
+    title TEXT NOT NULL,
+    duration TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS streams_by_member ON streams (member, published_at);
+CREATE INDEX IF NOT EXISTS streams_by_published_at ON streams (published_at);
+CREATE TABLE IF NOT EXISTS clips (
+    position INTEGER PRIMARY KEY,
+    video_id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    duration TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS clip_sources (
+    clip_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    stream_id TEXT NOT NULL,
+    PRIMARY KEY (clip_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS clip_sources_by_stream ON clip_sources (stream_id);
+"""
+
+# Tables written whole on every save, since they only have a row or so per channel
+_SMALL_TABLES = ["meta", "members", "clippers", "upload_playlists", "seen_channels"]
+_ALL_TABLES = _SMALL_TABLES + ["seen_videos", "streams", "clips", "clip_sources"]
+
+_UPSERT_STREAM = """
+INSERT INTO streams (video_id, member, published_at, title, duration)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (video_id) DO UPDATE SET
+    member = excluded.member,
+    published_at = excluded.published_at,
+    title = excluded.title,
+    duration = excluded.duration
+"""
+_UPSERT_CLIP = """
+INSERT INTO clips (video_id, title, duration) VALUES (?, ?, ?)
+ON CONFLICT (video_id) DO UPDATE SET
+    title = excluded.title,
+    duration = excluded.duration
+"""
+
+StreamRow = Tuple[str, str, str, str, str]
+ClipRow = Tuple[str, str, str, List[str]]
+
+
+class SyncStore(ABC):
+    """Loads and saves the sync data.
+
+    Saving is split in two so checkpoints can run in the background: snapshot copies what
+    needs saving while the caller holds the data lock, and write saves the copy.
+    """
+
+    @abstractmethod
+    def load(self, sections: Optional[List[str]] = None) -> HolocraftData:
+        """Load the sync data, or only the given top-level sections of it.
+
+        Data with only some sections loaded must never be saved.
+        """
+
+    @abstractmethod
+    def load_raw(self, sections: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Like load, but as the dict HolocraftData.to_dict would give, without parsing
+        it, so migrations can fix up data the current schema can't load yet.
+        """
+
+    @abstractmethod
+    def snapshot(self, data: HolocraftData) -> Any:
+        pass
+
+    @abstractmethod
+    def write(self, snapshot: Any):
+        pass
+
+    def save(self, data: HolocraftData):
+        self.write(self.snapshot(data))
+
+
+class JsonSyncStore(SyncStore):
+    """The sync data as one indented JSON file, rewritten whole on every save."""
+
+    def __init__(self, path: str, compact_seen_videos: bool = False):
+        self.path = path
+        # Whether to save seen video IDs in their compact form rather than as sorted lists
+        self.compact_seen_videos = compact_seen_videos
+
+    def load(self, sections: Optional[List[str]] = None) -> HolocraftData:
+        if sections is not None:
+            return load_sections(self.path, sections)
+        with open(self.path, "r") as sync_file:
+            return loads_holocraft_data(sync_file.read())
+
+    def load_raw(self, sections: Optional[List[str]] = None) -> Dict[str, Any]:
+        if sections is not None:
+            return load_raw_sections(self.path, sections)
+        with open(self.path, "r") as sync_file:
+            return json.load(sync_file)
+
+    def snapshot(self, data: HolocraftData) -> HolocraftData:
+        # Encoding sorts every seen set, which mustn't hold up the data lock
+        return data.copy()
+
+    def write(self, snapshot: HolocraftData):
+        write_json_atomically(
+            self.path,
+            holocraft_data_to_dict(snapshot, self.compact_seen_videos),
+            dumps_holocraft_data,
+        )
+
+
+@dataclass
+class _SqliteSnapshot:
+    # A copy of the sync data, when it's all rewritten rather than just what changed
+    everything: Optional[HolocraftData]
+    # What changed, to be handed back if it isn't written
+    changes: Optional[SyncChanges]
+    # Rows of the small tables
+    meta: List[Tuple[str, Any]]
+    members: List[Tuple[str, str, str, str]]
+    clippers: List[Tuple[str]]
+    upload_playlists: List[Tuple[str, str]]
+    seen_channels: List[Tuple[str]]
+    # (Video ID, Whether to move it to the end, Row or None if it's gone) of each change
+    streams: List[Tuple[str, bool, Optional[StreamRow]]]
+    clips: List[Tuple[str, bool, Optional[ClipRow]]]
+    # Channel ID -> Video IDs
+    seen_added: Dict[str, Set[str]]
+    seen_removed: Dict[str, Set[str]]
+    # Channels whose seen videos are all gone, or are all about to be saved again
+    gone_channels: List[str]
+
+
+def _stream_row(data: HolocraftData, video_id: str) -> Optional[StreamRow]:
+    stream = data.craft_streams.get(video_id)
+    if stream is None:
+        return None
+    published_at = stream.published_at.isoformat()
+    return (video_id, stream.member, published_at, stream.title, stream.duration)
+
+
+def _clip_row(data: HolocraftData, video_id: str) -> Optional[ClipRow]:
+    clip = data.craft_clips.get(video_id)
+    if clip is None:
+        return None
+    return (video_id, clip.title, clip.duration, list(clip.source_streams))
+
+
+class SqliteSyncStore(SyncStore):
+    """The sync data in a SQLite database, saved a changed row at a time.
+
+    Data loaded from the store tracks its changes, so each save after the first is a
+    single transaction with only the streams, clips and seen videos that changed since.
+    Data from anywhere else is written whole the first time it's saved. Changes from a
+    write that fails are written with the next snapshot instead, so snapshots must be
+    written one at a time, in the order they were taken.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Channels with seen videos as of the last snapshot, to notice any that went away
+        self._seen_channels: Set[str] = set()
+        # What the last snapshot would have saved, if writing it failed
+        self._unwritten: Optional[SyncChanges] = None
+        self._unwritten_gone_channels: Set[str] = set()
+        self._rewrite_everything = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per load or write, since checkpoints are written on another thread
+        connection = sqlite3.connect(self.path)
+        connection.executescript(_SQLITE_SCHEMA)
+        return connection
+
+    def load(self, sections: Optional[List[str]] = None) -> HolocraftData:
+        data = holocraft_data_from_dict(self.load_raw(sections))
+        if sections is None:
+            data.track_changes()
+            self._seen_channels = set(data.seen_videos)
+        return data
+
+    def load_raw(self, sections: Optional[List[str]] = None) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"No sync database at {self.path}")
+        wanted = set(sections) if sections is not None else None
+        raw: Dict[str, Any] = {}
+        with closing(self._connect()) as connection:
+            version = connection.execute(
+                "SELECT value FROM meta WHERE key = 'schema_version'"
+            ).fetchone()
+            if version is None or version[0] != SQLITE_SCHEMA_VERSION:
+                raise ValueError(f"Unsupported sync database schema: {version}")
+            for section, load_section in _SECTION_LOADERS.items():
+                if wanted is None or section in wanted:
+                    raw[section] = load_section(connection)
+        return raw
+
+    def snapshot(self, data: HolocraftData) -> _SqliteSnapshot:
+        changes = data.take_changes()
+        if changes is not None and self._unwritten is not None:
+            self._unwritten.merge(changes)
+            changes = self._unwritten
+        self._unwritten = None
+        everything = None
+        if changes is None or self._rewrite_everything:
+            # Nothing to go on, so everything is rewritten and tracked from here on.
+            # Encoding happens when it's written, since the data lock is held here.
+            everything = data.copy()
+            changes = None
+            data.track_changes()
+        self._rewrite_everything = False
+        seen_channels = set(data.seen_videos)
+        # Those that went away in a snapshot that wasn't written still need their rows
+        # deleted, even if they've come back and are about to be saved whole
+        gone_channels = (
+            self._seen_channels - seen_channels
+        ) | self._unwritten_gone_channels
+        self._unwritten_gone_channels = set()
+        seen_added: Dict[str, Set[str]] = {}
+        if changes is not None:
+            seen_added = changes.seen_added
+            for channel_seen in [seen_added, changes.seen_removed]:
+                # Channels that went away since have nothing left to save
+                for channel_id in channel_seen.keys() - seen_channels:
+                    del channel_seen[channel_id]
+            for channel_id in seen_channels - self._seen_channels:
+                # Channels can start out with IDs, so those of new ones are saved whole
+                seen_added[channel_id] = set(data.seen_videos[channel_id])
+        self._seen_channels = seen_channels
+        return _SqliteSnapshot(
+            everything=everything,
+            changes=changes,
+            meta=[
+                ("schema_version", SQLITE_SCHEMA_VERSION),
+                ("incremental_runs", data.incremental_runs),
+            ],
+            members=[
+                (member_name, member.channel_id, member.name, member.channel_image_url)
+                for member_name, member in data.members.items()
+            ],
+            clippers=[(channel_id,) for channel_id in data.clippers],
+            upload_playlists=list(data.upload_playlists.items()),
+            seen_channels=[(channel_id,) for channel_id in data.seen_videos],
+            streams=[
+                (video_id, moved, _stream_row(data, video_id))
+                for video_id, moved in (changes.streams.items() if changes else [])
+            ],
+            clips=[
+                (video_id, moved, _clip_row(data, video_id))
+                for video_id, moved in (changes.clips.items() if changes else [])
+            ],
+            seen_added=seen_added,
+            seen_removed=changes.seen_removed if changes else {},
+            gone_channels=sorted(gone_channels),
+        )
+
+    def write(self, snapshot: _SqliteSnapshot):
+        try:
+            self._write(snapshot)
+        except Exception:
+            # Nothing was committed, so the next snapshot has to make up for it
+            if snapshot.changes is None:
+                self._rewrite_everything = True
+            else:
+                self._unwritten = snapshot.changes
+                self._unwritten_gone_channels.update(snapshot.gone_channels)
+            raise
+
+    def _write(self, snapshot: _SqliteSnapshot):
+        with closing(self._connect()) as connection:
+            # Commits everything at once, or nothing if anything fails
+            with connection:
+                tables = (
+                    _ALL_TABLES if snapshot.everything is not None else _SMALL_TABLES
+                )
+                for table in tables:
+                    connection.execute(f"DELETE FROM {table}")
+                connection.executemany("INSERT INTO meta VALUES (?, ?)", snapshot.meta)
+                connection.executemany(
+                    "INSERT INTO members (member, channel_id, name, channel_image_url) "
+                    "VALUES (?, ?, ?, ?)",
+                    snapshot.members,
+                )
+                connection.executemany(
+                    "INSERT INTO clippers (channel_id) VALUES (?)", snapshot.clippers
+                )
+                connection.executemany(
+                    "INSERT INTO upload_playlists (channel_id, playlist_id) "
+                    "VALUES (?, ?)",
+                    snapshot.upload_playlists,
+                )
+                connection.executemany(
+                    "INSERT INTO seen_channels (channel_id) VALUES (?)",
+                    snapshot.seen_channels,
+                )
+                if snapshot.everything is not None:
+                    _write_everything(
+                        connection, holocraft_data_to_dict(snapshot.everything)
+                    )
+                else:
+                    _write_changes(connection, snapshot)
+
+
+def _write_everything(connection: sqlite3.Connection, raw: Dict[str, Any]):
+    connection.executemany(
+        "INSERT INTO seen_videos VALUES (?, ?)",
+        (
+            (channel_id, video_id)
+            for channel_id, video_ids in raw["seen_videos"].items()
+            for video_id in video_ids
+        ),
+    )
+    connection.executemany(
+        "INSERT INTO streams (video_id, member, published_at, title, duration) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (
+            (
+                video_id,
+                stream["member"],
+                stream["published_at"],
+                stream["title"],
+                stream["duration"],
+            )
+            for video_id, stream in raw["craft_streams"].items()
+        ),
+    )
+    connection.executemany(
+        "INSERT INTO clips (video_id, title, duration) VALUES (?, ?, ?)",
+        (
+            (video_id, clip["title"], clip["duration"])
+            for video_id, clip in raw["craft_clips"].items()
+        ),
+    )
+    connection.executemany(
+        "INSERT INTO clip_sources VALUES (?, ?, ?)",
+        (
+            (video_id, position, stream_id)
+            for video_id, clip in raw["craft_clips"].items()
+            for position, stream_id in enumerate(clip["source_streams"])
+        ),
+    )
+
+
+def _write_changes(connection: sqlite3.Connection, snapshot: _SqliteSnapshot):
+    connection.executemany(
+        "DELETE FROM seen_videos WHERE channel_id = ?",
+        ((channel_id,) for channel_id in snapshot.gone_channels),
+    )
+    for channel_id, video_ids in snapshot.seen_removed.items():
+        connection.executemany(
+            "DELETE FROM seen_videos WHERE channel_id = ? AND video_id = ?",
+            ((channel_id, video_id) for video_id in video_ids),
+        )
+    for channel_id, video_ids in snapshot.seen_added.items():
+        connection.executemany(
+            "INSERT OR IGNORE INTO seen_videos VALUES (?, ?)",
+            ((channel_id, video_id) for video_id in video_ids),
+        )
+    for video_id, moved, stream_row in snapshot.streams:
+        if moved or stream_row is None:
+            connection.execute("DELETE FROM streams WHERE video_id = ?", (video_id,))
+        if stream_row is not None:
+            connection.execute(_UPSERT_STREAM, stream_row)
+    for video_id, moved, clip_row in snapshot.clips:
+        if moved or clip_row is None:
+            connection.execute("DELETE FROM clips WHERE video_id = ?", (video_id,))
+        connection.execute("DELETE FROM clip_sources WHERE clip_id = ?", (video_id,))
+        if clip_row is not None:
+            connection.execute(_UPSERT_CLIP, clip_row[:3])
+            connection.executemany(
+                "INSERT INTO clip_sources VALUES (?, ?, ?)",
+                (
+                    (video_id, position, stream_id)
+                    for position, stream_id in enumerate(clip_row[3])
+                ),
+            )
+
+
+def _load_members(connection: sqlite3.Connection) -> Dict[str, Any]:
+    return {
+        member: {"channel_id": channel_id, "name": name, "channel_image_url": url}
+        for member, channel_id, name, url in connection.execute(
+            "SELECT member, channel_id, name, channel_image_url FROM members "
+            "ORDER BY position"
+        )
+    }
+
+
+def _load_seen_videos(connection: sqlite3.Connection) -> Dict[str, Any]:
+    seen_videos: Dict[str, List[str]] = {
+        channel_id: []
+        for channel_id, in connection.execute(
+            "SELECT channel_id FROM seen_channels ORDER BY position"
+        )
+    }
+    for channel_id, video_id in connection.execute(
+        "SELECT channel_id, video_id FROM seen_videos"
+    ):
+        seen_videos[channel_id].append(video_id)
+    return seen_videos
+
+
+def _load_craft_streams(connection: sqlite3.Connection) -> Dict[str, Any]:
+    return {
+        video_id: {
+            "member": member,
+            "published_at": published_at,
+            "title": title,
+            "duration": duration,
+        }
+        for video_id, member, published_at, title, duration in connection.execute(
+            "SELECT video_id, member, published_at, title, duration FROM streams "
+            "ORDER BY position"
+        )
+    }
+
+
+def _load_craft_clips(connection: sqlite3.Connection) -> Dict[str, Any]:
+    source_streams: Dict[str, List[str]] = {}
+    for clip_id, stream_id in connection.execute(
+        "SELECT clip_id, stream_id FROM clip_sources ORDER BY clip_id, position"
+    ):
+        source_streams.setdefault(clip_id, []).append(stream_id)
+    return {
+        video_id: {
+            "source_streams": source_streams.get(video_id, []),
+            "title": title,
+            "duration": duration,
+        }
+        for video_id, title, duration in connection.execute(
+            "SELECT video_id, title, duration FROM clips ORDER BY position"
+        )
+    }
+
+
+_SECTION_LOADERS = {
+    "members": _load_members,
+    "clippers": lambda connection: [
+        channel_id
+        for channel_id, in connection.execute(
+            "SELECT channel_id FROM clippers ORDER BY position"
+        )
+    ],
+    "upload_playlists": lambda connection: dict(
+        connection.execute(
+            "SELECT channel_id, playlist_id FROM upload_playlists ORDER BY position"
+        ).fetchall()
+    ),
+    "seen_videos": _load_seen_videos,
+    "craft_streams": _load_craft_streams,
+    "craft_clips": _load_craft_clips,
+    "incremental_runs": lambda connection: connection.execute(
+        "SELECT value FROM meta WHERE key = 'incremental_runs'"
+    ).fetchone()[0],
+}
+
+
+def copy_sync_data(source: SyncStore, destination: SyncStore):
+    """Save everything in source to destination, checking nothing was lost on the way."""
+    started = default_timer()
+    data = source.load()
+    # A fresh copy, so the destination writes everything rather than what data tracked
+    destination.save(holocraft_data_from_dict(holocraft_data_to_dict(data)))
+    if holocraft_data_to_dict(destination.load()) != holocraft_data_to_dict(data):
+        raise ValueError("Sync data didn't survive the copy unchanged")
+    print(
+        f"Copied {len(data.craft_streams)} streams and {len(data.craft_clips)} clips "
+        f"in {default_timer() - started:.2f} seconds"
+    )
+
+
+def main():
+    from updater.update_holocraft import DATAFILE_PATH, SQLITE_DATAFILE_PATH
+
+    parser = argparse.ArgumentParser(
+        description="Copy the sync data between the JSON file and the SQLite database"
+    )
+    parser.add_argument(
+        "direction",
+        choices=["import", "export"],
+        help="import the JSON file into the database, or export the database to it",
+    )
+    parser.add_argument("--json", default=DATAFILE_PATH, help="JSON sync file")
+    parser.add_argument("--sqlite", default=SQLITE_DATAFILE_PATH, help="Sync database")
+    parser.add_argument(
+        "--compact-seen-videos",
+        action="store_true",
+        help="Export seen video IDs as packed base64 instead of sorted lists",
+    )
+    args = parser.parse_args()
+
+    json_store = JsonSyncStore(args.json, args.compact_seen_videos)
+    sqlite_store = SqliteSyncStore(args.sqlite)
+    if args.direction == "import":
+        copy_sync_data(json_store, sqlite_store)
+    else:
+        copy_sync_data(sqlite_store, json_store)
+
+
+if __name__ == "__main__":
+    main()
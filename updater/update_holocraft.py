@@ -1,39 +1,166 @@
+import argparse
+import gzip
 import json
+import os
 import re
+import signal
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, nullcontext
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timedelta, timezone
 from itertools import chain
+from queue import Queue
+from threading import Event
 from timeit import timeit
-from typing import Any, Callable, Set, TypeVar
-
-import googleapiclient.discovery as api  # type: ignore
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Container,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
 
+from updater.api_client import build_youtube
+from updater.checkpoint import CheckpointWriter, indented_json, write_json_atomically
+from updater.classification_cache import ClassificationCache
+from updater.client_versions import (
+    ClientDataVersion,
+    client_data_delta,
+    client_data_fingerprint,
+    is_same_emit,
+    load_client_version,
+)
 from updater.holocraft_data import (
+    SHARD_PERIOD_FORMATS,
     HolocraftClientData,
     HolocraftClip,
     HolocraftData,
     HolocraftStream,
 )
+from updater.metrics import (
+    PLAYLIST_ITEMS_LIST,
+    VIDEOS_LIST,
+    WATCH_PAGE,
+    channel_context,
+    run_metrics,
+)
+from updater.planner import (
+    PlannerState,
+    describe_plan,
+    load_planner_state,
+    plan_scans,
+    record_scans,
+)
+from updater.response_cache import ResponseCache
+from updater.resume import (
+    ChannelCursor,
+    ResumeJournal,
+    StageProgress,
+    delete_journal,
+    load_journal,
+)
+from updater.seen_ids import PackedIdSet
+from updater.sync_store import JsonSyncStore, SqliteSyncStore, SyncStore
 from updater.youtube import (
-    get_html_fetches,
-    get_quota_usage,
+    DEFAULT_FEED_URL_TEMPLATE,
+    DEFAULT_PROBE_CONCURRENCY,
+    PlaylistPage,
+    YouTubeVideoItemResource,
+    channel_feeds,
+    default_http,
+    default_watch_adapter,
     get_upload_playlist_id,
-    is_minecraft_video,
-    playlist_videos,
+    get_videos,
+    playlist_video_pages,
+    probe_minecraft_videos,
+    set_api_concurrency,
+    set_classification_cache,
+    set_feed_url_template,
+    set_probe_concurrency,
+    set_response_cache,
+    set_transports,
 )
 
+if TYPE_CHECKING:
+    import googleapiclient.discovery as api  # type: ignore
+
 # Where all sync metadata is stored
 DATAFILE_PATH = "updater/holocraft_all.json"
+# Where all sync metadata is stored instead, when it's kept in SQLite
+SQLITE_DATAFILE_PATH = "updater/holocraft_all.sqlite3"
+# Sync data stores: the JSON file, or a SQLite database saved a changed row at a time
+STORAGE_JSON = "json"
+STORAGE_SQLITE = "sqlite"
+# Where progress of an interrupted run is kept until it finishes
+RESUME_JOURNAL_PATH = "updater/holocraft_resume.json"
+# How many runs in a row may be interrupted on a channel before we give up on it
+MAX_RESUME_ATTEMPTS = 3
+# Where to write measurements of the latest run
+RUN_REPORT_PATH = "updater/holocraft_run_report.json"
 # Where to emit the data file for rendering on the client
 CLIENT_DATA_PATH = "docs/holocraft.json"
+# Where to emit the compact columnar client data. Precompressed siblings go next to it.
+CLIENT_COLUMNAR_PATH = "docs/holocraft.columnar.json"
+# Client data formats: indented JSON records, or compact columnar JSON
+CLIENT_FORMAT_JSON = "json"
+CLIENT_FORMAT_COLUMNAR = "columnar"
+# Identifies the last emitted client data, so unchanged data isn't rewritten
+CLIENT_VERSION_PATH = "docs/holocraft.version.json"
+# Changes between the previous and current client data, for patching a cached copy
+CLIENT_DELTA_PATH = "docs/holocraft.delta.json"
+# Emit all of the client data into CLIENT_DATA_PATH, rather than sharding it by time
+CLIENT_OUTPUT_SINGLE = "single"
+# Where to emit client data shards and their manifest, when sharding by time
+CLIENT_SHARD_DIR = "docs/holocraft"
+CLIENT_MANIFEST_PATH = "docs/holocraft/manifest.json"
+# Where game classifications of videos are remembered between runs
+CLASSIFICATION_CACHE_PATH = "updater/classification_cache.json"
+# How long to trust a classification before checking the video again
+CLASSIFICATION_TTL = timedelta(days=90)
+# Oldest classifications beyond this many are dropped
+CLASSIFICATION_CACHE_MAX_ENTRIES = 200_000
+# Where learned channel upload rates are kept for planning incremental scans
+PLANNER_STATE_PATH = "updater/scan_planner.json"
+# Where API responses are kept for conditional requests. This isn't committed.
+RESPONSE_CACHE_DIR = "updater/.response_cache"
+# Least recently used responses are dropped once the cache grows past this
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Where the sync data is loaded from and saved to
+_sync_store: SyncStore = JsonSyncStore(DATAFILE_PATH)
+# Writes checkpoints in the background during a run
+_checkpoint_writer: Optional[CheckpointWriter] = None
+
+# Duration YouTube reports for videos that are live or haven't started yet
+PROVISIONAL_DURATION = "P0D"
+
+# How many channels to scan at once
+DEFAULT_CHANNEL_WORKERS = 8
+# How often to scan every channel's full upload history to find deleted videos
+DEFAULT_FULL_SYNC_EVERY = 7
+
+# Classifies a batch of videos, yielding (video, is_craft_video) in any order
+Probe = Callable[
+    [List[YouTubeVideoItemResource]], Iterable[Tuple[YouTubeVideoItemResource, bool]]
+]
 
 
-def ensure_upload_playlists(youtube: api.Resource, data: HolocraftData):
+def ensure_upload_playlists(youtube: "api.Resource", data: HolocraftData):
     for channel_id in chain(
         map(lambda member_info: member_info.channel_id, data.members.values()),
         data.clippers,
     ):
         if channel_id not in data.upload_playlists:
-            upload_playlist_id = get_upload_playlist_id(youtube, channel_id)
+            with channel_context(channel_id):
+                upload_playlist_id = get_upload_playlist_id(youtube, channel_id)
             if upload_playlist_id is not None:
                 print(
                     f"Now tracking upload playlist {upload_playlist_id} for channel {channel_id}"
@@ -43,130 +170,504 @@ def ensure_upload_playlists(youtube: api.Resource, data: HolocraftData):
                 print(f"Failed to get upload playlist for {channel_id}")
 
 
-def update_source_streams(youtube: api.Resource, data: HolocraftData):
-    all_stream_ids = set(data.craft_streams.keys())
-    seen_stream_ids = set()
-    for member_name, member_info in data.members.items():
+@dataclass
+class ScannedPage:
+    """One page of a channel's upload playlist, ready to merge into the data."""
+
+    # Every video ID on the page, in playlist order
+    video_ids: List[str]
+    # Videos not previously seen, in playlist order, with whether they are craft videos
+    new_videos: List[Tuple[YouTubeVideoItemResource, bool]]
+    # Where to resume the scan after this page, or None if it was the last page
+    next_page_token: Optional[str]
+
+
+# Marks the end of a channel's pages in its queue
+_END_OF_CHANNEL = object()
+
+
+def scan_channel(
+    youtube: "api.Resource",
+    channel_id: str,
+    upload_playlist_id: str,
+    seen_videos: PackedIdSet,
+    probe: Optional[Probe],
+    incremental: bool,
+    page_token: Optional[str],
+    output: "Queue[Any]",
+    new_video_ids: Optional[List[str]] = None,
+    stop: Optional[Event] = None,
+):
+    # Runs on a worker thread, so this must only read from the shared data.
+    # seen_videos only grows with videos from pages this worker has already output.
+    with channel_context(channel_id):
         try:
-            print("Processing member channel:", member_name)
-            dirty = False
-            member_channel_id = member_info.channel_id
-            upload_playlist_id = data.upload_playlists[member_channel_id]
-            if member_channel_id not in data.seen_videos:
-                data.seen_videos[member_channel_id] = set()
-
-            for playlist_item in playlist_videos(youtube, upload_playlist_id):
-                snippet = playlist_item.snippet
-                content_details = playlist_item.contentDetails
-
-                video_id = playlist_item.id
-                seen_stream_ids.add(video_id)
-
-                if video_id not in data.seen_videos[member_channel_id]:
-                    dirty = True
-                    if is_minecraft_video(playlist_item):
-                        print(f"{video_id}: {snippet.channelTitle} - {snippet.title}")
-                        # Add this source stream to the holocraft database
-                        data.craft_streams[video_id] = HolocraftStream(
-                            member=member_name,
-                            published_at=snippet.publishedAt,
-                            title=snippet.title,
-                            duration=content_details.duration,
-                        )
-
-                    # Mark this video as seen so we don't process it again
-                    data.seen_videos[member_channel_id].add(video_id)
-
-            # Checkpoint the data to disk after each channel
-            if dirty:
-                write_data(data)
+            if stop is not None and stop.is_set():
+                return
+            pages: Iterable[PlaylistPage]
+            if new_video_ids is not None:
+                # The channel's feed already told us what's new, so just look those up
+                pages = [
+                    PlaylistPage(
+                        new_video_ids, list(get_videos(youtube, new_video_ids))
+                    )
+                ]
+            else:
+                pages = playlist_video_pages(
+                    youtube,
+                    upload_playlist_id,
+                    known_ids=seen_videos,
+                    stop_at_known=incremental,
+                    page_token=page_token,
+                )
+            for page in pages:
+                # Classify the whole page at once so the watch page fetches overlap
+                verdicts = {}
+                if probe is not None and len(page.videos) > 0:
+                    verdicts = {
+                        video.id: verdict for video, verdict in probe(page.videos)
+                    }
+                output.put(
+                    ScannedPage(
+                        page.video_ids,
+                        [
+                            (video, verdicts.get(video.id, False))
+                            for video in page.videos
+                        ],
+                        page.next_page_token,
+                    )
+                )
+                # Nobody will merge any more pages, so don't spend quota on them
+                if stop is not None and stop.is_set():
+                    return
+            output.put(_END_OF_CHANNEL)
         except Exception as e:
-            print(f"Failed to process streams for {member_name}:", e)
-            # This is _probably_ a transient error, so let's not delete all of the member's streams
-            seen_stream_ids.update(
-                streamId
-                for streamId, streamDetails in data.craft_streams.items()
-                if streamDetails.member == member_name
+            output.put(e)
+
+
+def _drain_channel(output: "Queue[Any]") -> Iterator[ScannedPage]:
+    while True:
+        item = output.get()
+        if item is _END_OF_CHANNEL:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def scan_channels(
+    youtube: "api.Resource",
+    data: HolocraftData,
+    channel_ids: List[str],
+    probe: Optional[Probe],
+    workers: int,
+    incremental: bool,
+    page_tokens: Optional[Dict[str, Optional[str]]] = None,
+    feed_video_ids: Optional[Dict[str, List[str]]] = None,
+) -> Generator[Tuple[str, Iterator[ScannedPage]], None, None]:
+    """Scan channels concurrently, yielding each channel's pages in the order of channel_ids.
+
+    The pages of the channel being yielded stream in as they're scanned, while channels
+    further down the list buffer theirs. Merging in a fixed order keeps the output
+    identical to a serial scan no matter which channels happen to finish first. Raises
+    from the page iterator if the channel's scan failed partway through. Channels in
+    feed_video_ids only have those videos looked up, as a single page. Close the
+    generator when done with it, so scans are stopped if merging ends early.
+    """
+    page_tokens = page_tokens if page_tokens is not None else {}
+    feed_video_ids = feed_video_ids if feed_video_ids is not None else {}
+    for channel_id in channel_ids:
+        if channel_id not in data.seen_videos:
+            data.seen_videos[channel_id] = PackedIdSet()
+
+    stop = Event()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        outputs: List["Queue[Any]"] = []
+        for channel_id in channel_ids:
+            output: "Queue[Any]" = Queue()
+            outputs.append(output)
+            executor.submit(
+                scan_channel,
+                youtube,
+                channel_id,
+                data.upload_playlists[channel_id],
+                data.seen_videos[channel_id],
+                probe,
+                incremental,
+                page_tokens.get(channel_id),
+                output,
+                feed_video_ids.get(channel_id),
+                stop,
             )
+        for channel_id, output in zip(channel_ids, outputs):
+            yield channel_id, _drain_channel(output)
+    finally:
+        # Closed early, e.g. on SIGTERM: drop the channels that haven't started, and let
+        # those that have stop after the page they're on
+        stop.set()
+        executor.shutdown(cancel_futures=True)
+
+
+@dataclass
+class FeedCheck:
+    """What channel feeds say about which channels have new videos."""
+
+    # Channels whose feed has nothing we haven't seen
+    unchanged: List[str] = field(default_factory=list)
+    # Channel ID -> New video IDs, for channels whose feed reaches back to a seen video
+    new_video_ids: Dict[str, List[str]] = field(default_factory=dict)
+    # Channels that need a playlist scan: every video in the feed is new, so there may be
+    # more beyond it, or the feed was empty or couldn't be fetched
+    to_scan: List[str] = field(default_factory=list)
+
+
+def check_feeds(data: HolocraftData, channel_ids: List[str]) -> FeedCheck:
+    """Compare the latest uploads in each channel's feed with the videos we've seen."""
+    check = FeedCheck()
+    for channel_id, feed_video_ids in channel_feeds(channel_ids).items():
+        seen_videos = data.seen_videos.get(channel_id, PackedIdSet())
+        if not feed_video_ids:
+            # An empty feed tells us nothing, especially if it isn't a feed at all
+            check.to_scan.append(channel_id)
+            continue
+        new_video_ids = [
+            video_id for video_id in feed_video_ids if video_id not in seen_videos
+        ]
+        if len(new_video_ids) == 0:
+            check.unchanged.append(channel_id)
+        elif len(new_video_ids) < len(feed_video_ids):
+            check.new_video_ids[channel_id] = new_video_ids
+        else:
+            check.to_scan.append(channel_id)
+    print(
+        f"Channel feeds: {len(check.unchanged)} unchanged, "
+        f"{len(check.new_video_ids)} with new videos to look up, "
+        f"{len(check.to_scan)} to scan"
+    )
+    return check
+
+
+def _is_resumable(error: Exception):
+    from googleapiclient.errors import HttpError  # type: ignore
+
+    # Quota, rate limits, server trouble and network failures are all worth another try
+    if isinstance(error, HttpError):
+        return error.resp.status in (403, 429) or error.resp.status >= 500
+    return isinstance(error, OSError)
+
+
+def _record_interruption(
+    progress: StageProgress, channel_id: str, error: Exception
+) -> bool:
+    """Note that a channel's scan was cut short. Returns whether to try it again later."""
+    cursor = progress.cursors.setdefault(channel_id, ChannelCursor())
+    cursor.attempts += 1
+    if _is_resumable(error) and cursor.attempts < MAX_RESUME_ATTEMPTS:
+        return True
+    del progress.cursors[channel_id]
+    progress.failed_channels.append(channel_id)
+    return False
 
-    to_remove = all_stream_ids - seen_stream_ids
-    print(f"Removed {len(to_remove)} missing streams")
-    if len(to_remove) > 0:
-        print(", ".join(to_remove))
-    clean_up_streams(data, to_remove)
 
+def _finish_channel(progress: StageProgress, channel_id: str):
+    progress.cursors.pop(channel_id, None)
+    progress.completed_channels.append(channel_id)
 
-def update_clips(youtube: api.Resource, data: HolocraftData):
+
+def _pending_channels(
+    progress: StageProgress,
+    channel_ids: List[str],
+    deferred: Container[str] = frozenset(),
+):
+    done = set(progress.completed_channels) | set(progress.failed_channels)
+    return [
+        channel_id
+        for channel_id in channel_ids
+        if channel_id not in done and channel_id not in deferred
+    ]
+
+
+def update_source_streams(
+    youtube: "api.Resource",
+    data: HolocraftData,
+    workers: int = DEFAULT_CHANNEL_WORKERS,
+    incremental: bool = False,
+    progress: Optional[StageProgress] = None,
+    deferred: Container[str] = frozenset(),
+    feed_video_ids: Optional[Dict[str, List[str]]] = None,
+):
+    progress = progress if progress is not None else StageProgress()
+    all_stream_ids = set(data.craft_streams.keys())
+    channel_members = {
+        member_info.channel_id: member_name
+        for member_name, member_info in data.members.items()
+    }
+    channel_ids = _pending_channels(progress, list(channel_members.keys()), deferred)
+    results = scan_channels(
+        youtube,
+        data,
+        channel_ids,
+        probe_minecraft_videos,
+        workers,
+        incremental,
+        {
+            channel_id: cursor.page_token
+            for channel_id, cursor in progress.cursors.items()
+        },
+        feed_video_ids,
+    )
+    with closing(results):
+        for member_channel_id, pages in results:
+            member_name = channel_members[member_channel_id]
+            print("Processing member channel:", member_name)
+            try:
+                for page in pages:
+                    with data_lock():
+                        for playlist_item, is_craft_stream in page.new_videos:
+                            snippet = playlist_item.snippet
+                            content_details = playlist_item.contentDetails
+                            video_id = playlist_item.id
+
+                            if is_craft_stream:
+                                print(
+                                    f"{video_id}: {snippet.channelTitle} - {snippet.title}"
+                                )
+                                # Add this source stream to the holocraft database
+                                data.add_stream(
+                                    video_id,
+                                    HolocraftStream(
+                                        member=member_name,
+                                        published_at=snippet.publishedAt,
+                                        title=snippet.title,
+                                        duration=content_details.duration,
+                                    ),
+                                )
+
+                            # Mark this video as seen so we don't process it again
+                            data.mark_seen(member_channel_id, video_id)
+
+                        progress.seen_ids.update(page.video_ids)
+                        progress.cursors.setdefault(
+                            member_channel_id, ChannelCursor()
+                        ).page_token = page.next_page_token
+                    # Checkpoint the data to disk after each page
+                    checkpoint_data(data)
+
+                with data_lock():
+                    _finish_channel(progress, member_channel_id)
+            except Exception as e:
+                print(f"Failed to process streams for {member_name}:", e)
+                with data_lock():
+                    if _record_interruption(progress, member_channel_id, e):
+                        continue
+                    # This is _probably_ a transient error, so let's not delete all of the member's streams
+                    progress.seen_ids.update(
+                        streamId
+                        for streamId, streamDetails in data.craft_streams.items()
+                        if streamDetails.member == member_name
+                    )
+            checkpoint_data(data)
+
+    if len(progress.cursors) > 0:
+        print(
+            f"{len(progress.cursors)} member channels were interrupted, "
+            "they'll be resumed on the next run"
+        )
+        return
+
+    if incremental:
+        # We stopped short of each channel's older uploads, so we can't tell what's missing
+        print("Skipping removal of missing streams in incremental mode")
+    else:
+        to_remove = {
+            stream_id
+            for stream_id in all_stream_ids
+            if stream_id not in progress.seen_ids
+        }
+        print(f"Removed {len(to_remove)} missing streams")
+        if len(to_remove) > 0:
+            print(", ".join(to_remove))
+        with data_lock():
+            clean_up_streams(data, to_remove)
+    with data_lock():
+        progress.finished = True
+
+
+def update_clips(
+    youtube: "api.Resource",
+    data: HolocraftData,
+    workers: int = DEFAULT_CHANNEL_WORKERS,
+    incremental: bool = False,
+    progress: Optional[StageProgress] = None,
+    deferred: Container[str] = frozenset(),
+    feed_video_ids: Optional[Dict[str, List[str]]] = None,
+):
+    progress = progress if progress is not None else StageProgress()
     all_clip_ids = set(data.craft_clips.keys())
-    seen_clip_ids = set()
-    for clipper_channel_id in data.clippers:
-        try:
+    # Clips are identified by their description alone, so there's nothing to probe
+    results = scan_channels(
+        youtube,
+        data,
+        _pending_channels(progress, data.clippers, deferred),
+        None,
+        workers,
+        incremental,
+        {
+            channel_id: cursor.page_token
+            for channel_id, cursor in progress.cursors.items()
+        },
+        feed_video_ids,
+    )
+    with closing(results):
+        for clipper_channel_id, pages in results:
             print("Processing clip channel", clipper_channel_id)
-            dirty = False
             num_new_clips = 0
+            try:
+                for page in pages:
+                    with data_lock():
+                        for playlist_item, _ in page.new_videos:
+                            snippet = playlist_item.snippet
+                            content_details = playlist_item.contentDetails
+                            video_id = playlist_item.id
+
+                            source_stream_ids = [
+                                match[1]  # just the video ID
+                                for match in re.findall(
+                                    r"(youtube\.com/watch\?v=|youtu\.be/)([a-zA-Z0-9_-]+)",
+                                    snippet.description,
+                                )
+                            ]
+                            if len(source_stream_ids) > 0:
+                                num_new_clips += 1
+                                data.add_clip(
+                                    video_id,
+                                    HolocraftClip(
+                                        source_streams=source_stream_ids,
+                                        title=snippet.title,
+                                        duration=content_details.duration,
+                                    ),
+                                )
+
+                            # Mark this video as seen so we don't process it again
+                            data.mark_seen(clipper_channel_id, video_id)
 
-            upload_playlist_id = data.upload_playlists[clipper_channel_id]
-            if clipper_channel_id not in data.seen_videos:
-                data.seen_videos[clipper_channel_id] = set()
-
-            for playlist_item in playlist_videos(youtube, upload_playlist_id):
-                snippet = playlist_item.snippet
-                content_details = playlist_item.contentDetails
-
-                video_id = playlist_item.id
-                seen_clip_ids.add(video_id)
-
-                if video_id not in data.seen_videos[clipper_channel_id]:
-                    dirty = True
-                    source_stream_ids = [
-                        match[1]  # just the video ID
-                        for match in re.findall(
-                            r"(youtube\.com/watch\?v=|youtu\.be/)([a-zA-Z0-9_-]+)",
-                            snippet.description,
-                        )
-                    ]
-                    if len(source_stream_ids) > 0:
-                        num_new_clips += 1
-                        data.craft_clips[video_id] = HolocraftClip(
-                            source_streams=source_stream_ids,
-                            title=snippet.title,
-                            duration=content_details.duration,
-                        )
-
-                    # Mark this video as seen so we don't process it again
-                    data.seen_videos[clipper_channel_id].add(video_id)
+                        progress.seen_ids.update(page.video_ids)
+                        progress.cursors.setdefault(
+                            clipper_channel_id, ChannelCursor()
+                        ).page_token = page.next_page_token
+                    # Checkpoint data to disk after each page
+                    checkpoint_data(data)
+
+                with data_lock():
+                    _finish_channel(progress, clipper_channel_id)
+            except Exception as e:
+                # If we give up on this channel, we'll lose all of its clips
+                # since we don't save clip -> clipper mappings,
+                # we don't know which clips originated with this channel
+                print(f"Failed to process clips for {clipper_channel_id}:", e)
+                with data_lock():
+                    _record_interruption(progress, clipper_channel_id, e)
+                checkpoint_data(data)
+                continue
 
             print(f"{num_new_clips} new clips")
-            # Checkpoint data to disk after each channel
-            if dirty:
-                write_data(data)
-        except Exception as e:
-            # We'll lose all of the clips for this channel
-            # since we don't save clip -> clipper mappings,
-            # we don't know which clips originated with this channel
-            print(f"Failed to process clips for {clipper_channel_id}:", e)
+            checkpoint_data(data)
+
+    if len(progress.cursors) > 0:
+        print(
+            f"{len(progress.cursors)} clip channels were interrupted, "
+            "they'll be resumed on the next run"
+        )
+        return
+
+    if incremental:
+        print("Skipping removal of missing clips in incremental mode")
+    else:
+        to_remove = {
+            clip_id for clip_id in all_clip_ids if clip_id not in progress.seen_ids
+        }
+        print(f"Removed {len(to_remove)} missing clips")
+        if len(to_remove) > 0:
+            print(", ".join(to_remove))
+        with data_lock():
+            clean_up_clips(data, to_remove)
+    with data_lock():
+        progress.finished = True
 
-    to_remove = all_clip_ids - seen_clip_ids
-    print(f"Removed {len(to_remove)} missing clips")
-    if len(to_remove) > 0:
-        print(", ".join(to_remove))
-    clean_up_clips(data, to_remove)
+
+def refresh_provisional_videos(youtube: "api.Resource", data: HolocraftData):
+    """Re-query streams and clips that were live or upcoming when we first saw them.
+
+    Their title and duration were whatever YouTube reported at the time, and the duration
+    stays provisional until the video is looked up again after it ends, so every run
+    checks them by ID until they settle.
+    """
+    with data_lock():
+        stream_ids = [
+            video_id
+            for video_id, stream in data.craft_streams.items()
+            if stream.duration == PROVISIONAL_DURATION
+        ]
+        clip_ids = [
+            video_id
+            for video_id, clip in data.craft_clips.items()
+            if clip.duration == PROVISIONAL_DURATION
+        ]
+    if len(stream_ids) == 0 and len(clip_ids) == 0:
+        return
+    print(
+        f"Refreshing {len(stream_ids)} provisional streams and {len(clip_ids)} "
+        "provisional clips"
+    )
+    videos = {video.id: video for video in get_videos(youtube, stream_ids + clip_ids)}
+    settled = 0
+    with data_lock():
+        # Videos that have gone away are left for a full sync to clean up
+        for video_id in stream_ids:
+            video = videos.get(video_id)
+            if video is not None and video_id in data.craft_streams:
+                data.add_stream(
+                    video_id,
+                    replace(
+                        data.craft_streams[video_id],
+                        title=video.snippet.title,
+                        duration=video.contentDetails.duration,
+                    ),
+                )
+                settled += video.contentDetails.duration != PROVISIONAL_DURATION
+        for video_id in clip_ids:
+            video = videos.get(video_id)
+            if video is not None and video_id in data.craft_clips:
+                data.add_clip(
+                    video_id,
+                    replace(
+                        data.craft_clips[video_id],
+                        title=video.snippet.title,
+                        duration=video.contentDetails.duration,
+                    ),
+                )
+                settled += video.contentDetails.duration != PROVISIONAL_DURATION
+    print(f"{settled} of {len(stream_ids) + len(clip_ids)} provisional videos settled")
+    run_metrics.set_counter(
+        "provisional_videos",
+        {"refreshed": len(stream_ids) + len(clip_ids), "settled": settled},
+    )
+    checkpoint_data(data)
 
 
 def clean_up_streams(data: HolocraftData, stream_ids_to_remove: Set[str]):
     for stream_id in stream_ids_to_remove:
-        del data.craft_streams[stream_id]
+        data.remove_stream(stream_id)
     for member in data.members.values():
-        data.seen_videos[member.channel_id] = (
-            data.seen_videos[member.channel_id] - stream_ids_to_remove
-        )
+        data.forget_seen(member.channel_id, stream_ids_to_remove)
 
 
 def clean_up_clips(data: HolocraftData, clip_ids_to_remove: Set[str]):
     for clip_id in clip_ids_to_remove:
-        del data.craft_clips[clip_id]
+        data.remove_clip(clip_id)
     for clipper in data.clippers:
-        data.seen_videos[clipper] = data.seen_videos[clipper] - clip_ids_to_remove
+        data.forget_seen(clipper, clip_ids_to_remove)
 
 
 TSchemaAll = TypeVar("TSchemaAll")
@@ -177,52 +678,516 @@ def load_with_schema(deserialize: Callable[[str], TSchemaAll]) -> TSchemaAll:
         return deserialize(holocraft_data_file.read())
 
 
-def load_data():
-    return load_with_schema(HolocraftData.from_json)
+def load_data(sections: Optional[List[str]] = None):
+    """Load the sync data, or only the given top-level sections of it.
+
+    Data with only some sections loaded must never be written back.
+    """
+    return _sync_store.load(sections)
+
 
+def load_raw_data() -> Dict[str, Any]:
+    """Load the whole sync data as stored, before the current schema is applied to it."""
+    return _sync_store.load_raw()
 
-def write_with_schema(get_serializable_data: Callable[[], Any]):
-    with open(DATAFILE_PATH, "w") as holocraft_data_file:
-        holocraft_data_file.write(json.dumps(get_serializable_data(), indent=2))
+
+def write_with_schema(
+    get_serializable_data: Callable[[], Any],
+    dumps: Callable[[Any], str] = indented_json,
+):
+    write_json_atomically(DATAFILE_PATH, get_serializable_data(), dumps)
 
 
 def write_data(data: HolocraftData):
     write_time = timeit(
-        lambda: write_with_schema(data.to_dict), setup="gc.enable()", number=1
+        lambda: _sync_store.save(data),
+        setup="gc.enable()",
+        number=1,
     )
     print(f"Wrote sync metadata in {write_time} seconds")
 
 
-def do_emit_client_data(data: HolocraftData):
-    client_data = HolocraftClientData.from_holocraft_data(data)
+def set_sync_store(store: SyncStore):
+    global _sync_store
+    _sync_store = store
+
+
+def sync_store_for(storage: str, compact_seen_videos: bool = False) -> SyncStore:
+    if storage == STORAGE_SQLITE:
+        return SqliteSyncStore(SQLITE_DATAFILE_PATH)
+    return JsonSyncStore(DATAFILE_PATH, compact_seen_videos)
+
+
+def set_checkpoint_writer(writer: Optional[CheckpointWriter]):
+    global _checkpoint_writer
+    _checkpoint_writer = writer
+
+
+def checkpoint_data(data: HolocraftData):
+    """Save progress, in the background if a checkpoint writer is running."""
+    if _checkpoint_writer is not None:
+        _checkpoint_writer.request()
+    else:
+        write_data(data)
+
+
+def data_lock():
+    """Hold while mutating the sync data so checkpoints never see a half-applied change."""
+    if _checkpoint_writer is not None:
+        return _checkpoint_writer.lock
+    return nullcontext()
+
+
+def do_emit_client_data(client_data: Dict[str, Any]):
     with open(CLIENT_DATA_PATH, "w") as holocraft_client_data_file:
-        holocraft_client_data_file.write(json.dumps(client_data.to_dict(), indent=2))
+        holocraft_client_data_file.write(json.dumps(client_data, indent=2))
 
 
-def emit_client_data(data: HolocraftData):
-    write_time = timeit(
-        lambda: do_emit_client_data(data), setup="gc.enable()", number=1
+def write_precompressed(path: str, content: bytes):
+    """Write content to path, plus .gz and .br siblings for servers to send as-is."""
+    with open(path, "wb") as output_file:
+        output_file.write(content)
+    # A fixed mtime keeps the output identical when the content hasn't changed
+    with open(f"{path}.gz", "wb") as output_file:
+        output_file.write(gzip.compress(content, compresslevel=9, mtime=0))
+    try:
+        import brotli  # type: ignore
+    except ImportError:
+        # Brotli siblings are only written with the compression extra installed, and
+        # one left over from an earlier run would no longer match
+        print(f"brotli isn't installed, so {path}.br wasn't written")
+        if os.path.exists(f"{path}.br"):
+            os.remove(f"{path}.br")
+        return
+    with open(f"{path}.br", "wb") as output_file:
+        output_file.write(brotli.compress(content, quality=11))
+
+
+def do_emit_columnar_client_data(client_data: HolocraftClientData):
+    content = json.dumps(
+        client_data.to_columnar(), separators=(",", ":"), ensure_ascii=False
     )
+    write_precompressed(CLIENT_COLUMNAR_PATH, content.encode())
+
+
+def _client_shard_path(period: str):
+    return os.path.join(CLIENT_SHARD_DIR, f"{period}.json")
+
+
+def do_emit_sharded_client_data(client_data: HolocraftClientData, granularity: str):
+    client_root = os.path.dirname(CLIENT_DATA_PATH)
+    manifest, shards = client_data.shard(
+        granularity,
+        lambda period: os.path.relpath(_client_shard_path(period), client_root),
+    )
+    os.makedirs(CLIENT_SHARD_DIR, exist_ok=True)
+    # mypy can't see the to_dict that dataclass_json's decorator adds
+    for period, shard in shards.items():
+        shard_dict = shard.to_dict()  # type: ignore[attr-defined]
+        write_json_atomically(_client_shard_path(period), shard_dict)
+    # The manifest goes last so it never lists a shard that hasn't been written
+    manifest_dict = manifest.to_dict()  # type: ignore[attr-defined]
+    write_json_atomically(CLIENT_MANIFEST_PATH, manifest_dict)
+
+    # Clear out shards for periods which no longer have streams, or another granularity
+    current_paths = {_client_shard_path(period) for period in shards}
+    current_paths.add(CLIENT_MANIFEST_PATH)
+    for file_name in os.listdir(CLIENT_SHARD_DIR):
+        path = os.path.join(CLIENT_SHARD_DIR, file_name)
+        if file_name.endswith(".json") and path not in current_paths:
+            os.remove(path)
+
+
+def _client_output_path(output: str, client_format: str):
+    if client_format == CLIENT_FORMAT_COLUMNAR:
+        return CLIENT_COLUMNAR_PATH
+    if output == CLIENT_OUTPUT_SINGLE:
+        return CLIENT_DATA_PATH
+    return CLIENT_MANIFEST_PATH
+
+
+def emit_client_data(
+    data: HolocraftData,
+    output: str = CLIENT_OUTPUT_SINGLE,
+    client_format: str = CLIENT_FORMAT_JSON,
+    emit_delta: bool = False,
+):
+    client_data = HolocraftClientData.from_holocraft_data(data)
+    client_data_dict = client_data.to_dict()
+    fingerprint = client_data_fingerprint(client_data_dict)
+    version = load_client_version(CLIENT_VERSION_PATH)
+    if is_same_emit(version, fingerprint, output, client_format) and os.path.exists(
+        _client_output_path(output, client_format)
+    ):
+        print("Client data hasn't changed, skipping write")
+        return
+
+    delta = None
+    if (
+        emit_delta
+        and version is not None
+        and version.fingerprint != fingerprint
+        and version.output == CLIENT_OUTPUT_SINGLE
+        and version.format == CLIENT_FORMAT_JSON
+        and os.path.exists(CLIENT_DATA_PATH)
+    ):
+        # The file about to be replaced is the previous version
+        with open(CLIENT_DATA_PATH, "r") as previous_file:
+            previous = json.load(previous_file)
+        delta = client_data_delta(
+            previous, client_data_dict, version.fingerprint, fingerprint
+        )
+
+    if client_format == CLIENT_FORMAT_COLUMNAR:
+        write_time = timeit(
+            lambda: do_emit_columnar_client_data(client_data),
+            setup="gc.enable()",
+            number=1,
+        )
+    elif output == CLIENT_OUTPUT_SINGLE:
+        write_time = timeit(
+            lambda: do_emit_client_data(client_data_dict),
+            setup="gc.enable()",
+            number=1,
+        )
+    else:
+        write_time = timeit(
+            lambda: do_emit_sharded_client_data(client_data, output),
+            setup="gc.enable()",
+            number=1,
+        )
     print(f"Wrote client data in {write_time} seconds")
 
+    if delta is not None:
+        write_json_atomically(CLIENT_DELTA_PATH, delta)
+        print(
+            f"Wrote client data delta: {len(delta['upsertedStreams'])} streams and "
+            f"{len(delta['upsertedClips'])} clips added or changed, "
+            f"{len(delta['removedStreams'])} streams and "
+            f"{len(delta['removedClips'])} clips removed"
+        )
+    elif emit_delta and os.path.exists(CLIENT_DELTA_PATH):
+        # There's nothing to patch from, so don't leave a delta to the wrong version
+        os.remove(CLIENT_DELTA_PATH)
+    write_json_atomically(
+        CLIENT_VERSION_PATH,
+        ClientDataVersion(
+            fingerprint=fingerprint,
+            previous_fingerprint=version.fingerprint if version is not None else None,
+            output=output,
+            format=client_format,
+        ).to_dict(),
+    )
+
+
+def _exit_on_signal(signum, frame):
+    sys.exit(128 + signum)
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Update the Holocraft timeline data")
+    parser.add_argument("api_key", help="YouTube Data API key")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_CHANNEL_WORKERS,
+        help="Maximum number of channels to scan concurrently",
+    )
+    parser.add_argument(
+        "--probe-concurrency",
+        type=int,
+        default=DEFAULT_PROBE_CONCURRENCY,
+        help="Maximum number of watch page fetches in flight",
+    )
+    parser.add_argument(
+        "--full-sync-every",
+        type=int,
+        default=DEFAULT_FULL_SYNC_EVERY,
+        help="Scan full upload histories every N runs to detect deleted videos; "
+        "other runs stop paging at the first fully seen page (1 = always full)",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Force a full scan with deletion reconciliation on this run",
+    )
+    parser.add_argument(
+        "--quota-budget",
+        type=int,
+        metavar="UNITS",
+        help="On incremental runs, scan each channel about as often as it uploads and "
+        "spend at most about UNITS quota units scanning, deferring the rest",
+    )
+    parser.add_argument(
+        "--feeds",
+        action="store_true",
+        help="On incremental runs, check each channel's upload feed first, which costs "
+        "no quota, and only use the API for channels with new videos",
+    )
+    parser.add_argument(
+        "--feed-url-template",
+        default=DEFAULT_FEED_URL_TEMPLATE,
+        help="URL of a channel's upload feed, with {channel_id} in place of its ID",
+    )
+    parser.add_argument(
+        "--storage",
+        choices=[STORAGE_JSON, STORAGE_SQLITE],
+        default=STORAGE_JSON,
+        help=f"Keep the sync data in {DATAFILE_PATH}, or in {SQLITE_DATAFILE_PATH} "
+        "where checkpoints only write what changed; move it between the two with "
+        "python -m updater.sync_store",
+    )
+    parser.add_argument(
+        "--compact-seen-videos",
+        action="store_true",
+        help="Save seen video IDs as packed base64 instead of sorted lists; "
+        "either form is read back",
+    )
+    parser.add_argument(
+        "--client-output",
+        choices=[CLIENT_OUTPUT_SINGLE, *SHARD_PERIOD_FORMATS],
+        default=CLIENT_OUTPUT_SINGLE,
+        help=f"Emit client data as one file, or as per-year or per-month shards "
+        f"listed in {CLIENT_MANIFEST_PATH}",
+    )
+    parser.add_argument(
+        "--client-format",
+        choices=[CLIENT_FORMAT_JSON, CLIENT_FORMAT_COLUMNAR],
+        default=CLIENT_FORMAT_JSON,
+        help=f"Emit client data as JSON records, or as compact columnar JSON in "
+        f"{CLIENT_COLUMNAR_PATH} with gzip and brotli siblings",
+    )
+    parser.add_argument(
+        "--client-delta",
+        action="store_true",
+        help=f"Also write the changes since the previous client data to "
+        f"{CLIENT_DELTA_PATH}, so clients can patch a cached copy",
+    )
+    traffic = parser.add_mutually_exclusive_group()
+    traffic.add_argument(
+        "--record",
+        metavar="FIXTURE_DIR",
+        help="Save every API response and watch page fetched to FIXTURE_DIR",
+    )
+    traffic.add_argument(
+        "--replay",
+        metavar="FIXTURE_DIR",
+        help="Answer every request from fixtures saved with --record, offline",
+    )
+    args = parser.parse_args(argv)
+    if (
+        args.client_format == CLIENT_FORMAT_COLUMNAR
+        and args.client_output != CLIENT_OUTPUT_SINGLE
+    ):
+        # Clips refer to their source streams by position, which shards would break
+        parser.error("columnar client data can't be sharded")
+    if args.compact_seen_videos and args.storage != STORAGE_JSON:
+        parser.error("compact seen videos only apply to JSON storage")
+    if args.client_delta and (
+        args.client_format != CLIENT_FORMAT_JSON
+        or args.client_output != CLIENT_OUTPUT_SINGLE
+    ):
+        parser.error("client deltas are only written for single file JSON output")
+    return args
+
 
-def main():
-    api_key = sys.argv[1]
-    youtube = api.build("youtube", "v3", developerKey=api_key)
+def main(argv: Optional[List[str]] = None):
+    from updater.replay import (
+        RecordingAdapter,
+        RecordingHttp,
+        ReplayAdapter,
+        ReplayHttp,
+    )
+
+    args = parse_args(argv)
+    run_metrics.reset()
+    if args.record is not None:
+        set_transports(
+            lambda: RecordingHttp(args.record, default_http()),
+            lambda max_in_flight: RecordingAdapter(
+                args.record, default_watch_adapter(max_in_flight)
+            ),
+        )
+    elif args.replay is not None:
+        set_transports(
+            lambda: ReplayHttp(args.replay), lambda _: ReplayAdapter(args.replay)
+        )
+    youtube = build_youtube(args.api_key)
+    # Channel workers share the API connection budget, which shrinks if we get throttled
+    set_api_concurrency(args.workers)
+    set_probe_concurrency(args.probe_concurrency)
+    set_feed_url_template(args.feed_url_template)
+    set_sync_store(sync_store_for(args.storage, args.compact_seen_videos))
+    classification_cache = ClassificationCache(
+        CLASSIFICATION_CACHE_PATH,
+        CLASSIFICATION_TTL,
+        CLASSIFICATION_CACHE_MAX_ENTRIES,
+    )
+    classification_cache.load()
+    set_classification_cache(classification_cache)
+    response_cache = ResponseCache(RESPONSE_CACHE_DIR, RESPONSE_CACHE_MAX_BYTES)
+    set_response_cache(response_cache)
 
     # Load existing data
     data = load_data()
+    # Index it now, so the run keeps the index up to date as it adds and removes videos
+    # and emitting the client data doesn't have to sort and join everything again
+    data.index()
+
+    journal = load_journal(RESUME_JOURNAL_PATH)
+    if journal is not None:
+        # Finish the interrupted run in the same mode it started in
+        print("Resuming interrupted run")
+        incremental = journal.incremental
+    else:
+        incremental = not args.full and data.incremental_runs + 1 < args.full_sync_every
+        journal = ResumeJournal(incremental=incremental)
+    print("Incremental sync" if incremental else "Full sync")
+
+    # Turn termination into an exception so that pending checkpoints get flushed
+    signal.signal(signal.SIGTERM, _exit_on_signal)
 
     # Do update
     ensure_upload_playlists(youtube, data)
-    update_source_streams(youtube, data)
-    update_clips(youtube, data)
+    started_at = datetime.now(timezone.utc)
+    channel_ids = [
+        member.channel_id for member in data.members.values()
+    ] + data.clippers
+    # Channels which won't be scanned on this run
+    deferred: Set[str] = set()
+    feed_check: Optional[FeedCheck] = None
+    if args.feeds and incremental:
+        # Channels a resumed run has already finished, or must finish, skip the feeds
+        settled = {
+            channel_id
+            for progress in [journal.streams, journal.clips]
+            for channel_id in chain(
+                progress.completed_channels, progress.failed_channels, progress.cursors
+            )
+        }
+        feed_check = check_feeds(
+            data,
+            [channel_id for channel_id in channel_ids if channel_id not in settled],
+        )
+        deferred.update(feed_check.unchanged)
+        run_metrics.set_counter(
+            "feeds",
+            {
+                "unchanged": len(feed_check.unchanged),
+                "looked_up": len(feed_check.new_video_ids),
+                "scanned": len(feed_check.to_scan),
+            },
+        )
+    planner_state: Optional[PlannerState] = None
+    if args.quota_budget is not None:
+        planner_state = load_planner_state(PLANNER_STATE_PATH)
+    if planner_state is not None and incremental:
+        plan = plan_scans(
+            data,
+            planner_state,
+            [channel_id for channel_id in channel_ids if channel_id not in deferred],
+            args.quota_budget,
+            started_at,
+        )
+        describe_plan(plan, args.quota_budget)
+        deferred.update(plan.deferred)
+        run_metrics.set_counter(
+            "scan_plan",
+            {
+                "budget": args.quota_budget,
+                "planned_units": plan.planned_units(),
+                "scheduled": len(plan.scheduled),
+                "deferred": plan.deferred,
+            },
+        )
+    feed_video_ids = feed_check.new_video_ids if feed_check is not None else None
+    # The journal is written after the data, so it never claims progress the data lacks
+    checkpoint_targets = [
+        (lambda: _sync_store.snapshot(data), _sync_store.write),
+        (
+            journal.copy,
+            lambda snapshot: write_json_atomically(
+                RESUME_JOURNAL_PATH, snapshot.to_dict()
+            ),
+        ),
+    ]
+    with CheckpointWriter(checkpoint_targets) as checkpoints:
+        set_checkpoint_writer(checkpoints)
+        try:
+            refresh_provisional_videos(youtube, data)
+            if not journal.streams.finished:
+                update_source_streams(
+                    youtube,
+                    data,
+                    args.workers,
+                    incremental,
+                    journal.streams,
+                    deferred,
+                    feed_video_ids,
+                )
+            if not journal.clips.finished:
+                update_clips(
+                    youtube,
+                    data,
+                    args.workers,
+                    incremental,
+                    journal.clips,
+                    deferred,
+                    feed_video_ids,
+                )
+            run_finished = journal.streams.finished and journal.clips.finished
+            if run_finished:
+                with data_lock():
+                    data.incremental_runs = (
+                        data.incremental_runs + 1 if incremental else 0
+                    )
+            checkpoints.request()
+        finally:
+            set_checkpoint_writer(None)
+    if planner_state is not None:
+        # Channels waiting to be resumed or given up on haven't been scanned to
+        # completion, and unchanged feeds are as good as a scan that found nothing
+        scanned = journal.streams.completed_channels + journal.clips.completed_channels
+        if feed_check is not None:
+            scanned += feed_check.unchanged
+        record_scans(data, planner_state, scanned, started_at)
+        write_json_atomically(PLANNER_STATE_PATH, planner_state.to_dict())
+    if run_finished:
+        delete_journal(RESUME_JOURNAL_PATH)
+    else:
+        print(f"Run was interrupted, progress is saved in {RESUME_JOURNAL_PATH}")
 
     # Write out
-    write_data(data)
-    emit_client_data(data)
-    print("Total quota usage:", get_quota_usage())
-    print("Total html fetches", get_html_fetches())
+    emit_client_data(data, args.client_output, args.client_format, args.client_delta)
+    classification_cache.save()
+    response_cache.prune()
+    run_metrics.set_counter("sync_mode", "incremental" if incremental else "full")
+    run_metrics.set_counter(
+        "classification_cache",
+        {"hits": classification_cache.hits, "misses": classification_cache.misses},
+    )
+    run_metrics.set_counter(
+        "response_cache",
+        {"hits": response_cache.hits, "misses": response_cache.misses},
+    )
+    run_metrics.write(RUN_REPORT_PATH)
+
+    print("Total quota usage:", run_metrics.quota_units())
+    print(
+        f"API calls: {run_metrics.calls(PLAYLIST_ITEMS_LIST)} playlistItems.list, "
+        f"{run_metrics.calls(VIDEOS_LIST)} videos.list"
+    )
+    print("Total html fetches", run_metrics.calls(WATCH_PAGE))
+    print(
+        f"Classification cache: {classification_cache.hits} hits, "
+        f"{classification_cache.misses} misses "
+        f"({classification_cache.hit_rate():.1%} hit rate)"
+    )
+    print(
+        f"API response cache: {response_cache.hits} hits, "
+        f"{response_cache.misses} misses ({response_cache.hit_rate():.1%} hit rate)"
+    )
+    print(f"Wrote run report to {RUN_REPORT_PATH}")
 
 
 if __name__ == "__main__":
@@ -1,17 +1,235 @@
 import pdb
-import re
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Dict, Iterator, List, Literal, Optional, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Container,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from xml.etree import ElementTree
 
-import googleapiclient.discovery as api  # type: ignore
-import requests
 from dataclasses_json import DataClassJsonMixin, config
 from dateutil.parser import isoparse
 from marshmallow import fields
 
-_total_quota_usage = 0
-_total_html_fetches = 0
+from updater.classification_cache import (
+    SIGNAL_TITLE,
+    SIGNAL_WATCH_PAGE,
+    ClassificationCache,
+)
+from updater.concurrency import AdaptiveLimiter
+from updater.metrics import (
+    CHANNELS_LIST,
+    FEED,
+    PLAYLIST_ITEMS_LIST,
+    VIDEOS_LIST,
+    WATCH_PAGE,
+    channel_context,
+    current_channel,
+    run_metrics,
+)
+from updater.response_cache import ResponseCache, cache_key
+
+# The API client and HTTP libraries are slow to import, so they're only imported where
+# they're used, and offline tools that never touch the network start quickly
+if TYPE_CHECKING:
+    import googleapiclient.discovery as api  # type: ignore
+    import requests
+    import requests.adapters
+    from googleapiclient.errors import HttpError  # type: ignore
+
+# Every Data API list call we make costs one unit of the daily quota
+API_CALL_QUOTA_COST = 1
+# The most video IDs videos.list accepts in one call
+MAX_VIDEOS_PER_LIST = 50
+# How many playlist items we ask for per playlistItems.list call, the most it allows
+PLAYLIST_PAGE_SIZE = 50
+# How much of a watch page to read at a time while looking for the game block
+WATCH_PAGE_CHUNK_BYTES = 16 * 1024
+# The game block's title, and the script it appears in
+_GAME_MARKER = b'"simpleText":"Minecraft"'
+_INITIAL_DATA_START = b"var ytInitialData = "
+_INITIAL_DATA_END = b";</script>"
+
+# httplib2 connections can't be shared between threads, so each worker gets its own
+_thread_local = threading.local()
+
+
+def default_http() -> Any:
+    from googleapiclient.http import build_http  # type: ignore
+
+    return build_http()
+
+
+# Builds the HTTP client for API requests. Swapped out to record or replay traffic.
+_http_factory: Callable[[], Any] = default_http
+# Bounds the API requests in flight across all workers
+_api_limiter = AdaptiveLimiter(8)
+# How many times to retry a request that was rate limited before giving up
+MAX_THROTTLE_RETRIES = 5
+# Lets unchanged API pages be served from disk when YouTube answers 304 Not Modified
+_response_cache: Optional[ResponseCache] = None
+
+# Watch page probes share a keep-alive connection pool and a bounded set of workers. This
+# is how many watch pages are fetched at once across all channels by default.
+DEFAULT_PROBE_CONCURRENCY = 16
+# Hosts the watch session keeps connection pools for. Watch pages and feeds are both on
+# www.youtube.com, and the spare pool keeps a feed URL template pointed at another host
+# from evicting its connections.
+WATCH_HOST_POOLS = 2
+_probe_concurrency = DEFAULT_PROBE_CONCURRENCY
+_probe_lock = threading.Lock()
+_watch_session: Optional["requests.Session"] = None
+_probe_executor: Optional[ThreadPoolExecutor] = None
+# Remembers verdicts across runs so we don't fetch the same watch page twice
+_classification_cache: Optional[ClassificationCache] = None
+# Where a channel's Atom feed of its latest uploads lives. Feeds cost no API quota.
+DEFAULT_FEED_URL_TEMPLATE = (
+    "https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}"
+)
+_feed_url_template = DEFAULT_FEED_URL_TEMPLATE
+_FEED_VIDEO_ID = "{http://www.w3.org/2005/Atom}entry/{http://www.youtube.com/xml/schemas/2015}videoId"
+
+
+def default_watch_adapter(max_in_flight: int) -> "requests.adapters.BaseAdapter":
+    import requests.adapters
+
+    return requests.adapters.HTTPAdapter(
+        pool_connections=WATCH_HOST_POOLS, pool_maxsize=max_in_flight
+    )
+
+
+# Builds the transport watch pages are fetched over. Swapped out to record or replay traffic.
+_watch_adapter_factory: Callable[[int], "requests.adapters.BaseAdapter"] = (
+    default_watch_adapter
+)
+
+
+def set_transports(
+    http_factory: Callable[[], Any],
+    watch_adapter_factory: Callable[[int], "requests.adapters.BaseAdapter"],
+):
+    """Replace the HTTP layers used for API requests and watch page fetches."""
+    global _http_factory, _watch_adapter_factory
+    _http_factory = http_factory
+    _watch_adapter_factory = watch_adapter_factory
+    # Rebuild the watch page pool on top of the new transport
+    set_probe_concurrency(_probe_concurrency)
+
+
+def set_api_concurrency(max_in_flight: int):
+    global _api_limiter
+    _api_limiter = AdaptiveLimiter(max_in_flight)
+
+
+def _is_throttled(error: "HttpError"):
+    return error.resp.status in (403, 429)
+
+
+def _is_retryable(error: "HttpError"):
+    # Running out of daily quota won't fix itself by waiting, but rate limits will
+    return error.resp.status == 429 or b"rateLimitExceeded" in (error.content or b"")
+
+
+def _get_thread_http():
+    if getattr(_thread_local, "http_factory", None) is not _http_factory:
+        _thread_local.http_factory = _http_factory
+        _thread_local.http = _http_factory()
+    return _thread_local.http
+
+
+def _execute_with_backoff(request, endpoint: str):
+    from googleapiclient.errors import HttpError  # type: ignore
+
+    http = _get_thread_http()
+
+    # Peek at the raw response on its way to the JSON parser so we can measure it
+    received_bytes = 0
+    postproc = request.postproc
+
+    def measuring_postproc(resp, content):
+        nonlocal received_bytes
+        received_bytes = len(content)
+        return postproc(resp, content)
+
+    request.postproc = measuring_postproc
+
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            with _api_limiter.slot():
+                response = request.execute(http=http)
+            run_metrics.record(
+                endpoint,
+                API_CALL_QUOTA_COST,
+                received_bytes,
+                time.perf_counter() - started,
+            )
+            _api_limiter.on_success()
+            return response
+        except HttpError as e:
+            run_metrics.record(
+                endpoint,
+                API_CALL_QUOTA_COST,
+                len(e.content or b""),
+                time.perf_counter() - started,
+                # A 304 is the conditional request cache working as intended
+                error=e.resp.status != 304,
+            )
+            if not _is_throttled(e):
+                raise
+            _api_limiter.on_throttle()
+            if not _is_retryable(e) or attempt >= MAX_THROTTLE_RETRIES:
+                raise
+            time.sleep(2**attempt + random.random())
+            attempt += 1
+
+
+def _execute(request, endpoint: str):
+    from googleapiclient.errors import HttpError  # type: ignore
+
+    if _response_cache is None:
+        return _execute_with_backoff(request, endpoint)
+
+    key = cache_key(request.method, request.uri)
+    cached = _response_cache.get(key)
+    if cached is not None:
+        etag, cached_body = cached
+        request.headers["If-None-Match"] = etag
+
+    try:
+        body = _execute_with_backoff(request, endpoint)
+    except HttpError as e:
+        if e.resp.status != 304 or cached is None:
+            raise
+        _response_cache.record(hit=True)
+        _response_cache.touch(key)
+        return cached_body
+
+    _response_cache.record(hit=False)
+    if "etag" in body:
+        _response_cache.put(key, body["etag"], body)
+    return body
+
+
+def set_response_cache(cache: Optional[ResponseCache]):
+    global _response_cache
+    _response_cache = cache
 
 
 @dataclass
@@ -61,24 +279,18 @@ class YouTubeChannelListResponse(DataClassJsonMixin, YouTubeResponseCommon):
     items: List[YouTubeChannelResource] = field(default_factory=list)
 
 
-def get_upload_playlist_id(youtube: api.Resource, channel_id: str):
-    global _total_quota_usage
-    _total_quota_usage += 1
-
+def get_upload_playlist_id(youtube: "api.Resource", channel_id: str):
     request = youtube.channels().list(part="contentDetails", id=channel_id)
-    response = YouTubeChannelListResponse.from_dict(request.execute())
+    response = YouTubeChannelListResponse.from_dict(_execute(request, CHANNELS_LIST))
     if response.pageInfo.totalResults == 0 or response.items[0].contentDetails is None:
         return None
 
     return response.items[0].contentDetails.relatedPlaylists.uploads
 
 
-def get_channel_picture(youtube: api.Resource, channel_id: str):
-    global _total_quota_usage
-    _total_quota_usage += 1
-
+def get_channel_picture(youtube: "api.Resource", channel_id: str):
     request = youtube.channels().list(part="snippet", id=channel_id)
-    response = YouTubeChannelListResponse.from_dict(request.execute())
+    response = YouTubeChannelListResponse.from_dict(_execute(request, CHANNELS_LIST))
     if response.pageInfo.totalResults == 0 or response.items[0].snippet is None:
         return None
 
@@ -138,7 +350,7 @@ class YouTubeVideoSnippet:
 
 
 @dataclass
-class YouTubeVideoItemResource:
+class YouTubeVideoItemResource(DataClassJsonMixin):
     id: str
     contentDetails: YouTubeVideoContentDetails
     snippet: YouTubeVideoSnippet
@@ -149,65 +361,322 @@ class YouTubeVideoListResponse(DataClassJsonMixin, YouTubeResponseCommon):
     items: List[YouTubeVideoItemResource] = field(default_factory=list)
 
 
-def playlist_videos(
-    youtube: api.Resource, playlist_id: str
-) -> Iterator[YouTubeVideoItemResource]:
-    global _total_quota_usage
-
-    page_token = None
+@dataclass
+class PlaylistPage:
+    """One page of a playlist."""
+
+    # IDs of every available video on the page, in playlist order
+    video_ids: List[str]
+    # Details for the videos on the page which weren't already known
+    videos: List[YouTubeVideoItemResource]
+    # Token for the page after this one, or None if this was the last page
+    next_page_token: Optional[str] = None
+
+
+def playlist_video_pages(
+    youtube: "api.Resource",
+    playlist_id: str,
+    known_ids: Optional[Container[str]] = None,
+    stop_at_known: bool = False,
+    page_token: Optional[str] = None,
+) -> Iterator[PlaylistPage]:
+    """Yield the videos in a playlist a page at a time.
+
+    Only videos outside of known_ids are looked up with videos.list, and pages without
+    any such videos cost no videos.list call at all. If stop_at_known is set, paging stops
+    at the first page made entirely of known videos. Upload playlists are ordered newest
+    first, so everything past that page is already known too. Paging starts from
+    page_token if given, which lets an interrupted scan pick up where it left off.
+    """
+    known_ids = known_ids if known_ids is not None else set()
     while True:
-        _total_quota_usage += 1
         playlist_request = youtube.playlistItems().list(
             part="contentDetails,snippet",
-            maxResults=50,
+            maxResults=PLAYLIST_PAGE_SIZE,
             playlistId=playlist_id,
             pageToken=page_token,
         )
-        raw_playlist_response = playlist_request.execute()
+        raw_playlist_response = _execute(playlist_request, PLAYLIST_ITEMS_LIST)
         playlist_response = YouTubePlaylistListResponse.from_dict(raw_playlist_response)
 
-        video_request = youtube.videos().list(
-            id=",".join(
-                [
-                    item.contentDetails.videoId
-                    for item in playlist_response.items
-                    if item.snippet.title not in ["Deleted video", "Private video"]
-                ]
-            ),
-            part="contentDetails,snippet",
-        )
-        raw_response = video_request.execute()
-        video_response = YouTubeVideoListResponse.from_dict(raw_response)
+        video_ids = [
+            item.contentDetails.videoId
+            for item in playlist_response.items
+            if item.snippet.title not in ["Deleted video", "Private video"]
+        ]
+        unknown_ids = [video_id for video_id in video_ids if video_id not in known_ids]
+        if stop_at_known and len(unknown_ids) == 0:
+            break
+
+        videos: List[YouTubeVideoItemResource] = []
+        if len(unknown_ids) > 0:
+            video_request = youtube.videos().list(
+                id=",".join(unknown_ids),
+                part="contentDetails,snippet",
+            )
+            raw_response = _execute(video_request, VIDEOS_LIST)
+            videos = YouTubeVideoListResponse.from_dict(raw_response).items
 
-        for playlist_item in video_response.items:
-            yield playlist_item
+        yield PlaylistPage(video_ids, videos, playlist_response.nextPageToken)
 
         if playlist_response.nextPageToken is None:
             break
         page_token = playlist_response.nextPageToken
 
 
-def is_minecraft_video(video: YouTubeVideoItemResource):
-    global _total_html_fetches
+def playlist_videos(
+    youtube: "api.Resource", playlist_id: str
+) -> Iterator[YouTubeVideoItemResource]:
+    for page in playlist_video_pages(youtube, playlist_id):
+        yield from page.videos
 
-    # If we see minecraft in the video title we can save some time
-    normalized_title = video.snippet.title.lower()
-    if any(indicator in normalized_title for indicator in ["minecraft", "マイクラ"]):
-        return True
 
-    # Otherwise we try the weird strategy of finding the explicit string "Minecraft" with quotes
+def get_videos(
+    youtube: "api.Resource", video_ids: Iterable[str]
+) -> Iterator[YouTubeVideoItemResource]:
+    """Look up videos by ID, as many per videos.list call as it allows.
+
+    Videos which no longer exist or have gone private are left out.
+    """
+    video_ids = list(video_ids)
+    for start in range(0, len(video_ids), MAX_VIDEOS_PER_LIST):
+        video_request = youtube.videos().list(
+            id=",".join(video_ids[start : start + MAX_VIDEOS_PER_LIST]),
+            part="contentDetails,snippet",
+        )
+        raw_response = _execute(video_request, VIDEOS_LIST)
+        yield from YouTubeVideoListResponse.from_dict(raw_response).items
+
+
+def _create_probe_pool(max_in_flight: int):
+    import requests
+
+    session = requests.Session()
+    adapter = _watch_adapter_factory(max_in_flight)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    executor = ThreadPoolExecutor(
+        max_workers=max_in_flight, thread_name_prefix="watch-probe"
+    )
+    return session, executor
+
+
+def set_probe_concurrency(max_in_flight: int):
+    """Size the shared connection pool and worker pool used for watch page probes."""
+    global _watch_session, _probe_executor, _probe_concurrency
+    session, executor = _create_probe_pool(max_in_flight)
+    with _probe_lock:
+        old_executor = _probe_executor
+        _watch_session, _probe_executor = session, executor
+        _probe_concurrency = max_in_flight
+    if old_executor is not None:
+        old_executor.shutdown(wait=False)
+
+
+def _get_probe_pool() -> Tuple["requests.Session", ThreadPoolExecutor]:
+    global _watch_session, _probe_executor
+    with _probe_lock:
+        if _watch_session is None or _probe_executor is None:
+            _watch_session, _probe_executor = _create_probe_pool(_probe_concurrency)
+        return _watch_session, _probe_executor
+
+
+def _title_indicates_minecraft(video: YouTubeVideoItemResource):
+    normalized_title = video.snippet.title.lower()
+    return any(indicator in normalized_title for indicator in ["minecraft", "マイクラ"])
+
+
+def _scan_watch_page(chunks: Iterable[bytes]) -> Tuple[bool, int]:
+    """Search a watch page for the Minecraft game block, returning (found, bytes read).
+
+    The block only ever appears inside the ytInitialData script, so reading stops at the
+    marker or at the end of that script, whichever comes first. Pages without the script
+    are read to the end.
+    """
+    # Enough of the previous chunk to catch markers split across chunks
+    overlap = max(map(len, [_GAME_MARKER, _INITIAL_DATA_START, _INITIAL_DATA_END])) - 1
+    tail = b""
+    in_initial_data = False
+    bytes_read = 0
+    for chunk in chunks:
+        bytes_read += len(chunk)
+        window = tail + chunk
+        if _GAME_MARKER in window:
+            return True, bytes_read
+        if not in_initial_data:
+            start = window.find(_INITIAL_DATA_START)
+            if start != -1:
+                in_initial_data = True
+                window = window[start + len(_INITIAL_DATA_START) :]
+        if in_initial_data and _INITIAL_DATA_END in window:
+            return False, bytes_read
+        tail = window[-overlap:]
+    return False, bytes_read
+
+
+def _watch_page_indicates_minecraft(video: YouTubeVideoItemResource):
+    # We try the weird strategy of finding the explicit string "Minecraft" with quotes
     # which matches the a javascript payload on the video page for the meta game info block.
     # This will probably break some day in the distant future.
     #
     # Why would YouTube add this useful metadata to the API? Don't be ridiculous.
-    _total_html_fetches += 1
-    video_page = requests.get(f"https://youtube.com/watch?v={video.id}")
-    return re.search(r"\"simpleText\":\"Minecraft\"", video_page.text) is not None
+    import requests
+
+    session, _ = _get_probe_pool()
+    started = time.perf_counter()
+    try:
+        # Closing a response we stopped reading early drops its connection, which is
+        # still far cheaper than downloading the rest of the page
+        with session.get(
+            f"https://www.youtube.com/watch?v={video.id}", stream=True
+        ) as video_page:
+            # A page we didn't get says nothing about the video, so it mustn't become a
+            # verdict. Failing the probe leaves the video to be probed again.
+            video_page.raise_for_status()
+            found, bytes_read = _scan_watch_page(
+                video_page.iter_content(WATCH_PAGE_CHUNK_BYTES)
+            )
+            # What came over the wire, which differs from bytes_read when it's compressed
+            tell = getattr(video_page.raw, "tell", None)
+            wire_bytes = tell() if tell is not None else bytes_read
+            content_length = video_page.headers.get("Content-Length")
+            # Savings are only known when the server said how long the page is
+            bytes_saved = (
+                max(0, int(content_length) - wire_bytes)
+                if content_length is not None and content_length.isdigit()
+                else 0
+            )
+    except requests.RequestException:
+        run_metrics.record(
+            WATCH_PAGE, latency_seconds=time.perf_counter() - started, error=True
+        )
+        raise
+    run_metrics.record(
+        WATCH_PAGE,
+        num_bytes=wire_bytes,
+        bytes_saved=bytes_saved,
+        latency_seconds=time.perf_counter() - started,
+    )
+    return found
+
+
+def _classify_without_fetching(video: YouTubeVideoItemResource) -> Optional[bool]:
+    # If we see minecraft in the video title we can save some time
+    if _title_indicates_minecraft(video):
+        if _classification_cache is not None:
+            _classification_cache.put(video.id, True, SIGNAL_TITLE)
+        return True
+
+    if _classification_cache is not None:
+        cached = _classification_cache.get(video.id)
+        if cached is not None:
+            return cached.is_minecraft
+    return None
+
+
+def _classify_by_watch_page(video: YouTubeVideoItemResource):
+    is_minecraft = _watch_page_indicates_minecraft(video)
+    if _classification_cache is not None:
+        _classification_cache.put(video.id, is_minecraft, SIGNAL_WATCH_PAGE)
+    return is_minecraft
+
+
+def _classify_in_channel(channel_id: Optional[str], video: YouTubeVideoItemResource):
+    # Probes run on the shared pool, so carry over the channel they're being made for
+    with channel_context(channel_id):
+        return _classify_by_watch_page(video)
+
+
+def is_minecraft_video(video: YouTubeVideoItemResource):
+    verdict = _classify_without_fetching(video)
+    if verdict is not None:
+        return verdict
+
+    return _classify_by_watch_page(video)
+
+
+def probe_minecraft_videos(
+    videos: Iterable[YouTubeVideoItemResource],
+) -> Iterator[Tuple[YouTubeVideoItemResource, bool]]:
+    """Classify many videos at once, yielding (video, is_minecraft) as verdicts arrive.
+
+    Titles and cached verdicts are checked inline and the rest are probed over the shared
+    watch page pool, so results come back in completion order rather than input order.
+    """
+    _, executor = _get_probe_pool()
+    futures = {}
+    known_verdicts = []
+    for video in videos:
+        verdict = _classify_without_fetching(video)
+        if verdict is not None:
+            known_verdicts.append((video, verdict))
+        else:
+            future = executor.submit(_classify_in_channel, current_channel(), video)
+            futures[future] = video
+
+    yield from known_verdicts
+    for future in as_completed(futures):
+        yield futures[future], future.result()
+
+
+def channel_feed_video_ids(channel_id: str) -> List[str]:
+    """IDs of a channel's latest uploads according to its feed, newest first."""
+    import requests
+
+    session, _ = _get_probe_pool()
+    started = time.perf_counter()
+    try:
+        feed = session.get(_feed_url_template.format(channel_id=channel_id))
+        feed.raise_for_status()
+        video_ids = [
+            element.text or ""
+            for element in ElementTree.fromstring(feed.content).iterfind(_FEED_VIDEO_ID)
+        ]
+    except (requests.RequestException, ElementTree.ParseError):
+        run_metrics.record(
+            FEED, latency_seconds=time.perf_counter() - started, error=True
+        )
+        raise
+    run_metrics.record(
+        FEED,
+        num_bytes=len(feed.content),
+        latency_seconds=time.perf_counter() - started,
+    )
+    return video_ids
+
+
+def _feed_in_channel(channel_id: str):
+    with channel_context(channel_id):
+        return channel_feed_video_ids(channel_id)
+
+
+def channel_feeds(channel_ids: Iterable[str]) -> Dict[str, Optional[List[str]]]:
+    """Channel ID -> Latest upload IDs from each channel's feed, fetched concurrently.
+
+    Channels whose feed couldn't be fetched or parsed map to None.
+    """
+    import requests
+
+    _, executor = _get_probe_pool()
+    futures = {
+        channel_id: executor.submit(_feed_in_channel, channel_id)
+        for channel_id in channel_ids
+    }
+    feeds: Dict[str, Optional[List[str]]] = {}
+    for channel_id, future in futures.items():
+        try:
+            feeds[channel_id] = future.result()
+        except (requests.RequestException, ElementTree.ParseError) as e:
+            print(f"Failed to fetch the feed for {channel_id}:", e)
+            feeds[channel_id] = None
+    return feeds
 
 
-def get_quota_usage():
-    return _total_quota_usage
+def set_feed_url_template(template: str):
+    global _feed_url_template
+    _feed_url_template = template
 
 
-def get_html_fetches():
-    return _total_html_fetches
+def set_classification_cache(cache: Optional[ClassificationCache]):
+    global _classification_cache
+    _classification_cache = cache